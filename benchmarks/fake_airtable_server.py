@@ -0,0 +1,161 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+class FakeAirtableServer:
+    """
+    Class that runs a local stand-in for the Airtable API, for benchmarks and tests.
+    It keeps the tables in memory, answers the meta and records endpoints used by the ETL
+    and can add latency and random 429 responses to each request.
+    """
+    def __init__(self, latency:float=0.0, rate_429:float=0.0, seed:int=42):
+        """
+        Args:
+            - latency: seconds added to each response (default is 0)
+            - rate_429: fraction of the record requests answered with 429 (default is 0)
+            - seed: seed of the random 429 responses (default is 42)
+        """
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.records = {}
+        self.merge_indexes = {}
+        self.requests = {'GET': 0, 'POST': 0, 'PATCH': 0, '429': 0}
+        self._next_id = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def api_url(self):
+        return f'http://127.0.0.1:{self._server.server_address[1]}/v0'
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server._handle(self, 'GET')
+
+            def do_POST(self):
+                server._handle(self, 'POST')
+
+            def do_PATCH(self):
+                server._handle(self, 'PATCH')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handle(self, handler, method):
+        if self.latency:
+            time.sleep(self.latency)
+
+        url = urlparse(handler.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = json.loads(handler.rfile.read(length) or b'{}') if length else {}
+
+        with self.lock:
+            self.requests[method] += 1
+
+        if parts[1:2] == ['meta']:
+            status, content = self._handle_meta(method, body)
+        else:
+            with self.lock:
+                throttled = self.rate_429 and self.random.random() < self.rate_429
+                if throttled:
+                    self.requests['429'] += 1
+            if throttled:
+                status, content = 429, {'errors': [{'error': 'RATE_LIMIT_REACHED'}]}
+            else:
+                status, content = self._handle_records(method, parts[2], body, parse_qs(url.query))
+
+        data = json.dumps(content).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        if status == 429:
+            handler.send_header('Retry-After', '0')
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _handle_meta(self, method, body):
+        with self.lock:
+            if method == 'POST':
+                self.tables[body['name']] = {'id': f'tbl{len(self.tables)}', 'name': body['name'], 'fields': body.get('fields', [])}
+                self.records.setdefault(body['name'], {})
+                return 200, self.tables[body['name']]
+            return 200, {'tables': list(self.tables.values())}
+
+    def _handle_records(self, method, table_name, body, query):
+        with self.lock:
+            table = self.records.setdefault(table_name, {})
+
+        if method == 'GET':
+            with self.lock:
+                items = list(table.items())
+            offset = int(query.get('offset', ['0'])[0])
+            size = int(query.get('pageSize', ['100'])[0])
+            fields = query.get('fields[]')
+            page = [
+                {'id': record_id, 'fields': {k: v for k, v in record.items() if not fields or k in fields}}
+                for record_id, record in items[offset:offset + size]
+            ]
+            content = {'records': page}
+            if offset + size < len(items):
+                content['offset'] = str(offset + size)
+            return 200, content
+
+        merge_on = body.get('performUpsert', {}).get('fieldsToMergeOn')
+        result = []
+        for record in body.get('records', []):
+            fields = {k: v for k, v in record['fields'].items() if v is not None}
+            record_id = record.get('id')
+            with self.lock:
+                if record_id is None and merge_on:
+                    merge_index = self._merge_index(table_name, table, merge_on)
+                    key = tuple(json.dumps(fields.get(field)) for field in merge_on)
+                    record_id = merge_index.get(key)
+                    if record_id is None:
+                        record_id = self._next_record_id()
+                        merge_index[key] = record_id
+                elif record_id is None:
+                    record_id = self._next_record_id()
+                table.setdefault(record_id, {}).update(fields)
+                result.append({'id': record_id, 'fields': dict(table[record_id])})
+        return 200, {'records': result}
+
+    def _next_record_id(self):
+        self._next_id += 1
+        return f'rec{self._next_id:014d}'
+
+    def _merge_index(self, table_name, table, merge_on):
+        key = (table_name, tuple(merge_on))
+        if key not in self.merge_indexes:
+            self.merge_indexes[key] = {
+                tuple(json.dumps(record.get(field)) for field in merge_on): record_id
+                for record_id, record in table.items()
+            }
+        return self.merge_indexes[key]
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+# Packages that each entry point must not load when it is imported: they are only imported on first use.
+# etl and cli still import pandas and numpy eagerly, since the treatment and the sinks use them at module
+# level, so their cold import includes pandas and it is not checked here.
+LAZY_IMPORTS = {
+    'etl_from_excel.job_config': ('pandas', 'numpy', 'openpyxl', 'requests', 'aiohttp', 'discord'),
+    'etl_from_excel.etl': ('openpyxl', 'requests', 'aiohttp', 'discord'),
+    'etl_from_excel.cli': ('openpyxl', 'requests', 'aiohttp', 'discord'),
+    'etl_from_excel.discord_bot': ('pandas', 'numpy', 'openpyxl', 'requests'),
+    'etl_from_excel.main': ('pandas', 'numpy', 'openpyxl', 'requests'),
+}
+
+def parse_import_time(output:str, module:str) -> list:
+    """
+    Function to read the -X importtime report of the import of one module.
+    The report is written after each import finishes, so the imports done by the module are the lines
+    between the previous top-level import and the line of the module itself.
+
+    Args:
+        - output: stderr of python -X importtime
+        - module: name of the module that was imported
+    Returns:
+        - list of tuples (name, self microseconds, cumulative microseconds, depth)
+    """
+    group = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        depth = len(indent) // 2
+        group.append((name, int(self_us), int(cumulative_us), depth))
+        if depth == 0:
+            if name == module:
+                return group
+            group = []
+    raise ValueError(f'{module} não aparece no relatório do -X importtime')
+
+def measure_import(module:str, runs:int=3) -> dict:
+    """
+    Function to measure the cold import of a module in a new interpreter, keeping the fastest run.
+
+    Args:
+        - module: name of the module
+        - runs: number of interpreters started (default is 3)
+    Returns:
+        - dictionary with the total time, the time of each package and the packages that were imported
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        lines = parse_import_time(result.stderr, module)
+        if best is None or lines[-1][2] < best[-1][2]:
+            best = lines
+
+    packages = {}
+    for name, self_us, _, _ in best:
+        root = name.split('.')[0]
+        packages[root] = packages.get(root, 0) + self_us
+
+    return {
+        'total_ms': best[-1][2] / 1000,
+        'packages_ms': {name: us / 1000 for name, us in sorted(packages.items(), key=lambda item: -item[1])},
+        'imported': sorted(packages),
+    }
+
+def run_import_benchmark(modules:dict=None, runs:int=3, top:int=10) -> dict:
+    """
+    Function to measure the import of each entry point and check that the heavy packages are still lazy.
+
+    Args:
+        - modules: dictionary {module: packages that must not be imported} (default is LAZY_IMPORTS)
+        - runs: number of interpreters started for each module (default is 3)
+        - top: number of slowest packages kept for each module (default is 10)
+    Returns:
+        - dictionary with the results of each module
+    """
+    results = {}
+    for module, lazy in (modules or LAZY_IMPORTS).items():
+        measured = measure_import(module, runs)
+        results[module] = {
+            'total_ms': measured['total_ms'],
+            'slowest_ms': dict(list(measured['packages_ms'].items())[:top]),
+            'eager_imports': [package for package in lazy if package in measured['imported']],
+        }
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the cold import of the bot and ETL modules.')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None, help='fails when the import of some module takes longer')
+    parser.add_argument('--output', default='import_time_results.json', help='JSON file where the results are written')
+    args = parser.parse_args(argv)
+
+    results = run_import_benchmark(runs=args.runs, top=args.top)
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(json.dumps(results, indent=2))
+
+    failed = [
+        module for module, result in results.items()
+        if result['eager_imports'] or (args.max_ms is not None and result['total_ms'] > args.max_ms)
+    ]
+    if failed:
+        print(f"Imports mais lentos que o esperado ou carregando pacotes que deviam ser lazy: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
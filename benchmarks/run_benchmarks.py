@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime, timezone
+import pandas as pd
+from etl_from_excel import treat_data
+from etl_from_excel.airtable_client import AirtableClient
+from etl_from_excel.send_to_airtable import upsert_records_airtable, create_table
+from etl_from_excel.utils.get_dataset_columns import get_dataset_columns_with_types
+from etl_from_excel.utils.rename_to_snake_case import rename_to_snake_case
+from etl_from_excel.utils.serialize_records import serialize_records
+from .fake_airtable_server import FakeAirtableServer
+from .synthetic_workbook import write_synthetic_workbook
+
+def timed(results:dict, name:str, function, *args, **kwargs):
+    """
+    Function to run one stage and save its wall time in the results.
+
+    Args:
+        - results: dictionary where the time (in seconds) is saved under name
+        - name: name of the stage
+        - function: function that runs the stage
+    """
+    started_at = time.perf_counter()
+    value = function(*args, **kwargs)
+    results[name] = time.perf_counter() - started_at
+    return value
+
+def benchmark_treat_data(path:str, config:dict) -> tuple:
+    """
+    Function to time each stage of treat_data_pipeline separately.
+
+    Args:
+        - path: path of the workbook
+        - config: configuration returned by write_synthetic_workbook
+    Returns:
+        - tuple with the dictionary of times and the treated DataFrame
+    """
+    stages = {}
+
+    df = timed(stages, 'read', treat_data.read_data_from_excel, path, sheet_name=config['sheet_name'], header=config['header'])
+    df = timed(stages, 'rename', treat_data.rename_columns_to_snake_case, df)
+
+    def treat_quantity(df):
+        for column in config['quantity_column']:
+            df = treat_data.treat_quantity_column(df, rename_to_snake_case(column))
+        return df
+
+    def treat_date(df):
+        for column in config['date_column']:
+            df = treat_data.treat_date_column(df, rename_to_snake_case(column))
+        return df
+
+    columns_to_hash = [rename_to_snake_case(column) for column in config['columns_to_hash']]
+    columns_to_select = [rename_to_snake_case(column) for column in config['columns_to_select']] + ['column_hash']
+
+    df = timed(stages, 'quantity', treat_quantity, df)
+    df = timed(stages, 'date', treat_date, df)
+    df = timed(stages, 'hash', treat_data.add_hash_column, df, columns_to_hash)
+    df = timed(stages, 'select', treat_data.select_columns, df, columns_to_select)
+
+    return stages, df
+
+def benchmark_upload(df:pd.DataFrame, config:dict, latency:float, rate_429:float, max_workers:int, requests_per_second:float) -> dict:
+    """
+    Function to time the serialization, the batching and the upload of a treated DataFrame
+    against the local fake Airtable server.
+
+    Args:
+        - df: treated pandas DataFrame
+        - config: configuration returned by write_synthetic_workbook
+        - latency: seconds added by the fake server to each response
+        - rate_429: fraction of the requests answered with 429
+        - max_workers: number of batches sent at the same time
+        - requests_per_second: rate limit used by the uploader
+    """
+    stages = {}
+
+    records = timed(stages, 'serialize', serialize_records, df)
+    timed(stages, 'batching', lambda: [records[i:i + 10] for i in range(0, len(records), 10)])
+
+    with FakeAirtableServer(latency=latency, rate_429=rate_429) as server:
+        with AirtableClient('token', 'base', api_url=server.api_url, pool_size=max_workers) as client:
+            create_table(client, get_dataset_columns_with_types(df), 'benchmark')
+            stats = timed(
+                stages,
+                'upload',
+                upsert_records_airtable,
+                client=client,
+                records=records,
+                table_name='benchmark',
+                fields_to_merge_on=config['fields_to_merge_on'],
+                max_workers=max_workers,
+                requests_per_second=requests_per_second
+            )
+        stages['upload_stats'] = stats
+        stages['server_requests'] = dict(server.requests)
+
+    return stages
+
+def run_benchmarks(
+        rows:int=10000,
+        extra_columns:int=0,
+        upload_rows:int=2000,
+        latency:float=0.05,
+        rate_429:float=0.0,
+        max_workers:int=5,
+        requests_per_second:float=50
+        ) -> dict:
+    """
+    Function to run the whole benchmark and return its results.
+
+    Args:
+        - rows: number of rows of the synthetic workbook (default is 10000)
+        - extra_columns: number of extra text columns (default is 0)
+        - upload_rows: number of treated rows sent to the fake server (default is 2000, 0 to skip the upload)
+        - latency: seconds added by the fake server to each response (default is 0.05)
+        - rate_429: fraction of the requests answered with 429 (default is 0)
+        - max_workers: number of batches sent at the same time (default is 5)
+        - requests_per_second: rate limit used by the uploader (default is 50)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'synthetic.xlsx')
+        started_at = time.perf_counter()
+        config = write_synthetic_workbook(path, rows=rows, extra_columns=extra_columns)
+        generate_seconds = time.perf_counter() - started_at
+        file_size = os.path.getsize(path)
+
+        treat_stages, df = benchmark_treat_data(path, config)
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'parameters': {
+            'rows': rows,
+            'extra_columns': extra_columns,
+            'upload_rows': upload_rows,
+            'latency': latency,
+            'rate_429': rate_429,
+            'max_workers': max_workers,
+            'requests_per_second': requests_per_second,
+        },
+        'workbook': {'bytes': file_size, 'generate_seconds': generate_seconds},
+        'treat_data': treat_stages,
+    }
+    results['treat_data']['total'] = sum(treat_stages.values())
+
+    if upload_rows:
+        results['send_to_airtable'] = benchmark_upload(
+            df.head(upload_rows), config, latency, rate_429, max_workers, requests_per_second
+        )
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the treat_data and send_to_airtable hot paths.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--extra-columns', type=int, default=0)
+    parser.add_argument('--upload-rows', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--max-workers', type=int, default=5)
+    parser.add_argument('--requests-per-second', type=float, default=50)
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file where the results are written')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        rows=args.rows,
+        extra_columns=args.extra_columns,
+        upload_rows=args.upload_rows,
+        latency=args.latency,
+        rate_429=args.rate_429,
+        max_workers=args.max_workers,
+        requests_per_second=args.requests_per_second
+    )
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2, default=str)
+
+    print(json.dumps(results, indent=2, default=str))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import random
+from datetime import datetime, timedelta
+import openpyxl
+
+LOCATIONS = ['Loja Centro', 'Loja Norte', 'Loja Sul', 'Depósito', 'Quiosque Shopping']
+PRODUCTS = [f'Produto {i:03d}' for i in range(120)]
+
+BASE_COLUMNS = ['Data/hora', 'Local', 'Produto', 'Quantidade', 'Valor']
+
+def write_synthetic_workbook(path, rows:int=10000, extra_columns:int=0, header_row:int=13, sheet_name:str='Vendas', seed:int=42):
+    """
+    Function to write a workbook shaped like the bot template.
+    The sheet has some title rows before the header, a "dd/mm/YYYY HH:MM:SS" text date column,
+    location and product columns with few distinct values, a "N un" quantity column,
+    a value column and optional extra text columns.
+
+    Args:
+        - path: path of the file to write
+        - rows: number of data rows (default is 10000)
+        - extra_columns: number of extra text columns (default is 0)
+        - header_row: row number of the header, 0-indexed as HEADER_ROW (default is 13)
+        - sheet_name: name of the sheet (default is 'Vendas')
+        - seed: seed of the random values (default is 42)
+    Returns:
+        - dictionary with the configuration to process the workbook
+    """
+    generator = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+
+    sheet.append(['Relatório de vendas'])
+    for _ in range(header_row - 1):
+        sheet.append([])
+
+    extra = [f'Coluna extra {i}' for i in range(extra_columns)]
+    sheet.append(BASE_COLUMNS + extra)
+
+    start = datetime(2024, 1, 1)
+    for i in range(rows):
+        moment = start + timedelta(minutes=i // 7, seconds=generator.randrange(60))
+        sheet.append([
+            moment.strftime('%d/%m/%Y %H:%M:%S'),
+            generator.choice(LOCATIONS),
+            generator.choice(PRODUCTS),
+            f'{generator.randint(1, 50)} un',
+            round(generator.uniform(1, 500), 2),
+        ] + [f'texto {generator.randrange(1000)}' for _ in extra])
+
+    workbook.save(path)
+
+    return {
+        'sheet_name': sheet_name,
+        'header': header_row,
+        'quantity_column': ['Quantidade'],
+        'date_column': ['Data/hora'],
+        'columns_to_select': BASE_COLUMNS,
+        'columns_to_hash': ['Data/hora', 'Local', 'Produto'],
+        'fields_to_merge_on': ['column_hash'],
+    }
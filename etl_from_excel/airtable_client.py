@@ -0,0 +1,125 @@
+import os
+import json
+import time
+from urllib.parse import quote
+
+DEFAULT_API_URL = 'https://api.airtable.com/v0'
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (5, 60)
+DEFAULT_RETRIES = 3
+
+class AirtableClient:
+    """
+    Class that talks to the Airtable API of one base.
+    It owns a pooled keep-alive session, so the batches reuse the same connections
+    instead of opening a new TCP+TLS connection for each request.
+    """
+    def __init__(
+            self,
+            access_token:str,
+            base_id:str,
+            api_url:str=DEFAULT_API_URL,
+            pool_size:int=DEFAULT_POOL_SIZE,
+            timeout=DEFAULT_TIMEOUT,
+            retries:int=DEFAULT_RETRIES
+            ):
+        """
+        Args:
+            - access_token: personal access token of Airtable
+            - base_id: ID of the Airtable base
+            - api_url: root URL of the API, can point to a local server in tests (default is the Airtable API)
+            - pool_size: maximum number of connections kept open (default is 10)
+            - timeout: connect and read timeout in seconds (default is (5, 60))
+            - retries: number of retries on connection errors and 5xx responses (default is 3)
+        """
+        # requests is only imported with the first client, so importing the config doesn't load it.
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_id = base_id
+        self.report = None
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        })
+
+        # 429 is left to the upload dispatcher, which pauses the shared rate limiter.
+        # urllib3 would otherwise retry it by itself whenever Retry-After is present.
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=['GET', 'PATCH'],
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """
+        Function to create a client with the credentials from the environment variables
+        AIRTABLE_ACCESS_TOKEN and BASE_ID.
+        The pool size can be set with AIRTABLE_POOL_SIZE.
+        """
+        if 'pool_size' not in kwargs and os.getenv('AIRTABLE_POOL_SIZE'):
+            kwargs['pool_size'] = int(os.getenv('AIRTABLE_POOL_SIZE'))
+
+        return cls(
+            access_token=os.getenv('AIRTABLE_ACCESS_TOKEN'),
+            base_id=os.getenv('BASE_ID'),
+            **kwargs
+        )
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Function to create a client with the credentials and the pool size of a JobConfig.
+        """
+        kwargs.setdefault('pool_size', config.pool_size)
+        return cls(access_token=config.access_token, base_id=config.base_id, **kwargs)
+
+    @property
+    def meta_tables_url(self):
+        return f'{self.api_url}/meta/bases/{self.base_id}/tables'
+
+    def table_url(self, table_name:str):
+        return f'{self.api_url}/{self.base_id}/{quote(table_name, safe="")}'
+
+    def get(self, url:str, **kwargs):
+        return self._request('GET', url, **kwargs)
+
+    def post(self, url:str, payload:dict):
+        return self._request('POST', url, data=self._encode(payload))
+
+    def patch(self, url:str, payload:dict):
+        return self._request('PATCH', url, data=self._encode(payload))
+
+    def _request(self, method:str, url:str, **kwargs):
+        started_at = time.perf_counter()
+        response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+
+        if self.report is not None:
+            endpoint = 'meta/tables' if url.startswith(self.meta_tables_url) else 'records'
+            self.report.record_http(f'{method} {endpoint}', time.perf_counter() - started_at, response.status_code)
+
+        return response
+
+    def _encode(self, payload:dict) -> bytes:
+        return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
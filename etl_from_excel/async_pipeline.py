@@ -0,0 +1,366 @@
+import json
+import time
+import asyncio
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from loguru import logger
+from .airtable_client import AirtableClient, DEFAULT_API_URL, DEFAULT_POOL_SIZE, DEFAULT_RETRIES
+from .treat_data import read_data_from_excel_in_chunks, treat_dataset
+from .transform_plan import compile_transform_plan
+from .send_to_airtable import prepare_table, get_retry_after_seconds, DEFAULT_MAX_RETRIES
+from .utils.rename_to_snake_case import rename_to_snake_case
+from .utils.serialize_records import serialize_records
+from .utils.token_bucket import AsyncTokenBucket
+from .run_report import RunReport
+from .job_config import JobConfig
+
+DEFAULT_ASYNC_CHUNK_SIZE = 1000
+DEFAULT_QUEUE_SIZE = 2
+DEFAULT_ASYNC_TIMEOUT = 60
+BATCH_SIZE = 10
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+_DONE = object()
+
+class AsyncResponse:
+    """
+    Class with the parts of an aiohttp response used by the upload, read before the connection
+    goes back to the pool. It has the same attributes as a requests response.
+    """
+    def __init__(self, status_code:int, headers, content:bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+class AsyncAirtableClient:
+    """
+    Class that talks to the Airtable records API of one base from an event loop, with aiohttp.
+    It is the async counterpart of AirtableClient: one pooled session per upload, and connection
+    errors and 5xx responses of PATCH requests are retried with a backoff.
+    """
+    def __init__(
+            self,
+            access_token:str,
+            base_id:str,
+            api_url:str=DEFAULT_API_URL,
+            pool_size:int=DEFAULT_POOL_SIZE,
+            timeout:float=DEFAULT_ASYNC_TIMEOUT,
+            retries:int=DEFAULT_RETRIES
+            ):
+        """
+        Args:
+            - access_token: personal access token of Airtable
+            - base_id: ID of the Airtable base
+            - api_url: root URL of the API, can point to a local server in tests (default is the Airtable API)
+            - pool_size: maximum number of connections kept open (default is 10)
+            - timeout: total timeout of each request in seconds (default is 60)
+            - retries: number of retries on connection errors and 5xx responses (default is 3)
+        """
+        self.base_id = base_id
+        self.report = None
+        self.api_url = api_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.headers = {
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        }
+        self.session = None
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Function to create a client with the credentials and the pool size of a JobConfig.
+        """
+        kwargs.setdefault('pool_size', config.pool_size)
+        return cls(access_token=config.access_token, base_id=config.base_id, **kwargs)
+
+    def table_url(self, table_name:str):
+        return f'{self.api_url}/{self.base_id}/{quote(table_name, safe="")}'
+
+    async def post(self, url:str, payload:dict):
+        return await self._request('POST', url, payload)
+
+    async def patch(self, url:str, payload:dict):
+        return await self._request('PATCH', url, payload)
+
+    async def _request(self, method:str, url:str, payload:dict):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        retries = self.retries if method != 'POST' else 0
+
+        for attempt in range(retries + 1):
+            started_at = time.perf_counter()
+            try:
+                async with self.session.request(method, url, data=data) as response:
+                    result = AsyncResponse(response.status, dict(response.headers), await response.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == retries:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+                continue
+
+            if self.report is not None:
+                self.report.record_http(f'{method} records', time.perf_counter() - started_at, result.status_code)
+
+            if result.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                return result
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+def transform_chunk(chunk, config:JobConfig) -> tuple:
+    """
+    Function that treats one chunk in the executor of the async pipeline.
+
+    Args:
+        - chunk: pandas DataFrame with the rows read from the file
+        - config: JobConfig of the job
+    Returns:
+        - tuple with the treated pandas DataFrame and the RunReport of the chunk
+    """
+    report = RunReport(name='chunk', trace_memory=False)
+    dataset = treat_dataset(
+        chunk,
+        quantity_column=config.quantity_columns,
+        date_column=config.date_columns,
+        columns_to_select=config.columns_to_select,
+        columns_to_hash=config.columns_to_hash,
+        hash_processes=config.hash_processes,
+        quantity_units=config.quantity_units,
+        quantity_decimal=config.quantity_decimal,
+        date_formats=config.date_formats,
+        optimize=config.optimize_dtypes,
+        report=report
+    )
+    return dataset, report
+
+async def send_batch_async(client, payload, table_name, bucket, max_retries=DEFAULT_MAX_RETRIES, method='patch'):
+    """
+    Function to send one batch to Airtable from the event loop, respecting the rate limit.
+    When Airtable answers 429, every request sharing the bucket waits for the Retry-After header
+    (or an exponential backoff) before the batch is sent again.
+
+    Args:
+        - client: AsyncAirtableClient of the base
+        - payload: dictionary with the data to send
+        - table_name: name of the table in Airtable
+        - bucket: AsyncTokenBucket shared by all the requests to the base
+        - max_retries: number of retries after a 429 response
+        - method: 'patch' to upsert records, 'post' to create records (default is 'patch')
+    Returns:
+        - tuple with the last response and the number of 429 responses received
+    """
+    throttled = 0
+    response = None
+
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        if method == 'post':
+            response = await client.post(client.table_url(table_name), payload)
+        else:
+            response = await client.patch(client.table_url(table_name), payload)
+
+        if response.status_code != 429:
+            break
+
+        throttled += 1
+        wait_seconds = get_retry_after_seconds(response, attempt)
+        logger.warning(f"Airtable limitou as requisições (429), tentando de novo em {wait_seconds:.1f}s.")
+        bucket.pause(wait_seconds)
+
+    return response, throttled
+
+async def run_async_pipeline(file_path, config:JobConfig, report:RunReport, executor=None, checkpoint=None) -> dict:
+    """
+    Function that reads, treats, serializes and sends a file to Airtable with all the stages running
+    at the same time, connected by bounded queues: while a chunk is uploaded, the next ones are being
+    serialized, treated and read. The queues hold only a few chunks (and a few batches per upload worker),
+    so a slow stage makes the previous ones wait and the memory used doesn't grow with the file.
+    Reading runs on its own thread, treating and serializing on the executor, and the upload on the
+    event loop, with max_workers requests in flight sharing the same rate limit. The writes to the
+    checkpoint run on another thread, so they don't block the event loop.
+
+    Args:
+        - file_path: path to the Excel file or file-like object
+        - config: JobConfig of the job, the file is read in chunks of chunk_size rows (default is 1000)
+        - report: RunReport where the metrics of each stage are saved
+        - executor: executor where the chunks are treated and serialized, e.g. the pool of the job queue
+          (default is the default executor of the event loop)
+        - checkpoint: UploadCheckpoint where the batches are saved, so the upload can be resumed (default is None)
+    Returns:
+        - dictionary with the upload statistics
+    """
+    loop = asyncio.get_running_loop()
+    fields_to_merge_on = [rename_to_snake_case(field) for field in config.fields_to_merge_on] if config.fields_to_merge_on else None
+    workers = config.max_workers
+
+    raw_chunks = asyncio.Queue(maxsize=DEFAULT_QUEUE_SIZE)
+    treated_chunks = asyncio.Queue(maxsize=DEFAULT_QUEUE_SIZE)
+    batches = asyncio.Queue(maxsize=workers * 2)
+    bucket = AsyncTokenBucket(rate=config.requests_per_second)
+
+    stats = {'requests': 0, 'success': 0, 'error': 0, 'throttled': 0, 'records': 0, 'max_in_flight': 0}
+    in_flight = 0
+    in_flight_total = 0
+    started_at = time.perf_counter()
+    first_record_at = None
+
+    reader = read_data_from_excel_in_chunks(
+        file_path,
+        sheet_name=config.sheet_name,
+        header=config.header_row,
+        chunk_size=config.chunk_size or DEFAULT_ASYNC_CHUNK_SIZE,
+        usecols=compile_transform_plan(
+            config.quantity_columns, config.date_columns, config.columns_to_select, config.columns_to_hash
+        ).usecols()
+    )
+    # The generator of the reader keeps the file open, so it always runs on the same thread.
+    read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='etl-read')
+    # The writes to the SQLite checkpoint block, so they run on their own thread, in the order they were made.
+    checkpoint_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='etl-checkpoint')
+
+    async def read():
+        while True:
+            with report.stage('read') as stage:
+                chunk = await loop.run_in_executor(read_executor, next, reader, None)
+                stage['rows_out'] = len(chunk) if chunk is not None else 0
+            if chunk is None:
+                break
+            await raw_chunks.put(chunk)
+        await raw_chunks.put(_DONE)
+
+    async def transform():
+        while (chunk := await raw_chunks.get()) is not _DONE:
+            dataset, chunk_report = await loop.run_in_executor(executor, transform_chunk, chunk, config)
+            report.merge(chunk_report)
+            await treated_chunks.put(dataset)
+        await treated_chunks.put(_DONE)
+
+    async def serialize():
+        column_hash_exists = None
+        batch_number = 0
+
+        with AirtableClient.from_config(config) as sync_client:
+            sync_client.report = report
+            while (dataset := await treated_chunks.get()) is not _DONE:
+                if column_hash_exists is None:
+                    with report.stage('prepare_table'):
+                        _, column_hash_exists = await loop.run_in_executor(
+                            None, prepare_table, sync_client, dataset, config.table_name, config.primary_field, config.schema_cache_ttl
+                        )
+
+                if not column_hash_exists:
+                    dataset = dataset.drop(columns=['column_hash'], errors='ignore')
+
+                with report.stage('serialize', rows_in=len(dataset)) as stage:
+                    records = await loop.run_in_executor(executor, serialize_records, dataset)
+                    stage['rows_out'] = len(records)
+
+                payloads = []
+                for i in range(0, len(records), BATCH_SIZE):
+                    payload = {}
+                    if fields_to_merge_on:
+                        payload['performUpsert'] = {"fieldsToMergeOn": fields_to_merge_on}
+                    payload['records'] = records[i:i+BATCH_SIZE]
+                    payloads.append(payload)
+
+                if checkpoint:
+                    batch_ids = await loop.run_in_executor(
+                        checkpoint_executor, checkpoint.add_batches, config.table_name, 'patch', payloads
+                    )
+                else:
+                    batch_ids = [None] * len(payloads)
+                for payload, batch_id in zip(payloads, batch_ids):
+                    batch_number += 1
+                    await batches.put((batch_number, payload, batch_id))
+
+        for _ in range(workers):
+            await batches.put(_DONE)
+
+    async def upload(client):
+        nonlocal in_flight, in_flight_total, first_record_at
+
+        while (batch := await batches.get()) is not _DONE:
+            batch_number, payload, batch_id = batch
+
+            in_flight += 1
+            stats['max_in_flight'] = max(stats['max_in_flight'], in_flight)
+            in_flight_total += in_flight
+            try:
+                response, throttled = await send_batch_async(client, payload, config.table_name, bucket)
+            finally:
+                in_flight -= 1
+            success = response is not None and response.status_code == 200
+
+            stats['requests'] += 1
+            stats['throttled'] += throttled
+            if success:
+                stats['success'] += 1
+                stats['records'] += len(payload['records'])
+                if first_record_at is None:
+                    first_record_at = time.perf_counter()
+                logger.info(f"Lote {batch_number} enviado com sucesso.")
+            else:
+                stats['error'] += 1
+                logger.error(f"Erro no lote {batch_number}: {response.content if response is not None else 'sem resposta'}")
+
+            if checkpoint and batch_id is not None:
+                await loop.run_in_executor(
+                    checkpoint_executor, checkpoint.mark, batch_id, success, None if success else str(response.content)
+                )
+
+    try:
+        async with AsyncAirtableClient.from_config(config) as client:
+            client.report = report
+            tasks = [
+                asyncio.create_task(read()),
+                asyncio.create_task(transform()),
+                asyncio.create_task(serialize()),
+                *[asyncio.create_task(upload(client)) for _ in range(workers)]
+            ]
+            try:
+                # The stages overlap, so the pipeline is measured as a whole.
+                with report.stage('pipeline') as stage:
+                    await asyncio.gather(*tasks)
+                    stage['rows_out'] = stats['records']
+            except BaseException:
+                # One stage failed, the others would wait forever on their queues.
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+    finally:
+        # The reader is closed on its own thread, after the chunk it may still be reading, so the
+        # workbook is closed also when a stage failed or the job was cancelled.
+        await loop.run_in_executor(read_executor, reader.close)
+        read_executor.shutdown(wait=False, cancel_futures=True)
+        checkpoint_executor.shutdown(wait=True)
+
+    elapsed = time.perf_counter() - started_at
+    stats['elapsed_seconds'] = elapsed
+    stats['records_per_second'] = stats['records'] / elapsed if elapsed > 0 else 0.0
+    stats['avg_in_flight'] = in_flight_total / stats['requests'] if stats['requests'] else 0.0
+    stats['first_record_seconds'] = first_record_at - started_at if first_record_at is not None else None
+
+    logger.info(
+        f"Total de requisições: {stats['requests']}, Sucesso: {stats['success']}, Erro: {stats['error']}, "
+        f"Throttled (429): {stats['throttled']}, Registros enviados: {stats['records']} "
+        f"em {elapsed:.2f}s ({stats['records_per_second']:.1f} registros/s), "
+        f"Em voo: média {stats['avg_in_flight']:.1f}, máximo {stats['max_in_flight']}"
+    )
+
+    return stats
@@ -0,0 +1,205 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv, dotenv_values
+from loguru import logger
+from .etl import treat_sheet, open_checkpoint
+from .job_config import JobConfig, InvalidConfigError, ALL_SHEETS
+from .run_report import RunReport
+from .send_to_airtable import empty_upload_stats, merge_upload_stats
+from .sinks import Sink, create_sink
+from .treat_data import get_sheet_names
+
+DEFAULT_PATTERN = '*.xlsx'
+
+def collect_files(inputs:list, pattern:str=DEFAULT_PATTERN) -> list:
+    """
+    Function to list the workbooks of the command line.
+    A directory gives its files that match the pattern, a glob gives the files it matches and
+    any other input is used as a path. The lock files that Excel leaves open (~$...) are ignored.
+
+    Args:
+        - inputs: list of directories, globs or paths
+        - pattern: pattern of the files read from the directories (default is *.xlsx)
+    Returns:
+        - sorted list of paths, without repetitions
+    """
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            files.extend(glob.glob(os.path.join(item, pattern)))
+        elif any(character in item for character in '*?['):
+            files.extend(glob.glob(item, recursive=True))
+        else:
+            files.append(item)
+
+    return sorted({path for path in files if not os.path.basename(path).startswith('~$')})
+
+def load_config(path:str=None, environ=None) -> JobConfig:
+    """
+    Function to build the JobConfig of the run from a config file with one KEY=VALUE per line,
+    the same variables accepted by the bot. The variables of the file take precedence over the environment.
+
+    Args:
+        - path: path to the config file (default is only the environment variables)
+        - environ: mapping with the default values (default is os.environ)
+    Raises:
+        - InvalidConfigError when a variable can't be used or a required one is missing
+    """
+    overrides = {key: value for key, value in dotenv_values(path).items() if value is not None} if path else None
+    return JobConfig.from_env(overrides, environ=environ).validate()
+
+def run_files(files:list, config:JobConfig, report:RunReport, sink:Sink, workers:int=None) -> tuple:
+    """
+    Function that treats several workbooks in parallel on a process pool and writes each one to the sink
+    as soon as it is ready, while the other files are still being treated. All the files share the sink,
+    and so the same rate limit. With SHEET_NAME listing several sheets, each sheet of each file is a task.
+
+    Args:
+        - files: list of paths to the workbooks
+        - config: JobConfig of the run
+        - report: RunReport where the metrics of all the files are saved
+        - sink: Sink where the files are written
+        - workers: number of processes used to treat the files (default is SHEET_PROCESSES or the number of CPUs)
+    Returns:
+        - tuple with the upload statistics of all the files and a dictionary with the status of each task
+    """
+    statuses = {}
+    tasks = []
+    for path in files:
+        if not config.sheet_names:
+            tasks.append((path, config.sheet_name, path))
+            continue
+        try:
+            sheets = get_sheet_names(path) if config.sheet_names == (ALL_SHEETS,) else list(config.sheet_names)
+        except Exception as e:
+            statuses[path] = {'status': 'error', 'error': str(e)}
+            continue
+        tasks.extend((path, sheet, f'{path} [{sheet}]') for sheet in sheets)
+
+    total = empty_upload_stats()
+    if not tasks:
+        return total, statuses
+
+    workers = min(len(tasks), workers or config.sheet_processes or os.cpu_count() or 1)
+    logger.info(f'Tratando {len(tasks)} planilhas em {workers} processos.')
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(treat_sheet, path, sheet, config): (sheet, label) for path, sheet, label in tasks}
+
+        for future in as_completed(futures):
+            sheet, label = futures[future]
+            table_name = config.table_for_sheet(sheet) if config.sheet_names else config.table_name
+            try:
+                df, task_report = future.result()
+                report.merge(task_report)
+                stats = sink.write(df, table_name)
+            except Exception as e:
+                logger.error(f'Erro ao processar {label}: {e}')
+                statuses[label] = {'status': 'error', 'error': str(e)}
+                continue
+
+            total = merge_upload_stats(total, stats)
+            statuses[label] = {
+                'status': 'ok',
+                'table': table_name,
+                'rows': len(df),
+                'records': stats['records'],
+                'errors': stats['error'],
+                'treat_seconds': sum(stage['wall_seconds'] for stage in task_report.stages.values()),
+                'upload_seconds': stats['elapsed_seconds'],
+            }
+
+    return total, statuses
+
+def format_summary(statuses:dict, total:dict, elapsed:float) -> str:
+    """
+    Function to build the summary printed at the end of the run: the throughput of the whole run
+    and the status of each file.
+
+    Args:
+        - statuses: dictionary with the status of each task, see run_files
+        - total: dictionary with the upload statistics of all the files
+        - elapsed: wall time of the run in seconds
+    """
+    done = [status for status in statuses.values() if status['status'] == 'ok']
+    rows = sum(status['rows'] for status in done)
+    lines = [
+        f"Arquivos: {len(done)} ok, {len(statuses) - len(done)} com erro, em {elapsed:.1f}s",
+        f"Linhas tratadas: {rows} ({rows / elapsed if elapsed > 0 else 0.0:.1f} linhas/s)",
+        f"Registros gravados: {total['records']} ({total['records'] / elapsed if elapsed > 0 else 0.0:.1f} registros/s), "
+        f"{total['error']} lotes com erro",
+    ]
+
+    for label, status in sorted(statuses.items()):
+        if status['status'] == 'ok':
+            lines.append(
+                f"- {label}: ok, {status['rows']} linhas para {status['table']}, "
+                f"tratado em {status['treat_seconds']:.1f}s, gravado em {status['upload_seconds']:.1f}s"
+                + (f", {status['errors']} lotes com erro" if status['errors'] else '')
+            )
+        else:
+            lines.append(f"- {label}: erro: {status['error']}")
+
+    return '\n'.join(lines)
+
+def main(argv=None) -> int:
+    """
+    Function that runs the ETL of many workbooks from the command line, without the Discord bot.
+
+    Args:
+        - argv: list of arguments (default is sys.argv)
+    Returns:
+        - exit code: 0 when every file was processed, 1 when some failed and 2 when the run couldn't start
+    """
+    parser = argparse.ArgumentParser(
+        prog='etl-from-excel',
+        description='Trata e envia várias planilhas de uma vez, com a mesma configuração do bot.'
+    )
+    parser.add_argument('inputs', nargs='+', help='pastas, globs (ex.: "dados/**/*.xlsx") ou arquivos')
+    parser.add_argument('--config', help='arquivo com uma variável KEY=VALUE por linha, como na mensagem do bot')
+    parser.add_argument('--workers', type=int, help='número de processos que tratam as planilhas (padrão: SHEET_PROCESSES ou o número de CPUs)')
+    parser.add_argument('--pattern', default=DEFAULT_PATTERN, help='arquivos lidos das pastas (padrão *.xlsx)')
+    parser.add_argument('--report', help='arquivo JSON onde o relatório da execução é gravado')
+    args = parser.parse_args(argv)
+
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers precisa ser pelo menos 1')
+
+    load_dotenv()
+    try:
+        config = load_config(args.config)
+    except InvalidConfigError as e:
+        print(f'Configuração inválida: {e}', file=sys.stderr)
+        return 2
+
+    files = collect_files(args.inputs, args.pattern)
+    if not files:
+        print('Nenhuma planilha encontrada.', file=sys.stderr)
+        return 2
+
+    started_at = time.perf_counter()
+    report = RunReport(name=f'{len(files)} arquivos', trace_memory=config.trace_memory)
+
+    with report, open_checkpoint(config, report) as checkpoint, create_sink(config, report, checkpoint) as sink:
+        total, statuses = run_files(files, config, report, sink, args.workers)
+
+    report.add_details('upload', total)
+    report.add_details('files', statuses)
+    report.log()
+
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(report.to_dict(), file, indent=2, default=str)
+
+    print(format_summary(statuses, total, time.perf_counter() - started_at))
+    print(report.summary())
+
+    return 0 if all(status['status'] == 'ok' for status in statuses.values()) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,21 +1,94 @@
 import os
 import asyncio
+import tempfile
 import traceback
+import importlib
 import discord
 from loguru import logger
-from .etl import main as etl_main
+from .job_config import JobConfig, InvalidConfigError
+from .job_queue import Job, JobQueue, QueueFullError, DEFAULT_WORKERS, DEFAULT_MAX_PENDING
+from .upload_checkpoint import list_checkpoints
 
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
 
+DEFAULT_MAX_MEMORY_FILE_MB = 50
+
+async def read_attachment(attachment, max_memory_size:int):
+    """
+    Function to read an attachment into a buffer, without saving it to a fixed path.
+    The buffer stays in memory up to max_memory_size bytes, and above that it is moved to an
+    anonymous temporary file that is deleted as soon as the buffer is closed.
+
+    Args:
+        - attachment (discord.Attachment): The attachment to read.
+        - max_memory_size (int): Maximum size in bytes kept in memory.
+    Returns:
+        - SpooledTemporaryFile positioned at the start of the file
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+    try:
+        await attachment.save(buffer, seek_begin=True)
+    except Exception:
+        buffer.close()
+        raise
+    return buffer
+
+async def load_etl():
+    """
+    Function to import the ETL module (pandas, openpyxl, requests) when the first job runs.
+    The import happens in a thread, so the bot connects to Discord without waiting for it and
+    the loop isn't blocked; the next jobs get the module already imported.
+
+    Returns:
+        - the etl module
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, importlib.import_module, '.etl', __package__)
+
+def read_message_variables(content:str) -> dict:
+    """
+    Function to read the variables sent in a message in the format KEY=VALUE, one per line.
+
+    Args:
+        - content (str): The content of the message.
+    """
+    env = {}
+    if content:
+        for line in content.strip().split("\n"):
+            if '=' in line:
+                key, value = line.split("=", 1)
+                env[key] = value.strip()
+    return env
+
 class MyClient(discord.Client):
     """
     Class that represents the Discord bot.
-    It will handle the messages and process the attachments.
+    It will handle the messages and put the attachments in the job queue, that processes them in the background.
     """
     def __init__(self):
         super().__init__(intents=intents)
+        self.job_queue = JobQueue(
+            handler=self.process_job,
+            workers=int(os.getenv('BOT_WORKERS') if os.getenv('BOT_WORKERS') else DEFAULT_WORKERS),
+            executor=os.getenv('BOT_EXECUTOR') if os.getenv('BOT_EXECUTOR') else 'thread',
+            max_pending=int(os.getenv('BOT_QUEUE_SIZE') if os.getenv('BOT_QUEUE_SIZE') else DEFAULT_MAX_PENDING)
+        )
+        self.max_memory_file_size = int(
+            float(os.getenv('BOT_MAX_MEMORY_FILE_MB') if os.getenv('BOT_MAX_MEMORY_FILE_MB') else DEFAULT_MAX_MEMORY_FILE_MB) * 1024 ** 2
+        )
+
+    async def setup_hook(self):
+        """
+        Function that is called by discord.py before the bot connects.
+        It starts the workers of the job queue.
+        """
+        await self.job_queue.start()
+
+    async def close(self):
+        await self.job_queue.stop()
+        await super().close()
 
     async def on_ready(self):
         """
@@ -44,6 +117,15 @@ class MyClient(discord.Client):
         if message.content.lower() == 'ping':
             await message.channel.send('pong')
 
+        if message.content.lower() == 'fila':
+            await self.send_queue_status(message.channel)
+
+        if message.content.lower().split()[:1] == ['cancelar']:
+            await self.cancel_job(message)
+
+        if message.content.lower().split()[:1] == ['retomar']:
+            await self.resume_upload(message)
+
         if message.content.lower() == 'gato':
             await message.channel.send('https://media.giphy.com/media/JIX9t2j0ZTN9S/giphy.gif')
 
@@ -75,7 +157,9 @@ class MyClient(discord.Client):
             "4. Você pode definir variáveis de ambiente no formato: KEY=VALUE na mesma mensagem.\n"
             "5. Para receber um template de variáveis de ambiente, envie a mensagem, mencione o bot e mande 'template'.\n"
             "6. Para verificar o status, você pode usar o comando 'ping'.\n"
-            "7. Se houver algum erro durante o processamento, o bot irá informar."
+            "7. Os arquivos entram em uma fila. Envie 'fila' para ver a fila e 'cancelar <número>' para tirar um arquivo dela.\n"
+            "8. Com UPLOAD_CHECKPOINT=true, um envio interrompido pode continuar de onde parou: envie 'retomar' para ver os envios e 'retomar <id>' para continuar um deles.\n"
+            "9. Se houver algum erro durante o processamento, o bot irá informar."
         )
         await channel.send(help)
 
@@ -115,45 +199,214 @@ class MyClient(discord.Client):
     async def process_attachments(self, message):
         """
         Function that processes the attachments in the message.
-        It will save the enviroment variables and process the xlsx attachments.
+        It will read the variables of the message into a JobConfig and put the xlsx attachments in the job queue.
+        The variables are only used by the jobs of this message, they don't change the environment of the bot.
 
         Args:
             - message (discord.Message): The message that was received.
         """
-        if message.content:
-            for line in message.content.strip().split("\n"):
-                if '=' in line:
-                    key, value = line.split("=", 1)
-                    os.environ[key] = value.strip()
+        attachments = [attachment for attachment in message.attachments if attachment.filename.endswith('.xlsx')]
+        if not attachments:
+            return
+
+        try:
+            config = JobConfig.from_env(read_message_variables(message.content)).validate()
+        except InvalidConfigError as e:
+            await message.channel.send(f'Não consegui entender as variáveis da mensagem: {e} :crying_cat_face:')
+            return
 
-        for attachment in message.attachments:
-            if attachment.filename.endswith('.xlsx'):
-                await self.handle_xlsx_attachment(attachment, message.channel)
+        for attachment in attachments:
+            await self.handle_xlsx_attachment(attachment, message.channel, config)
 
-    async def handle_xlsx_attachment(self, attachment, channel):
+    async def handle_xlsx_attachment(self, attachment, channel, config:JobConfig):
         """
         Function that handles the xlsx attachment.
-        It will save the attachment and process it.
+        It will read the attachment into a buffer and put it in the job queue.
+        The attachment is only downloaded when the queue has a free place.
 
         Args:
             - attachment (discord.Attachment): The attachment to be processed.
             - channel (discord.TextChannel): The channel to send the messages.
+            - config (JobConfig): The configuration of the job.
         """
-        temp_path = f"./temp_{attachment.filename}"
-        await attachment.save(temp_path)
-        logger.info(f'Arquivo {attachment.filename} recebido e salvo em {temp_path}.')
-        await channel.send(f'Arquivo {attachment.filename} recebido! Vou tentar salvar! :sweat_smile:')
+        try:
+            self.job_queue.check_capacity()
+        except QueueFullError as e:
+            await self.send_queue_full(attachment, channel, e)
+            return
+
+        buffer = await read_attachment(attachment, self.max_memory_file_size)
+        logger.info(f'Arquivo {attachment.filename} recebido ({attachment.size} bytes).')
+
+        job = Job(
+            channel_id=channel.id,
+            name=attachment.filename,
+            data={'attachment': attachment, 'channel': channel, 'buffer': buffer, 'config': config}
+        )
 
         try:
-            await asyncio.to_thread(etl_main, temp_path)
+            position = await self.job_queue.submit(job)
+        except QueueFullError as e:
+            # Another attachment took the last place while this one was being downloaded.
+            buffer.close()
+            await self.send_queue_full(attachment, channel, e)
+            return
+
+        await channel.send(
+            f'Arquivo {attachment.filename} recebido! Ele é o número {job.id} e está na posição {position} da fila. :sweat_smile:'
+        )
+
+    async def send_queue_full(self, attachment, channel, error:QueueFullError):
+        """
+        Function that tells the channel that an attachment was not queued because the queue is full.
+
+        Args:
+            - attachment (discord.Attachment): The attachment that was not queued.
+            - channel (discord.TextChannel): The channel to send the message.
+            - error (QueueFullError): The error raised by the queue.
+        """
+        await channel.send(f'Arquivo {attachment.filename} recebido, mas a fila está cheia! Tente de novo daqui a pouco. :scream_cat: ({error})')
+
+    async def process_job(self, job):
+        """
+        Function that is called by the job queue to process one attachment.
+
+        Args:
+            - job (Job): The job with the attachment, the channel, the buffer with the file and the JobConfig.
+        """
+        if 'checkpoint_id' in job.data:
+            await self.process_resume_job(job)
+            return
+
+        attachment = job.data['attachment']
+        channel = job.data['channel']
+        buffer = job.data['buffer']
+
+        await channel.send(f'Começando a processar o arquivo {attachment.filename} (número {job.id})! Vou tentar salvar!')
+
+        try:
+            source = buffer
+            if self.job_queue.executor_kind == 'process':
+                # File objects can't be sent to another process, so the worker gets the bytes.
+                source = buffer.read()
+
+            config = job.data['config']
+            etl = await load_etl()
+            if etl.use_async_pipeline(config):
+                # The async pipeline runs on the loop of the bot, only the treatment of the chunks goes to the pool.
+                report = await etl.main_async(source, config, attachment.filename, executor=self.job_queue.executor)
+            else:
+                report = await self.job_queue.run_in_executor(etl.main, source, config, attachment.filename)
             logger.info(f'Processamento do arquivo {attachment.filename} concluído com sucesso.')
             await channel.send(f'Processamento do arquivo {attachment.filename} concluído com sucesso aqui do meu lado! Sugiro que verifique lá no Airtable agora! :smile_cat:')
+            await channel.send(f"```{report.summary()[:1900]}```")
 
         except Exception as e:
             await self.handle_error(attachment, e, channel)
         
         finally:
-            os.remove(temp_path)
+            buffer.close()
+
+    async def send_queue_status(self, channel):
+        """
+        Function that sends the state of the job queue to the channel.
+
+        Args:
+            - channel (discord.TextChannel): The channel to send the status.
+        """
+        lines = [f"Processando agora: {len(self.job_queue.running)} | Esperando: {self.job_queue.pending}"]
+        for job in self.job_queue.running.values():
+            lines.append(f"- número {job.id}: {job.name} (processando)")
+        for position, job in enumerate(self.job_queue.order(), start=1):
+            lines.append(f"- número {job.id}: {job.name} (posição {position})")
+        await channel.send("\n".join(lines))
+
+    async def cancel_job(self, message):
+        """
+        Function that removes a job that didn't start yet from the queue.
+        Only jobs sent in the same channel can be cancelled.
+
+        Args:
+            - message (discord.Message): The message with 'cancelar <número>'.
+        """
+        try:
+            job_id = int(message.content.split()[1])
+        except (IndexError, ValueError):
+            await message.channel.send("Use 'cancelar <número do arquivo>'.")
+            return
+
+        pending = {job.id: job for job in self.job_queue.order()}
+        if self.job_queue.cancel(job_id, channel_id=message.channel.id):
+            pending[job_id].close()
+            await message.channel.send(f'Arquivo número {job_id} tirado da fila.')
+        elif job_id in self.job_queue.running:
+            await message.channel.send(f'O arquivo número {job_id} já está sendo processado e não pode mais ser cancelado.')
+        else:
+            await message.channel.send(f'Não encontrei o arquivo número {job_id} na fila deste canal.')
+
+    async def resume_upload(self, message):
+        """
+        Function that lists the uploads that can be resumed ('retomar') or puts one of them
+        in the job queue ('retomar <id>'). The variables of the message (e.g. the access token) are used by the job.
+
+        Args:
+            - message (discord.Message): The message with 'retomar' or 'retomar <id>'.
+        """
+        words = message.content.split()
+        checkpoint_dir = os.getenv('CHECKPOINT_DIR')
+
+        if len(words) < 2 or '=' in words[1]:
+            checkpoints = list_checkpoints(checkpoint_dir)
+            if not checkpoints:
+                await message.channel.send('Nenhum envio para retomar. :smile_cat:')
+                return
+            lines = ["Envios que podem ser retomados com 'retomar <id>':"]
+            for checkpoint in checkpoints:
+                lines.append(f"- {checkpoint['id']}: {checkpoint['metadata'].get('name')} ({checkpoint['left']} lotes faltando)")
+            await message.channel.send("\n".join(lines)[:1900])
+            return
+
+        try:
+            config = JobConfig.from_env(read_message_variables(message.content))
+        except InvalidConfigError as e:
+            await message.channel.send(f'Não consegui entender as variáveis da mensagem: {e} :crying_cat_face:')
+            return
+
+        checkpoint_id = words[1]
+        job = Job(
+            channel_id=message.channel.id,
+            name=f'retomar {checkpoint_id}',
+            data={'checkpoint_id': checkpoint_id, 'channel': message.channel, 'config': config}
+        )
+
+        try:
+            position = await self.job_queue.submit(job)
+        except QueueFullError as e:
+            await message.channel.send(f'A fila está cheia! Tente de novo daqui a pouco. :scream_cat: ({e})')
+            return
+
+        await message.channel.send(f'Envio {checkpoint_id} vai ser retomado! Ele é o número {job.id} e está na posição {position} da fila.')
+
+    async def process_resume_job(self, job):
+        """
+        Function that is called by the job queue to send again the batches of an interrupted upload.
+
+        Args:
+            - job (Job): The job with the ID of the upload, the channel and the JobConfig.
+        """
+        channel = job.data['channel']
+        checkpoint_id = job.data['checkpoint_id']
+
+        await channel.send(f'Retomando o envio {checkpoint_id} (número {job.id})!')
+        try:
+            etl = await load_etl()
+            report = await self.job_queue.run_in_executor(etl.resume, checkpoint_id, job.data['config'])
+            await channel.send(f'Envio {checkpoint_id} retomado com sucesso! :smile_cat:')
+            await channel.send(f"```{report.summary()[:1900]}```")
+        except Exception as e:
+            logger.error(f"Erro ao retomar o envio {checkpoint_id}: {e}")
+            logger.debug(traceback.format_exc())
+            await channel.send(f"Deu ruim aqui! :tired_face: \nErro ao retomar o envio {checkpoint_id}: {e}")
 
     async def handle_error(self, attachment, e, channel):
         """
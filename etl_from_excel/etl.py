@@ -1,32 +1,303 @@
+import io
 import os
-from dotenv import load_dotenv
+import asyncio
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import replace
 from loguru import logger
-from .treat_data import treat_data_pipeline
-from .send_to_airtable import send_to_airtable_pipeline
+from .treat_data import treat_data_pipeline, treat_data_pipeline_in_chunks, get_sheet_names
+from .send_to_airtable import empty_upload_stats, merge_upload_stats, resume_upload
+from .utils.prefetch import prefetch
+from .airtable_client import AirtableClient
+from .run_report import RunReport
+from .job_config import JobConfig, ALL_SHEETS
+from .workbook_cache import WorkbookCache
+from .upload_checkpoint import UploadCheckpoint
+from .sinks import Sink, create_sink
 
-load_dotenv()
+def treat_file(source, sheet_name, config:JobConfig, report:RunReport):
+    """
+    Function that treats one sheet of a file with the options of the job.
 
-def main(file_path):
-    SHEET_NAME = os.getenv('SHEET_NAME') if os.getenv('SHEET_NAME') else 0
-    HEADER_ROW = int(os.getenv('HEADER_ROW') if os.getenv('HEADER_ROW') else 0)
-    QUANTITY_COLUMNS = os.getenv('QUANTITY_COLUMNS').split(',') if os.getenv('QUANTITY_COLUMNS') else None
-    DATE_COLUMNS = os.getenv('DATE_COLUMNS').split(',') if os.getenv('DATE_COLUMNS') else None
-    COLUMNS_TO_SELECT = os.getenv('COLUMNS_TO_SELECT').split(',') if os.getenv('COLUMNS_TO_SELECT') else None
-    COLUMNS_TO_HASH = os.getenv('COLUMNS_TO_HASH').split(',') if os.getenv('COLUMNS_TO_HASH') else None
+    Args:
+        - source: path to the Excel file or file-like object
+        - sheet_name: name or index of the sheet
+        - config: JobConfig of the job
+        - report: RunReport where the metrics of each stage are saved
+    Returns:
+        - pandas DataFrame with the treated data
+    """
+    cache = WorkbookCache(config.workbook_cache_dir, config.workbook_cache_max_mb) if config.workbook_cache else None
+    try:
+        return treat_data_pipeline(
+            path=source,
+            sheet_name=sheet_name,
+            header=config.header_row,
+            quantity_column=config.quantity_columns,
+            date_column=config.date_columns,
+            columns_to_select=config.columns_to_select,
+            columns_to_hash=config.columns_to_hash,
+            hash_processes=config.hash_processes,
+            quantity_units=config.quantity_units,
+            quantity_decimal=config.quantity_decimal,
+            date_formats=config.date_formats,
+            optimize=config.optimize_dtypes,
+            engine=config.reader_engine,
+            cache=cache,
+            report=report
+        )
+    finally:
+        if cache:
+            cache.close()
+
+def treat_sheet(source, sheet_name, config:JobConfig) -> tuple:
+    """
+    Function that treats one sheet in a worker process of run_sheets.
+
+    Args:
+        - source: path to the Excel file or bytes with the content of the file
+        - sheet_name: name of the sheet
+        - config: JobConfig of the job
+    Returns:
+        - tuple with the treated pandas DataFrame and the RunReport of the sheet
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    report = RunReport(name=str(sheet_name), trace_memory=False)
+    return treat_file(source, sheet_name, config, report), report
+
+def run_sheets(file_path, config:JobConfig, report:RunReport, sink:Sink) -> dict:
+    """
+    Function that treats several sheets of a file in parallel on a process pool and writes each one
+    to its table as soon as it is ready, while the other sheets are still being treated.
+    The table of each sheet comes from JobConfig.table_for_sheet, so the sheets can go to the same
+    table or each one to its own table. All the uploads share the sink, and so the same rate limit.
+
+    Args:
+        - file_path: path to the Excel file or file-like object
+        - config: JobConfig of the job, with sheet_names
+        - report: RunReport where the metrics of all the sheets are saved
+        - sink: Sink where the sheets are written
+    Returns:
+        - dictionary with the upload statistics of all the sheets
+    """
+    sheets = get_sheet_names(file_path) if config.sheet_names == (ALL_SHEETS,) else list(config.sheet_names)
+
+    source = file_path
+    if hasattr(file_path, 'read'):
+        # File objects can't be sent to another process, so the workers get the bytes.
+        file_path.seek(0)
+        source = file_path.read()
+
+    processes = config.sheet_processes or min(len(sheets), os.cpu_count() or 1)
+    logger.info(f'Tratando {len(sheets)} abas em {processes} processos.')
+
+    total = empty_upload_stats()
+    tables = {}
+    failed = {}
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(treat_sheet, source, sheet, config): sheet for sheet in sheets}
+
+        for future in as_completed(futures):
+            sheet = futures[future]
+            table_name = config.table_for_sheet(sheet)
+            try:
+                df, sheet_report = future.result()
+                report.merge(sheet_report)
+                logger.info(f'Aba {sheet} tratada, enviando para a tabela {table_name}.')
+                stats = sink.write(df, table_name)
+            except Exception as e:
+                logger.error(f'Erro ao processar a aba {sheet}: {e}')
+                failed[str(sheet)] = str(e)
+                continue
+
+            tables[table_name] = merge_upload_stats(tables.get(table_name), stats)
+            total = merge_upload_stats(total, stats)
+
+    report.add_details('tables', tables)
+    if failed:
+        report.add_details('failed_sheets', failed)
+    if len(failed) == len(sheets):
+        raise RuntimeError(f"Nenhuma aba foi processada: {failed}")
+
+    return total
+
+@contextmanager
+def open_checkpoint(config:JobConfig, report:RunReport):
+    """
+    Function to open the UploadCheckpoint of a run when UPLOAD_CHECKPOINT is enabled.
+    The checkpoint is marked as complete when the run ends without errors, and its file is removed
+    when every batch was acknowledged.
+
+    Args:
+        - config: JobConfig of the job
+        - report: RunReport of the run, where the ID of the checkpoint is saved
+    Yields:
+        - UploadCheckpoint, or None when UPLOAD_CHECKPOINT is disabled
+    """
+    if not config.upload_checkpoint:
+        yield None
+        return
+
+    checkpoint = UploadCheckpoint(directory=config.checkpoint_dir)
+    checkpoint.set_metadata(name=report.name, base_id=config.base_id, complete=False)
+    logger.info(f'Envio salvo no checkpoint {checkpoint.id}.')
+
+    try:
+        yield checkpoint
+        # Every batch of the file is in the checkpoint now, so a resume sends everything that is left.
+        checkpoint.set_metadata(complete=True)
+        report.add_details('checkpoint', {'id': checkpoint.id, 'failed': checkpoint.count_failed()})
+    except BaseException:
+        if checkpoint.count_left():
+            logger.warning(f"O envio parou no meio, use 'retomar {checkpoint.id}' para enviar os lotes que faltaram.")
+        raise
+    finally:
+        checkpoint.close(remove_if_done=True)
+
+def use_async_pipeline(config:JobConfig) -> bool:
+    """
+    Function to check if a job runs on the async pipeline. The pipeline sends one sheet with upserts,
+    so the jobs with several sheets, INCREMENTAL_SYNC or PREFETCH_REMOTE keep the threaded pipeline.
+
+    Args:
+        - config: JobConfig of the job
+    """
+    if not config.async_pipeline:
+        return False
+    if config.sheet_names or config.incremental_sync or config.prefetch_remote:
+        logger.warning('ASYNC_PIPELINE não funciona com várias abas, INCREMENTAL_SYNC ou PREFETCH_REMOTE, usando o envio normal.')
+        return False
+    if config.output_sink != 'airtable':
+        logger.warning(f'ASYNC_PIPELINE só envia para o Airtable, gravando em {config.output_sink} com o pipeline normal.')
+        return False
+    return True
+
+def main(file_path, config:JobConfig=None, name:str=None):
+    """
+    Function that runs the ETL of one file: treats the data and writes it to the sink of the job (Airtable by default).
+
+    Args:
+        - file_path: path to the Excel file, file-like object or bytes with the content of the file
+        - config: JobConfig of the job (default is built from the environment variables)
+        - name: name of the file used in the report (default is the name in file_path)
+    Returns:
+        - RunReport with the metrics of the run
+    """
+    config = config or JobConfig.from_env()
+
+    if use_async_pipeline(config):
+        return asyncio.run(main_async(file_path, config, name))
+
+    if isinstance(file_path, bytes):
+        file_path = io.BytesIO(file_path)
 
     logger.info('Starting ETL process...')
+    report = RunReport(name=name or os.path.basename(str(file_path)), trace_memory=config.trace_memory)
+
+    with report, open_checkpoint(config, report) as checkpoint, create_sink(config, report, checkpoint) as sink:
+        if config.sheet_names:
+            stats = run_sheets(file_path, config, report, sink)
+        elif config.chunk_size:
+            chunks = treat_data_pipeline_in_chunks(
+                path=file_path,
+                sheet_name=config.sheet_name,
+                header=config.header_row,
+                quantity_column=config.quantity_columns,
+                date_column=config.date_columns,
+                columns_to_select=config.columns_to_select,
+                columns_to_hash=config.columns_to_hash,
+                chunk_size=config.chunk_size,
+                hash_processes=config.hash_processes,
+                quantity_units=config.quantity_units,
+                quantity_decimal=config.quantity_decimal,
+                date_formats=config.date_formats,
+                optimize=config.optimize_dtypes,
+                report=report
+            )
+            stats = sink.write_chunks(prefetch(chunks))
+        else:
+            df = treat_file(file_path, config.sheet_name, config, report)
+            stats = sink.write(df)
+
+    report.add_details('upload', stats)
+    report.log()
+    return report
+
+async def main_async(file_path, config:JobConfig=None, name:str=None, executor=None):
+    """
+    Function that runs the ETL of one file on the running event loop, with the async pipeline:
+    the chunks are read, treated, serialized and uploaded at the same time.
+
+    Args:
+        - file_path: path to the Excel file, file-like object or bytes with the content of the file
+        - config: JobConfig of the job (default is built from the environment variables)
+        - name: name of the file used in the report (default is the name in file_path)
+        - executor: executor where the chunks are treated, e.g. the pool of the job queue (default is the default executor of the loop)
+    Returns:
+        - RunReport with the metrics of the run
+    """
+    # aiohttp is only loaded by the jobs that use the async pipeline.
+    from .async_pipeline import run_async_pipeline
+
+    config = config or JobConfig.from_env()
+
+    if isinstance(file_path, bytes):
+        file_path = io.BytesIO(file_path)
+
+    logger.info('Starting async ETL process...')
+    report = RunReport(name=name or os.path.basename(str(file_path)), trace_memory=config.trace_memory)
+
+    with report, open_checkpoint(config, report) as checkpoint:
+        stats = await run_async_pipeline(file_path, config, report, executor=executor, checkpoint=checkpoint)
+
+    report.add_details('upload', stats)
+    report.log()
+    return report
+
+def resume(checkpoint_id:str, config:JobConfig=None, name:str=None):
+    """
+    Function that sends again the batches of an upload saved with UPLOAD_CHECKPOINT that were not
+    acknowledged by Airtable, e.g. after a restart of the bot or an outage of Airtable.
+
+    Args:
+        - checkpoint_id: ID of the upload
+        - config: JobConfig with the access token and the limits of the upload (default is built from the environment variables)
+        - name: name used in the report (default is the name of the file of the upload)
+    Returns:
+        - RunReport with the metrics of the run
+    Raises:
+        - FileNotFoundError when there is no upload with this ID
+    """
+    config = config or JobConfig.from_env()
+
+    checkpoint = UploadCheckpoint(checkpoint_id, config.checkpoint_dir, create=False)
+    try:
+        metadata = checkpoint.metadata()
+        report = RunReport(name=name or metadata.get('name', checkpoint_id), trace_memory=config.trace_memory)
+        # The batches go to the base where the upload started, even if another base is configured now.
+        config = replace(config, base_id=metadata.get('base_id') or config.base_id)
+
+        with report, AirtableClient.from_config(config) as client:
+            client.report = report
+            stats = resume_upload(client, checkpoint, config=config, report=report)
 
-    df = treat_data_pipeline(
-        path=file_path,
-        sheet_name=SHEET_NAME,
-        header=HEADER_ROW,
-        quantity_column=QUANTITY_COLUMNS,
-        date_column=DATE_COLUMNS,
-        columns_to_select=COLUMNS_TO_SELECT,
-        columns_to_hash=COLUMNS_TO_HASH
-    )
+        # Batches of an upload that stopped before all of them were saved can't be recovered.
+        report.add_details('checkpoint', {
+            'id': checkpoint.id, 'failed': checkpoint.count_failed(), 'partial': not metadata.get('complete')
+        })
+        checkpoint.set_metadata(complete=True)
+    finally:
+        checkpoint.close(remove_if_done=True)
 
-    send_to_airtable_pipeline(df)
+    report.add_details('upload', stats)
+    report.log()
+    return report
 
 if __name__ == '__main__':
-    main()
+    # Running the module directly processes the files given in the command line, see cli.main.
+    import sys
+    from .cli import main as cli_main
+    sys.exit(cli_main())
@@ -0,0 +1,193 @@
+import os
+from dataclasses import dataclass, fields
+from .airtable_client import DEFAULT_POOL_SIZE
+from .schema_cache import DEFAULT_SCHEMA_TTL_SECONDS
+
+DEFAULT_MAX_WORKERS = 5
+DEFAULT_REQUESTS_PER_SECOND = 5
+
+ALL_SHEETS = '*'
+# Kept here instead of treat_data, so parsing a config doesn't load pandas.
+READER_ENGINES = ('calamine', 'openpyxl')
+OUTPUT_SINKS = ('airtable', 'sqlite', 'parquet', 'csv')
+TRUE_VALUES = ('1', 'true', 'sim')
+FALSE_VALUES = ('', '0', 'false', 'nao', 'não')
+
+class InvalidConfigError(ValueError):
+    """
+    Exception raised when a variable of the job has a value that can't be used.
+    """
+
+@dataclass(frozen=True)
+class JobConfig:
+    """
+    Class with the parsed configuration of one ETL job.
+    It is built once per file (from the .env and the variables sent in the message) and passed
+    explicitly to each step, so two jobs running at the same time never see each other's values.
+    The lists are stored as tuples, so the object can't be changed after it is built.
+    """
+    table_name: str = None
+    primary_field: str = None
+    fields_to_merge_on: tuple = None
+    sheet_name: object = 0
+    sheet_names: tuple = None
+    sheet_processes: int = None
+    header_row: int = 0
+    quantity_columns: tuple = None
+    quantity_units: tuple = None
+    quantity_decimal: str = ','
+    date_columns: tuple = None
+    date_formats: tuple = None
+    columns_to_select: tuple = None
+    columns_to_hash: tuple = None
+    chunk_size: int = None
+    async_pipeline: bool = False
+    reader_engine: str = 'auto'
+    workbook_cache: bool = False
+    workbook_cache_dir: str = None
+    workbook_cache_max_mb: float = None
+    incremental_sync: bool = False
+    prefetch_remote: bool = False
+    output_sink: str = 'airtable'
+    output_dir: str = None
+    access_token: str = None
+    base_id: str = None
+    max_workers: int = DEFAULT_MAX_WORKERS
+    requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND
+    pool_size: int = DEFAULT_POOL_SIZE
+    schema_cache_ttl: float = DEFAULT_SCHEMA_TTL_SECONDS
+    hash_processes: int = 0
+    sync_index_dir: str = None
+    trace_memory: bool = False
+    optimize_dtypes: bool = True
+    upload_checkpoint: bool = False
+    checkpoint_dir: str = None
+
+    def __repr__(self):
+        # The access token must never end up in the logs or in a Discord message.
+        values = ', '.join(
+            f"{field.name}={'***' if field.name == 'access_token' and self.access_token else repr(getattr(self, field.name))}"
+            for field in fields(self)
+        )
+        return f'JobConfig({values})'
+
+    @classmethod
+    def from_env(cls, overrides:dict=None, environ=None):
+        """
+        Function to build the configuration of a job.
+        The values sent with the job take precedence over the environment variables (and the .env).
+
+        Args:
+            - overrides: dictionary with the KEY=VALUE variables sent with the job (default is None)
+            - environ: mapping with the default values (default is os.environ)
+        Returns:
+            - JobConfig with the parsed values
+        Raises:
+            - InvalidConfigError when a value can't be parsed
+        """
+        values = dict(os.environ if environ is None else environ)
+        values.update(overrides or {})
+
+        def text(key):
+            value = values.get(key)
+            return value.strip() if value and value.strip() else None
+
+        def text_list(key):
+            value = text(key)
+            return tuple(value.split(',')) if value else None
+
+        def number(key, cast, default, minimum):
+            value = text(key)
+            if value is None:
+                return default
+            try:
+                parsed = cast(value)
+            except ValueError:
+                raise InvalidConfigError(f"{key} precisa ser um número, mas recebeu '{value}'.")
+            if parsed < minimum:
+                raise InvalidConfigError(f"{key} precisa ser pelo menos {minimum}, mas recebeu '{value}'.")
+            return parsed
+
+        def choice(key, options, default):
+            value = (text(key) or default).lower()
+            if value not in options:
+                raise InvalidConfigError(f"{key} precisa ser um destes valores: {', '.join(options)}, mas recebeu '{value}'.")
+            return value
+
+        def flag(key, default=False):
+            if text(key) is None:
+                return default
+            value = text(key).lower()
+            if value in TRUE_VALUES:
+                return True
+            if value in FALSE_VALUES:
+                return False
+            raise InvalidConfigError(f"{key} precisa ser true ou false, mas recebeu '{value}'.")
+
+        # Several sheets (separated by commas, or * for all of them) are processed in parallel by etl.main.
+        multiple_sheets = bool(text('SHEET_NAME')) and (text('SHEET_NAME') == ALL_SHEETS or ',' in text('SHEET_NAME'))
+
+        return cls(
+            table_name=text('TABLE_NAME'),
+            primary_field=text('PRIMARY_FIELD'),
+            fields_to_merge_on=text_list('FIELDS_TO_MERGE_ON'),
+            sheet_name=text('SHEET_NAME') if text('SHEET_NAME') and not multiple_sheets else 0,
+            sheet_names=text_list('SHEET_NAME') if multiple_sheets else None,
+            sheet_processes=number('SHEET_PROCESSES', int, None, 1),
+            header_row=number('HEADER_ROW', int, 0, 0),
+            quantity_columns=text_list('QUANTITY_COLUMNS'),
+            quantity_units=text_list('QUANTITY_UNITS'),
+            quantity_decimal=choice('QUANTITY_DECIMAL_SEPARATOR', (',', '.'), ','),
+            date_columns=text_list('DATE_COLUMNS'),
+            date_formats=text_list('DATE_FORMATS'),
+            columns_to_select=text_list('COLUMNS_TO_SELECT'),
+            columns_to_hash=text_list('COLUMNS_TO_HASH'),
+            chunk_size=number('CHUNK_SIZE', int, None, 1),
+            async_pipeline=flag('ASYNC_PIPELINE'),
+            reader_engine=choice('READER_ENGINE', ('auto',) + READER_ENGINES, 'auto'),
+            workbook_cache=flag('WORKBOOK_CACHE'),
+            workbook_cache_dir=text('WORKBOOK_CACHE_DIR'),
+            workbook_cache_max_mb=number('WORKBOOK_CACHE_MAX_MB', float, None, 1),
+            incremental_sync=flag('INCREMENTAL_SYNC'),
+            prefetch_remote=flag('PREFETCH_REMOTE'),
+            output_sink=choice('OUTPUT_SINK', OUTPUT_SINKS, 'airtable'),
+            output_dir=text('OUTPUT_DIR'),
+            access_token=text('AIRTABLE_ACCESS_TOKEN'),
+            base_id=text('BASE_ID'),
+            max_workers=number('AIRTABLE_MAX_WORKERS', int, DEFAULT_MAX_WORKERS, 1),
+            requests_per_second=number('AIRTABLE_REQUESTS_PER_SECOND', float, DEFAULT_REQUESTS_PER_SECOND, 0.1),
+            pool_size=number('AIRTABLE_POOL_SIZE', int, DEFAULT_POOL_SIZE, 1),
+            schema_cache_ttl=number('SCHEMA_CACHE_TTL', float, DEFAULT_SCHEMA_TTL_SECONDS, 0),
+            hash_processes=number('HASH_PROCESSES', int, 0, 0),
+            sync_index_dir=text('SYNC_INDEX_DIR'),
+            trace_memory=flag('TRACE_MEMORY'),
+            optimize_dtypes=flag('OPTIMIZE_DTYPES', default=True),
+            upload_checkpoint=flag('UPLOAD_CHECKPOINT'),
+            checkpoint_dir=text('CHECKPOINT_DIR'),
+        )
+
+    def table_for_sheet(self, sheet_name) -> str:
+        """
+        Function to get the table of a sheet: '{sheet}' in TABLE_NAME is replaced by the name of the sheet,
+        so each sheet goes to its own table, otherwise every sheet goes to the same table.
+
+        Args:
+            - sheet_name: name of the sheet
+        """
+        return self.table_name.replace('{sheet}', str(sheet_name))
+
+    def validate(self):
+        """
+        Function to check that the job has everything it needs to send the data to Airtable
+        (or to write it to the local output), before the file is processed.
+
+        Raises:
+            - InvalidConfigError with the missing variables
+        """
+        required = [('TABLE_NAME', self.table_name)]
+        if self.output_sink == 'airtable':
+            required = [('AIRTABLE_ACCESS_TOKEN', self.access_token), ('BASE_ID', self.base_id)] + required
+        missing = [key for key, value in required if not value]
+        if missing:
+            raise InvalidConfigError(f"Faltam as variáveis: {', '.join(missing)}.")
+        return self
@@ -0,0 +1,233 @@
+import io
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from loguru import logger
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 20
+
+class QueueFullError(Exception):
+    """
+    Exception raised when a job is submitted to a queue that has no free place.
+    """
+
+class Job:
+    """
+    Class that represents one file waiting to be processed.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, channel_id, name:str, data:dict=None):
+        """
+        Args:
+            - channel_id: ID of the channel where the job was sent, used for fairness
+            - name: name shown to the users, e.g. the file name
+            - data: anything the handler needs to process the job (default is an empty dictionary)
+        """
+        self.id = next(self._ids)
+        self.channel_id = channel_id
+        self.name = name
+        self.data = data or {}
+        self.status = 'pending'
+
+    def close(self):
+        """
+        Function to close the files kept in the data of the job, e.g. the buffer with the attachment.
+        """
+        for value in self.data.values():
+            if isinstance(value, io.IOBase):
+                value.close()
+
+class JobQueue:
+    """
+    Class that decouples receiving files from processing them.
+    Jobs wait in one queue per channel and a fixed number of workers takes them in round-robin
+    order between the channels, so a burst of uploads in one channel doesn't block the others.
+    The heavy work runs on a thread or process pool with as many workers as the queue.
+    """
+    def __init__(self, handler, workers:int=DEFAULT_WORKERS, executor:str='thread', max_pending:int=DEFAULT_MAX_PENDING):
+        """
+        Args:
+            - handler: async function called with each Job by the workers
+            - workers: number of jobs processed at the same time (default is 2)
+            - executor: 'thread' or 'process', the kind of pool used by run_in_executor (default is 'thread')
+            - max_pending: maximum number of jobs waiting in the queue (default is 20)
+        """
+        if executor not in ('thread', 'process'):
+            raise ValueError("executor must be 'thread' or 'process'")
+
+        self.handler = handler
+        self.workers = workers
+        self.executor_kind = executor
+        self.max_pending = max_pending
+        self.executor = None
+        self.running = {}
+        self._channels = OrderedDict()
+        self._available = asyncio.Condition()
+        self._tasks = []
+        self._unfinished = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def pending(self) -> int:
+        return sum(len(jobs) for jobs in self._channels.values())
+
+    async def start(self):
+        """
+        Function to start the workers. It must be called from the event loop.
+        """
+        if self._tasks:
+            return
+
+        if self.executor_kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='etl-job')
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f'Fila de processamento iniciada com {self.workers} workers ({self.executor_kind}).')
+
+    async def stop(self):
+        """
+        Function to stop the workers and the pool. Jobs still waiting are dropped and their files are closed.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for job in self.order():
+            job.status = 'cancelled'
+            job.close()
+            self._job_done()
+        self._channels.clear()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def submit(self, job:Job) -> int:
+        """
+        Function to put a job in the queue.
+
+        Args:
+            - job: Job to process
+        Returns:
+            - position of the job in the queue (1 is the next one to start)
+        """
+        self.check_capacity()
+
+        async with self._available:
+            self._channels.setdefault(job.channel_id, deque()).append(job)
+            self._unfinished += 1
+            self._idle.clear()
+            self._available.notify()
+
+        return self.position(job.id)
+
+    def check_capacity(self):
+        """
+        Function to check that the queue has a free place, e.g. before downloading the file of a job.
+
+        Raises:
+            - QueueFullError when the queue is full
+        """
+        if self.pending >= self.max_pending:
+            raise QueueFullError(f'A fila já tem {self.pending} arquivos esperando.')
+
+    def order(self) -> list:
+        """
+        Function to list the pending jobs in the order they will start.
+        """
+        queues = [list(jobs) for jobs in self._channels.values()]
+        return [
+            job
+            for round_jobs in itertools.zip_longest(*queues)
+            for job in round_jobs
+            if job is not None
+        ]
+
+    def position(self, job_id:int):
+        """
+        Function to get the position of a pending job (None if it is not waiting).
+
+        Args:
+            - job_id: ID of the job
+        """
+        for position, job in enumerate(self.order(), start=1):
+            if job.id == job_id:
+                return position
+        return None
+
+    def cancel(self, job_id:int, channel_id=None) -> bool:
+        """
+        Function to cancel a job that didn't start yet.
+
+        Args:
+            - job_id: ID of the job
+            - channel_id: if given, only a job sent in this channel can be cancelled
+        Returns:
+            - True if the job was removed from the queue
+        """
+        for current_channel, jobs in self._channels.items():
+            if channel_id is not None and current_channel != channel_id:
+                continue
+            for job in jobs:
+                if job.id == job_id:
+                    jobs.remove(job)
+                    job.status = 'cancelled'
+                    if not jobs:
+                        del self._channels[current_channel]
+                    self._job_done()
+                    return True
+        return False
+
+    async def run_in_executor(self, function, *args):
+        """
+        Function to run the heavy part of a job in the pool of the queue.
+
+        Args:
+            - function: function to run (it must be picklable when the pool is 'process')
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def join(self):
+        """
+        Function to wait until every job submitted so far is finished.
+        """
+        await self._idle.wait()
+
+    def _next_job(self):
+        channel_id, jobs = next(iter(self._channels.items()))
+        job = jobs.popleft()
+        # The channel goes to the end of the line, so the other channels are served before its next job.
+        del self._channels[channel_id]
+        if jobs:
+            self._channels[channel_id] = jobs
+        return job
+
+    def _job_done(self):
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._idle.set()
+
+    async def _worker(self):
+        while True:
+            async with self._available:
+                await self._available.wait_for(lambda: self.pending > 0)
+                job = self._next_job()
+
+            job.status = 'running'
+            self.running[job.id] = job
+            try:
+                await self.handler(job)
+                job.status = 'done'
+            except Exception as e:
+                job.status = 'failed'
+                logger.error(f'Erro no job {job.id} ({job.name}): {e}')
+            finally:
+                del self.running[job.id]
+                self._job_done()
@@ -2,9 +2,14 @@ import os
 from dotenv import load_dotenv
 from .discord_bot import MyClient
 
-load_dotenv()
+def main():
+    """
+    Function that starts the Discord bot with the token of the .env.
+    The ETL is only imported when the first file arrives, see discord_bot.load_etl.
+    """
+    load_dotenv()
+    client = MyClient()
+    client.run(os.getenv('DISCORD_BOT_TOKEN'))
 
-DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
-
-client = MyClient()
-client.run(DISCORD_BOT_TOKEN)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
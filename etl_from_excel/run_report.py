@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from loguru import logger
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# tracemalloc is global to the process, so the reports of the jobs running at the same time share it:
+# it is stopped with the last report that traces memory, and only if a report started it.
+_TRACING_LOCK = threading.Lock()
+_tracing = {'reports': 0, 'started': False, 'stages': []}
+
+def get_peak_rss_mb():
+    """
+    Function to get the peak resident memory of the process, in MB (None where it is not available).
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values:list, fraction:float) -> float:
+    """
+    Function to get a percentile of a list of numbers, interpolating between the closest values.
+
+    Args:
+        - values: sorted list of numbers
+        - fraction: percentile between 0 and 1
+    """
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+class RunReport:
+    """
+    Class that collects the metrics of one ETL run: wall time, CPU time, memory and rows
+    of each stage, and the latency of the HTTP requests to each Airtable endpoint.
+    A stage that runs several times (e.g. once per chunk) is accumulated under the same name.
+    The peak of tracemalloc is shared by the whole process, so alloc_peak_mb is only measured for the
+    stages that don't overlap with another traced stage, of this or of another report running at the same time.
+    """
+    def __init__(self, name:str='etl', trace_memory:bool=None):
+        """
+        Args:
+            - name: name of the run, e.g. the file name
+            - trace_memory: measure the memory allocated by each stage with tracemalloc, which makes
+              the run slower (default is the TRACE_MEMORY environment variable)
+        """
+        if trace_memory is None:
+            trace_memory = os.getenv('TRACE_MEMORY', '').lower() in ('1', 'true', 'sim')
+
+        self.name = name
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.http = {}
+        self.details = {}
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+        # Tracing is started once for the whole run, because stages of a chunked run overlap in different threads.
+        self._tracing = self.trace_memory
+        if self._tracing:
+            with _TRACING_LOCK:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _tracing['started'] = True
+                _tracing['reports'] += 1
+
+    def __getstate__(self):
+        # The report goes back from the worker processes of the job queue, and locks can't be pickled.
+        # The copy doesn't hold the tracing of the process where it was made.
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['_tracing'] = False
+        return state
+
+    def finish(self):
+        """
+        Function to stop tracing the memory when the run is over, if no other report is still tracing
+        and tracemalloc was started by a report. It can be called more than once.
+        """
+        if not self._tracing:
+            return
+        self._tracing = False
+
+        with _TRACING_LOCK:
+            _tracing['reports'] -= 1
+            if not _tracing['reports'] and _tracing['started']:
+                tracemalloc.stop()
+                _tracing['started'] = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.finish()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name:str, rows_in:int=None):
+        """
+        Function to measure a stage. The rows returned by the stage can be saved in the
+        yielded dictionary under 'rows_out'.
+
+        Args:
+            - name: name of the stage
+            - rows_in: number of rows received by the stage (default is None)
+        """
+        metrics = {'rows_in': rows_in, 'rows_out': None}
+
+        traced = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            with _TRACING_LOCK:
+                # The peak is only reset when no other stage is being measured, the other ones would lose theirs.
+                traced = {'overlapped': bool(_tracing['stages'])}
+                for other in _tracing['stages']:
+                    other['overlapped'] = True
+                _tracing['stages'].append(traced)
+                if not traced['overlapped']:
+                    tracemalloc.reset_peak()
+                memory_before = tracemalloc.get_traced_memory()[0]
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield metrics
+        finally:
+            metrics['wall_seconds'] = time.perf_counter() - wall_start
+            metrics['cpu_seconds'] = time.process_time() - cpu_start
+            metrics['peak_rss_mb'] = get_peak_rss_mb()
+
+            if traced is not None:
+                with _TRACING_LOCK:
+                    current, peak = tracemalloc.get_traced_memory()
+                    _tracing['stages'].remove(traced)
+                metrics['alloc_delta_mb'] = (current - memory_before) / 1024 ** 2
+                metrics['alloc_peak_mb'] = None if traced['overlapped'] else (peak - memory_before) / 1024 ** 2
+
+            self._add_stage(name, metrics)
+
+    def _add_stage(self, name:str, metrics:dict, calls:int=1):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = dict(metrics, calls=calls)
+                return
+
+            stage['calls'] += calls
+            for key in ('rows_in', 'rows_out', 'wall_seconds', 'cpu_seconds', 'alloc_delta_mb'):
+                if metrics.get(key) is not None:
+                    stage[key] = (stage.get(key) or 0) + metrics[key]
+            for key in ('peak_rss_mb', 'alloc_peak_mb'):
+                if metrics.get(key) is not None:
+                    stage[key] = max(stage.get(key) or 0, metrics[key])
+
+    def merge(self, other):
+        """
+        Function to add the stages and counters of another report, e.g. one filled in a worker process.
+
+        Args:
+            - other: RunReport to add
+        """
+        for name, stage in other.stages.items():
+            self._add_stage(name, {key: value for key, value in stage.items() if key != 'calls'}, calls=stage['calls'])
+        for name, value in other.details.items():
+            if isinstance(value, dict) and all(isinstance(count, (int, float)) for count in value.values()):
+                for key, count in value.items():
+                    self.add_count(name, key, count)
+            else:
+                self.add_details(name, value)
+
+    def record_http(self, endpoint:str, seconds:float, status_code:int=None):
+        """
+        Function to save the latency of one HTTP request.
+
+        Args:
+            - endpoint: name of the endpoint, e.g. 'PATCH records'
+            - seconds: time until the response was received
+            - status_code: status code of the response (default is None)
+        """
+        with self._lock:
+            entry = self.http.setdefault(endpoint, {'latencies': [], 'status_codes': {}})
+            entry['latencies'].append(seconds)
+            if status_code is not None:
+                entry['status_codes'][status_code] = entry['status_codes'].get(status_code, 0) + 1
+
+    def add_details(self, name:str, value):
+        """
+        Function to save extra information in the report, e.g. the upload statistics.
+
+        Args:
+            - name: name of the information
+            - value: value that can be converted to JSON
+        """
+        with self._lock:
+            self.details[name] = value
+
+    def add_count(self, name:str, key:str, value:int):
+        """
+        Function to add a number to a counter of the details, e.g. the invalid cells of each column.
+        The counters are added up when a stage runs several times.
+
+        Args:
+            - name: name of the information
+            - key: name of the counter inside the information
+            - value: number to add
+        """
+        with self._lock:
+            counters = self.details.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + value
+
+    def to_dict(self) -> dict:
+        """
+        Function to build the structured report of the run.
+        """
+        with self._lock:
+            http = {}
+            for endpoint, entry in self.http.items():
+                latencies = sorted(entry['latencies'])
+                http[endpoint] = {
+                    'count': len(latencies),
+                    'p50_ms': percentile(latencies, 0.5) * 1000,
+                    'p90_ms': percentile(latencies, 0.9) * 1000,
+                    'p99_ms': percentile(latencies, 0.99) * 1000,
+                    'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+                    'status_codes': dict(entry['status_codes']),
+                }
+
+            return {
+                'run': self.name,
+                'wall_seconds': time.perf_counter() - self.started_at,
+                'peak_rss_mb': get_peak_rss_mb(),
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'http': http,
+                'details': dict(self.details),
+            }
+
+    def log(self):
+        """
+        Function to write the report as one JSON log line.
+        """
+        logger.info(f"Relatório da execução: {json.dumps(self.to_dict(), default=str)}")
+
+    def summary(self) -> str:
+        """
+        Function to build a short summary of the report, to be sent in the Discord channel.
+        """
+        report = self.to_dict()
+        lines = [f"Resumo de {report['run']}: {report['wall_seconds']:.1f}s no total"]
+
+        for name, stage in report['stages'].items():
+            rows = f", {stage['rows_out']} linhas" if stage.get('rows_out') is not None else ''
+            lines.append(f"- {name}: {stage['wall_seconds']:.2f}s (CPU {stage['cpu_seconds']:.2f}s){rows}")
+
+        for endpoint, entry in report['http'].items():
+            lines.append(
+                f"- {endpoint}: {entry['count']} requisições, p50 {entry['p50_ms']:.0f}ms, p99 {entry['p99_ms']:.0f}ms"
+            )
+
+        upload = report['details'].get('upload')
+        if upload:
+            lines.append(
+                f"Envio: {upload['records']} registros a {upload['records_per_second']:.1f} registros/s, "
+                f"{upload['error']} lotes com erro"
+            )
+            if upload.get('first_record_seconds') is not None:
+                lines.append(f"Primeiro lote confirmado em {upload['first_record_seconds']:.1f}s")
+
+        failed = report['details'].get('failed_sheets')
+        if failed:
+            lines.append(f"Abas com erro: {', '.join(failed)}")
+
+        checkpoint = report['details'].get('checkpoint')
+        if checkpoint and checkpoint['failed']:
+            lines.append(f"Lotes com erro guardados para reenviar: {checkpoint['failed']} (use 'retomar {checkpoint['id']}')")
+        if checkpoint and checkpoint.get('partial'):
+            lines.append("O envio parou antes de todos os lotes serem salvos, o restante do arquivo precisa ser enviado de novo")
+
+        memory = report['details'].get('memory_mb')
+        if memory:
+            lines.append(f"Memória dos dados: {memory['before']:.1f} MB antes e {memory['after']:.1f} MB depois da otimização")
+
+        invalid = sum(report['details'].get('invalid_quantities', {}).values())
+        if invalid:
+            lines.append(f"Quantidades inválidas (ficaram vazias): {invalid}")
+
+        invalid = sum(report['details'].get('invalid_dates', {}).values())
+        if invalid:
+            lines.append(f"Datas inválidas (ficaram vazias): {invalid}")
+
+        if report['peak_rss_mb'] is not None:
+            lines.append(f"Memória máxima: {report['peak_rss_mb']:.0f} MB")
+
+        return '\n'.join(lines)
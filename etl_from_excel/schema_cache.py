@@ -0,0 +1,69 @@
+import time
+import threading
+from loguru import logger
+
+DEFAULT_SCHEMA_TTL_SECONDS = 300
+
+class TableSchema(dict):
+    """
+    Class with the schema of one table as returned by the meta endpoint, plus the names of
+    its fields in a set, so checking a column of a wide table doesn't scan the fields list.
+    """
+    def __init__(self, table:dict):
+        super().__init__(table)
+        self.field_names = {field.get('name') for field in table.get('fields', [])}
+
+class SchemaCache:
+    """
+    Class that keeps the schema of each Airtable base for some time, indexed by table name.
+    One instance (SCHEMA_CACHE) is shared by all the jobs of the process, so only the first
+    upload to a base (or the first after the schema expires) downloads the list of tables.
+    """
+    def __init__(self):
+        self._bases = {}
+        self._lock = threading.Lock()
+
+    def _key(self, client):
+        return (client.api_url, client.base_id)
+
+    def get_tables(self, client, max_age:float=DEFAULT_SCHEMA_TTL_SECONDS):
+        """
+        Function to get the tables of the base of a client, downloading them when the cached
+        schema is older than max_age.
+
+        Args:
+            - client: AirtableClient of the base
+            - max_age: maximum age of the cached schema in seconds (default is 300, 0 always downloads)
+        Returns:
+            - dictionary {table name: TableSchema}, or None if the request failed
+        """
+        key = self._key(client)
+        with self._lock:
+            cached = self._bases.get(key)
+            if cached and time.monotonic() - cached[0] <= max_age:
+                return cached[1]
+
+            # The lock is kept while downloading, so jobs starting together make a single request.
+            response = client.get(client.meta_tables_url)
+            if response.status_code != 200:
+                logger.error(f"Erro ao buscar tabelas: {response.content}")
+                return None
+
+            tables = {table.get('name'): TableSchema(table) for table in response.json().get('tables', [])}
+            self._bases[key] = (time.monotonic(), tables)
+            return tables
+
+    def invalidate(self, client=None):
+        """
+        Function to forget the cached schema of the base of a client (or of every base).
+
+        Args:
+            - client: AirtableClient of the base (default is None, for every base)
+        """
+        with self._lock:
+            if client is None:
+                self._bases.clear()
+            else:
+                self._bases.pop(self._key(client), None)
+
+SCHEMA_CACHE = SchemaCache()
@@ -1,44 +1,42 @@
-import os
-from dotenv import load_dotenv
-import requests
-import json
+import threading
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import pandas as pd
-import numpy as np
 from loguru import logger
 from .utils.rename_to_snake_case import rename_to_snake_case
 from .utils.get_dataset_columns import get_dataset_columns_with_types
+from .utils.token_bucket import TokenBucket
+from .utils.serialize_records import serialize_records
+from .sync_index import SyncIndex, row_content_hash, row_merge_key
+from .run_report import RunReport
+from .schema_cache import SCHEMA_CACHE, TableSchema, DEFAULT_SCHEMA_TTL_SECONDS
+from .job_config import JobConfig, DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_SECOND
 
-load_dotenv()
+DEFAULT_MAX_RETRIES = 5
+MAX_BACKOFF_SECONDS = 30
 
-AIRTABLE_ACCESS_TOKEN = os.getenv('AIRTABLE_ACCESS_TOKEN')
-BASE_ID = os.getenv('BASE_ID')
-AIRTABLE_URL = f'https://api.airtable.com/v0/{BASE_ID}/'
-AIRTABLE_META_URL = f'https://api.airtable.com/v0/meta/bases/{BASE_ID}/tables'
-
-headers = {
-    'Authorization': f'Bearer {AIRTABLE_ACCESS_TOKEN}',
-    'Content-Type': 'application/json'
-}
-
-def table_exists(table_name):
+def table_exists(client, table_name, max_age=DEFAULT_SCHEMA_TTL_SECONDS):
     """
-    Function to check if a table exists in the Airtable base
-    """
-    response = requests.get(AIRTABLE_META_URL, headers=headers)
+    Function to check if a table exists in the Airtable base.
+    The tables of the base are kept in SCHEMA_CACHE, shared by every job of the process,
+    so the list is only downloaded again after max_age seconds.
 
-    if response.status_code == 200:
-
-        tables = response.json().get('tables', [])
-        logger.info(f"Searching for table... {table_name}")
-        for table in tables:
-            if table.get('name') == table_name:
-                logger.info(f"Tabela encontrada: {table_name}")
-                return table
-        return None
-    else:
-        logger.error(f"Erro ao buscar tabelas: {response.content}")
+    Args:
+        - client: AirtableClient of the base
+        - table_name: name of the table to search
+        - max_age: maximum age of the cached tables in seconds (default is 300, 0 always downloads)
+    """
+    tables = SCHEMA_CACHE.get_tables(client, max_age=max_age)
+    if tables is None:
         return None
 
+    logger.info(f"Searching for table... {table_name}")
+    table = tables.get(table_name)
+    if table is not None:
+        logger.info(f"Tabela encontrada: {table_name}")
+    return table
+
 def verify_column_exists(table, column_name):
     """
     Function to check if a column exists in a table
@@ -47,14 +45,23 @@ def verify_column_exists(table, column_name):
         - table: dictionary with the table information
         - column_name: name of the column to check
     """
+    if isinstance(table, TableSchema):
+        return column_name in table.field_names
+
     for field in table.get('fields', []):
         if field.get('name') == column_name:
             return True
     return False
 
-def create_table(columns, table_name, description=""):
+def create_table(client, columns, table_name, description=""):
     """
     Function to create a table in the Airtable base
+
+    Args:
+        - client: AirtableClient of the base
+        - columns: list of dictionaries with the fields of the table
+        - table_name: name of the table to create
+        - description: description of the table (default is empty)
     """
     payload = {
         "name": rename_to_snake_case(table_name),
@@ -62,19 +69,26 @@ def create_table(columns, table_name, description=""):
         "fields": columns
     }
 
-    response = requests.post(AIRTABLE_META_URL, headers=headers, data=json.dumps(payload))
+    response = client.post(client.meta_tables_url, payload)
 
     if response.status_code == 200:
         logger.success("Tabela criada com sucesso.")
         logger.info(response.json())
+        # The schema of the base changed, the next check downloads it again with the new table.
+        SCHEMA_CACHE.invalidate(client)
     else:
         logger.error(f"Erro ao criar tabela: {response.content}")
 
 def upsert_data_airtable(
+        client,
         dataset:pd.DataFrame,
         table_name:str,
         fields_to_merge_on:list, 
-        batch_size=10
+        batch_size=10,
+        max_workers=DEFAULT_MAX_WORKERS,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        max_retries=DEFAULT_MAX_RETRIES,
+        bucket=None
         ):
     """
     Function to send data to Airtable in batches.
@@ -82,96 +96,620 @@ def upsert_data_airtable(
     It assumes that the dataset has the same columns as the Airtable table.
     The maximum batch size is 10 records.
     The fields_to_merge_on parameter is a list of fields used as the external key for the upsert.
+    Several batches are kept in flight at once, limited by a token bucket shared by all the workers
+    so the requests-per-second limit of the base is respected.
 
     Args:
+        - client: AirtableClient of the base
         - dataset: pandas DataFrame with the data to send
         - fields_to_merge_on: list of fields used as the external key for the upsert
         - table_name: name of the table in Airtable
         - batch_size: number of records to send in each batch (default is 10, maximum is 10)
+        - max_workers: number of batches sent at the same time (default is 5)
+        - requests_per_second: maximum number of requests per second to the base (default is 5)
+        - max_retries: number of times a throttled batch is retried before being counted as an error (default is 5)
+        - bucket: TokenBucket shared with other uploads to the same base (default is a new one)
     Returns:
-        - None
+        - dictionary with the upload statistics
     """
-    all_requests = 0
-    success_requests = 0
-    error_requests = 0
+    return upsert_records_airtable(
+        client=client,
+        records=serialize_records(dataset),
+        table_name=table_name,
+        fields_to_merge_on=fields_to_merge_on,
+        batch_size=batch_size,
+        max_workers=max_workers,
+        requests_per_second=requests_per_second,
+        max_retries=max_retries,
+        bucket=bucket
+    )
+
+def upsert_records_airtable(
+        client,
+        records:list,
+        table_name:str,
+        fields_to_merge_on:list,
+        batch_size=10,
+        max_workers=DEFAULT_MAX_WORKERS,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        max_retries=DEFAULT_MAX_RETRIES,
+        bucket=None,
+        on_batch_done=None,
+        method='patch',
+        checkpoint=None
+        ):
+    """
+    Function to send records already serialized with serialize_records to Airtable in batches.
+    It is the dispatcher used by upsert_data_airtable.
 
-    dataset = dataset.copy()
+    Args:
+        - client: AirtableClient of the base
+        - records: list of records in the format {"fields": {...}}
+        - table_name: name of the table in Airtable
+        - fields_to_merge_on: list of fields used as the external key for the upsert
+        - batch_size: number of records to send in each batch (default is 10, maximum is 10)
+        - max_workers: number of batches sent at the same time (default is 5)
+        - requests_per_second: maximum number of requests per second to the base (default is 5)
+        - max_retries: number of times a throttled batch is retried before being counted as an error (default is 5)
+        - bucket: TokenBucket shared with other uploads to the same base (default is a new one)
+        - on_batch_done: function called with (start, end, success) after each batch,
+          where start and end are the positions of the batch in records (default is None)
+        - method: 'patch' to upsert or update records with an id, 'post' to create records (default is 'patch')
+        - checkpoint: UploadCheckpoint where the batches are saved before being sent and acknowledged
+          after each response, so the upload can be resumed (default is None)
+    Returns:
+        - dictionary with the upload statistics
+    """
+    if fields_to_merge_on:
+        fields_to_merge_on = [rename_to_snake_case(field) for field in fields_to_merge_on]
+
+    def build_payloads():
+        for i in range(0, len(records), batch_size):
+            payload = {}
+
+            if fields_to_merge_on and method == 'patch':
+                payload['performUpsert'] = {
+                    "fieldsToMergeOn": fields_to_merge_on
+                }
+
+            payload['records'] = records[i:i+batch_size]
+
+            yield i // batch_size + 1, i, payload, None
+
+    batches = build_payloads()
+    if checkpoint:
+        # Every batch is saved before the first one is sent, so a resumed upload knows everything that was left.
+        batches = list(batches)
+        batch_ids = checkpoint.add_batches(table_name, method, [payload for _, _, payload, _ in batches])
+        batches = [(number, start, payload, batch_id) for (number, start, payload, _), batch_id in zip(batches, batch_ids)]
+
+    return send_batches_airtable(
+        client=client,
+        batches=batches,
+        table_name=table_name,
+        max_workers=max_workers,
+        requests_per_second=requests_per_second,
+        max_retries=max_retries,
+        bucket=bucket,
+        on_batch_done=on_batch_done,
+        method=method,
+        checkpoint=checkpoint
+    )
+
+def send_batches_airtable(
+        client,
+        batches,
+        table_name:str,
+        max_workers=DEFAULT_MAX_WORKERS,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        max_retries=DEFAULT_MAX_RETRIES,
+        bucket=None,
+        on_batch_done=None,
+        method='patch',
+        checkpoint=None
+        ):
+    """
+    Function to send batches already built to Airtable, keeping several of them in flight.
 
-    dataset = dataset.replace({np.nan: None})
+    Args:
+        - client: AirtableClient of the base
+        - batches: iterable of tuples (batch_number, start, payload, batch_id), where batch_id
+          is the ID of the batch in the checkpoint (or None)
+        - table_name: name of the table in Airtable
+        - max_workers: number of batches sent at the same time (default is 5)
+        - requests_per_second: maximum number of requests per second to the base (default is 5)
+        - max_retries: number of times a throttled batch is retried before being counted as an error (default is 5)
+        - bucket: TokenBucket shared with other uploads to the same base (default is a new one)
+        - on_batch_done: function called with (start, end, success) after each batch (default is None)
+        - method: 'patch' to upsert or update records with an id, 'post' to create records (default is 'patch')
+        - checkpoint: UploadCheckpoint where the result of each batch is saved (default is None)
+    Returns:
+        - dictionary with the upload statistics
+    """
+    if bucket is None:
+        bucket = TokenBucket(rate=requests_per_second)
+
+    stats = {
+        'requests': 0,
+        'success': 0,
+        'error': 0,
+        'throttled': 0,
+        'records': 0,
+        'max_in_flight': 0,
+        'in_flight_samples': 0,
+        'in_flight_total': 0,
+    }
+    stats_lock = threading.Lock()
+    in_flight = 0
+
+    def send_batch(batch_number, start, payload, batch_id):
+        nonlocal in_flight
+
+        with stats_lock:
+            in_flight += 1
+            stats['max_in_flight'] = max(stats['max_in_flight'], in_flight)
+            stats['in_flight_samples'] += 1
+            stats['in_flight_total'] += in_flight
+
+        try:
+            response, throttled = send_batch_with_retry(client, payload, table_name, bucket, max_retries, method)
+        finally:
+            with stats_lock:
+                in_flight -= 1
+
+        success = response is not None and response.status_code == 200
+        content = response.content if response is not None else 'sem resposta'
+
+        with stats_lock:
+            stats['requests'] += 1
+            stats['throttled'] += throttled
+            if success:
+                stats['success'] += 1
+                stats['records'] += len(payload['records'])
+                logger.info(f"Lote {batch_number} enviado com sucesso.")
+            else:
+                stats['error'] += 1
+                logger.error(f"Erro no lote {batch_number}: {content}")
+
+        if checkpoint and batch_id is not None:
+            checkpoint.mark(batch_id, success, None if success else str(content))
+
+        if on_batch_done:
+            on_batch_done(start, start + len(payload['records']), success)
+
+    started_at = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for batch in batches:
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(send_batch, *batch))
+
+        for future in pending:
+            future.result()
+
+    elapsed = time.perf_counter() - started_at
+    stats['elapsed_seconds'] = elapsed
+    stats['records_per_second'] = stats['records'] / elapsed if elapsed > 0 else 0.0
+    stats['avg_in_flight'] = (
+        stats.pop('in_flight_total') / stats['in_flight_samples'] if stats['in_flight_samples'] else 0.0
+    )
+    stats.pop('in_flight_samples')
+
+    logger.info(
+        f"Total de requisições: {stats['requests']}, Sucesso: {stats['success']}, Erro: {stats['error']}, "
+        f"Throttled (429): {stats['throttled']}, Registros enviados: {stats['records']} "
+        f"em {elapsed:.2f}s ({stats['records_per_second']:.1f} registros/s), "
+        f"Em voo: média {stats['avg_in_flight']:.1f}, máximo {stats['max_in_flight']}"
+    )
+
+    return stats
+
+def send_batch_with_retry(client, payload, table_name, bucket, max_retries=DEFAULT_MAX_RETRIES, method='patch'):
+    """
+    Function to send one batch to Airtable respecting the rate limit.
 
-    for column in dataset.select_dtypes(include=['datetime64[ns, UTC]']).columns:
-        dataset[column] = dataset[column].dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    Args:
+        - client: AirtableClient of the base
+        - payload: dictionary with the data to send
+        - table_name: name of the table in Airtable
+        - bucket: TokenBucket shared by all the requests to the base
+        - max_retries: number of retries after a 429 response
+        - method: 'patch' to upsert or update records, 'post' to create records (default is 'patch')
+    Returns:
+        - tuple with the last response and the number of 429 responses received
+    """
+    if method == 'post':
+        return send_request_with_retry(lambda: send_create_request_to_airtable(client, payload, table_name), bucket, max_retries)
+    return send_request_with_retry(lambda: send_upsert_request_to_airtable(client, payload, table_name), bucket, max_retries)
 
-    for i in range(0, len(dataset), batch_size):
-        batch = dataset.iloc[i:i+batch_size]
+def send_request_with_retry(send_request, bucket, max_retries=DEFAULT_MAX_RETRIES):
+    """
+    Function to send a request to Airtable respecting the rate limit.
+    When Airtable answers 429, it waits for the Retry-After header (or an exponential backoff)
+    and tries again instead of giving up on the request.
 
-        records = [
-            {
-                "fields": {column: row[column] for column in dataset.columns}
-            }
-            for _, row in batch.iterrows()
-        ]
+    Args:
+        - send_request: function without arguments that sends the request and returns the response
+        - bucket: TokenBucket shared by all the requests to the base
+        - max_retries: number of retries after a 429 response
+    Returns:
+        - tuple with the last response and the number of 429 responses received
+    """
+    throttled = 0
+    response = None
+
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        response = send_request()
 
-        payload = {}
+        if response.status_code != 429:
+            break
 
-        if fields_to_merge_on:
-            fields_to_merge_on = [rename_to_snake_case(field) for field in fields_to_merge_on]
-            payload['performUpsert'] = {
-                "fieldsToMergeOn": fields_to_merge_on
-            }
+        throttled += 1
+        wait_seconds = get_retry_after_seconds(response, attempt)
+        logger.warning(f"Airtable limitou as requisições (429), tentando de novo em {wait_seconds:.1f}s.")
+        bucket.pause(wait_seconds)
 
-        payload['records'] = records
+    return response, throttled
 
-        response = send_upsert_request_to_airtable(payload, table_name)
+def get_retry_after_seconds(response, attempt):
+    """
+    Function to get how long to wait after a 429 response.
+    It uses the Retry-After header when present and an exponential backoff otherwise.
 
-        if response.status_code == 200:
-            success_requests += 1
-            logger.info(f"Lote {i // batch_size + 1} enviado com sucesso.")
-        else:
-            error_requests += 1
-            logger.error(f"Erro no lote {i // batch_size + 1}: {response.content}")
+    Args:
+        - response: response received from Airtable
+        - attempt: number of the current attempt (0-indexed)
+    """
+    retry_after = response.headers.get('Retry-After') if response.headers else None
+    try:
+        if retry_after is not None:
+            return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    return min(MAX_BACKOFF_SECONDS, 2 ** attempt)
+
+def send_create_request_to_airtable(client, payload, table_name):
+    """
+    Function to send a request to create records in Airtable
 
-        all_requests += 1
+    Args:
+        - client: AirtableClient of the base
+        - payload: dictionary with the records to create
+        - table_name: name of the table in Airtable
+    """
+    response = client.post(client.table_url(table_name), payload)
 
-    logger.info(f"Total de requisições: {all_requests}, Sucesso: {success_requests}, Erro: {error_requests}")
+    return response
 
-def send_upsert_request_to_airtable(payload, table_name):
+def send_upsert_request_to_airtable(client, payload, table_name):
     """
     Function to send an upsert request to Airtable
 
     Args:
+        - client: AirtableClient of the base
         - payload: dictionary with the data to send
         - table_name: name of the table in Airtable
     """
-    response = requests.patch(AIRTABLE_URL + table_name, headers=headers, data=json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+    response = client.patch(client.table_url(table_name), payload)
 
     return response
 
-def send_to_airtable_pipeline(dataframe):
+def prepare_table(client, dataframe, table_name, primary_field=None, schema_max_age=DEFAULT_SCHEMA_TTL_SECONDS):
     """
-    Function to send a dataset to Airtable.
-    It checks if the table exists, creates it if it doesn't, and sends the data.
+    Function to make sure the table exists before sending the data.
+    It creates the table from the dataset columns if it doesn't exist.
+
     Args:
+        - client: AirtableClient of the base
         - dataframe: pandas DataFrame with the data to send
+        - table_name: name of the table in Airtable
+        - primary_field: name of the primary field used if the table is created (default is None)
+        - schema_max_age: maximum age of the cached tables of the base in seconds (default is 300)
+    Returns:
+        - tuple (created, column_hash_exists): whether the table was created now
+          and whether it has the column_hash field
     """
-    PRIMARY_FIELD = os.getenv('PRIMARY_FIELD')
-    FIELDS_TO_MERGE_ON = os.getenv('FIELDS_TO_MERGE_ON').split(',') if os.getenv('FIELDS_TO_MERGE_ON') else None
-    TABLE_NAME = os.getenv('TABLE_NAME')
-
-    table = table_exists(TABLE_NAME)
+    table = table_exists(client, table_name, max_age=schema_max_age)
 
     if not table:
-        columns = get_dataset_columns_with_types(dataset=dataframe, primary_field=PRIMARY_FIELD)
+        columns = get_dataset_columns_with_types(dataset=dataframe, primary_field=primary_field)
         create_table(
+            client=client,
             columns=columns,
-            table_name=TABLE_NAME)
-    else:
-        column_hash_exists = verify_column_exists(table, 'column_hash')
-    
-        if column_hash_exists is False:
-            dataframe = dataframe.drop(columns=['column_hash'])
-
-    upsert_data_airtable(
-        dataset=dataframe,
-        table_name=TABLE_NAME,
-        fields_to_merge_on=FIELDS_TO_MERGE_ON)
+            table_name=table_name)
+        return True, True
+
+    return False, verify_column_exists(table, 'column_hash')
+
+def fetch_existing_records(client, table_name, fields=None, bucket=None, page_size=100):
+    """
+    Function to read the records that already exist in an Airtable table.
+    It pages through the list-records endpoint, asking only for the given fields.
+
+    Args:
+        - client: AirtableClient of the base
+        - table_name: name of the table in Airtable
+        - fields: list of names of the fields to read (default is all the fields)
+        - bucket: TokenBucket shared by all the requests to the base (default is a new one)
+        - page_size: number of records per page (default is 100, maximum is 100)
+    Returns:
+        - list of records in the format {"id": ..., "fields": {...}}, or None if the request failed
+    """
+    if bucket is None:
+        bucket = TokenBucket(rate=DEFAULT_REQUESTS_PER_SECOND)
+
+    params = {'pageSize': page_size}
+    if fields:
+        params['fields[]'] = list(fields)
+
+    records = []
+    while True:
+        response, _ = send_request_with_retry(
+            lambda: client.get(client.table_url(table_name), params=params),
+            bucket
+        )
+
+        if response.status_code != 200:
+            logger.error(f"Erro ao buscar registros da tabela {table_name}: {response.content}")
+            return None
+
+        content = response.json()
+        records.extend(content.get('records', []))
+
+        if not content.get('offset'):
+            break
+        params['offset'] = content['offset']
+
+    logger.info(f"{len(records)} registros encontrados na tabela {table_name}.")
+    return records
+
+def build_remote_index(records, merge_fields=None):
+    """
+    Function to index the records read from Airtable by their merge key.
+
+    Args:
+        - records: list of records returned by fetch_existing_records
+        - merge_fields: list of snake_case names of the fields used to merge (default is None)
+    Returns:
+        - dictionary {merge_key: (record_id, content_hash)}
+    """
+    return {
+        row_merge_key(record.get('fields', {}), merge_fields): (record['id'], row_content_hash(record.get('fields', {})))
+        for record in records
+    }
+
+def empty_upload_stats():
+    """
+    Function to create the statistics of an upload that didn't send anything.
+    """
+    return {
+        'requests': 0,
+        'success': 0,
+        'error': 0,
+        'throttled': 0,
+        'records': 0,
+        'max_in_flight': 0,
+        'avg_in_flight': 0.0,
+        'elapsed_seconds': 0.0,
+        'records_per_second': 0.0,
+    }
+
+def merge_upload_stats(total, stats):
+    """
+    Function to add the statistics of one upload to the statistics of the previous ones.
+
+    Args:
+        - total: dictionary with the accumulated statistics (or None)
+        - stats: dictionary returned by upsert_data_airtable
+    """
+    if total is None:
+        total = empty_upload_stats()
+
+    merged = dict(total)
+    for key in ('requests', 'success', 'error', 'throttled', 'records', 'elapsed_seconds'):
+        merged[key] = total[key] + stats[key]
+    if 'skipped' in stats:
+        merged['skipped'] = total.get('skipped', 0) + stats['skipped']
+    merged['max_in_flight'] = max(total['max_in_flight'], stats['max_in_flight'])
+    if merged['requests']:
+        merged['avg_in_flight'] = (
+            total['avg_in_flight'] * total['requests'] + stats['avg_in_flight'] * stats['requests']
+        ) / merged['requests']
+    merged['records_per_second'] = merged['records'] / merged['elapsed_seconds'] if merged['elapsed_seconds'] > 0 else 0.0
+    return merged
+
+def send_to_airtable_pipeline(client, dataframe, config:JobConfig=None, report=None, bucket:TokenBucket=None, checkpoint=None):
+    """
+    Function to send a dataset to Airtable.
+    It checks if the table exists, creates it if it doesn't, and sends the data.
+    Args:
+        - client: AirtableClient of the base
+        - dataframe: pandas DataFrame with the data to send
+        - config: JobConfig of the job (default is built from the environment variables)
+        - report: RunReport where the metrics of each stage are saved (default is None)
+        - bucket: TokenBucket shared with other uploads to the same base (default is a new one)
+        - checkpoint: UploadCheckpoint where the batches are saved, so the upload can be resumed (default is None)
+    Returns:
+        - dictionary with the upload statistics
+    """
+    return send_chunks_to_airtable_pipeline(client, [dataframe], config=config, report=report, bucket=bucket, checkpoint=checkpoint)
+
+def send_chunks_to_airtable_pipeline(client, chunks, config:JobConfig=None, report=None, bucket:TokenBucket=None, checkpoint=None):
+    """
+    Function to send a dataset that arrives in chunks to Airtable.
+    The table is checked (and created if needed) with the first chunk, and each chunk is
+    uploaded as soon as it arrives, sharing the same rate limit.
+    When incremental_sync is enabled, the rows that didn't change since the last sync
+    to the same table are skipped, using the local SyncIndex.
+    When prefetch_remote is enabled, the records already in the table are read first: new rows
+    are created, changed rows are updated by record id, unchanged rows are skipped and the
+    local SyncIndex (if enabled) is rebuilt from what is really in the table.
+    Args:
+        - client: AirtableClient of the base
+        - chunks: iterable of pandas DataFrames with the data to send
+        - config: JobConfig of the job (default is built from the environment variables)
+        - report: RunReport where the metrics of each stage are saved (default is None)
+        - bucket: TokenBucket shared with other uploads to the same base (default is a new one)
+        - checkpoint: UploadCheckpoint where the batches are saved, so the upload can be resumed (default is None)
+    Returns:
+        - dictionary with the upload statistics of all the chunks
+    """
+    config = config or JobConfig.from_env()
+    PRIMARY_FIELD = config.primary_field
+    FIELDS_TO_MERGE_ON = list(config.fields_to_merge_on) if config.fields_to_merge_on else None
+    TABLE_NAME = config.table_name
+    MAX_WORKERS = config.max_workers
+    REQUESTS_PER_SECOND = config.requests_per_second
+
+    report = report or RunReport()
+    bucket = bucket or TokenBucket(rate=REQUESTS_PER_SECOND)
+    merge_fields = [rename_to_snake_case(field) for field in FIELDS_TO_MERGE_ON] if FIELDS_TO_MERGE_ON else None
+    index = SyncIndex(TABLE_NAME, directory=config.sync_index_dir) if config.incremental_sync else None
+    remote_index = None
+    column_hash_exists = None
+    total = empty_upload_stats()
+    skipped = 0
+
+    def upload(records, positions, merge_keys, content_hashes, fields_to_merge_on, method, record_ids=None):
+        acknowledged = []
+        with report.stage('upload', rows_in=len(records)) as stage:
+            stats = upsert_records_airtable(
+                client=client,
+                records=records,
+                table_name=TABLE_NAME,
+                fields_to_merge_on=fields_to_merge_on,
+                max_workers=MAX_WORKERS,
+                requests_per_second=REQUESTS_PER_SECOND,
+                bucket=bucket,
+                on_batch_done=lambda start, end, success: success and acknowledged.append((start, end)),
+                method=method,
+                checkpoint=checkpoint)
+            stage['rows_out'] = stats['records']
+
+        for start, end in acknowledged:
+            sent = positions[start:end]
+            if index:
+                index.update([merge_keys[i] for i in sent], [content_hashes[i] for i in sent])
+            if record_ids:
+                for i, record_id in zip(sent, record_ids[start:end]):
+                    remote_index[merge_keys[i]] = (record_id, content_hashes[i])
+        return stats
+
+    try:
+        for dataframe in chunks:
+            if column_hash_exists is None:
+                with report.stage('prepare_table'):
+                    created, column_hash_exists = prepare_table(client, dataframe, TABLE_NAME, PRIMARY_FIELD, config.schema_cache_ttl)
+                    if index and created:
+                        index.clear()
+
+                if config.prefetch_remote:
+                    with report.stage('fetch_remote') as stage:
+                        fields = [column for column in dataframe.columns if column_hash_exists or column != 'column_hash']
+                        existing = [] if created else fetch_existing_records(client, TABLE_NAME, fields=fields, bucket=bucket)
+                        if existing is not None:
+                            remote_index = build_remote_index(existing, merge_fields)
+                            if index:
+                                index.replace(list(remote_index), [content for _, content in remote_index.values()])
+                        stage['rows_out'] = len(existing) if existing is not None else None
+
+            if column_hash_exists is False:
+                dataframe = dataframe.drop(columns=['column_hash'], errors='ignore')
+
+            with report.stage('serialize', rows_in=len(dataframe)) as stage:
+                records = serialize_records(dataframe)
+                merge_keys = content_hashes = None
+                if index or remote_index is not None:
+                    merge_keys = [row_merge_key(record['fields'], merge_fields) for record in records]
+                    content_hashes = [row_content_hash(record['fields']) for record in records]
+                stage['rows_out'] = len(records)
+
+            if remote_index is not None:
+                to_create = []
+                to_update = []
+                for i, (key, content) in enumerate(zip(merge_keys, content_hashes)):
+                    existing = remote_index.get(key)
+                    if existing is None:
+                        to_create.append(i)
+                    elif existing[1] != content:
+                        to_update.append(i)
+
+                skipped += len(records) - len(to_create) - len(to_update)
+                logger.info(f"{len(to_create)} linhas novas e {len(to_update)} linhas alteradas para enviar.")
+
+                if to_create:
+                    # New rows still go through performUpsert when possible, so a row repeated in a later chunk is not duplicated.
+                    stats = upload(
+                        [records[i] for i in to_create], to_create, merge_keys, content_hashes,
+                        FIELDS_TO_MERGE_ON, 'patch' if FIELDS_TO_MERGE_ON else 'post')
+                    total = merge_upload_stats(total, stats)
+                if to_update:
+                    record_ids = [remote_index[merge_keys[i]][0] for i in to_update]
+                    stats = upload(
+                        [{'id': record_id, 'fields': records[i]['fields']} for i, record_id in zip(to_update, record_ids)],
+                        to_update, merge_keys, content_hashes, None, 'patch', record_ids)
+                    total = merge_upload_stats(total, stats)
+                continue
+
+            positions = list(range(len(records)))
+            if index:
+                to_send = index.changed(merge_keys, content_hashes)
+                positions = [i for i, send in enumerate(to_send) if send]
+                skipped += len(records) - len(positions)
+
+            stats = upload([records[i] for i in positions], positions, merge_keys, content_hashes, FIELDS_TO_MERGE_ON, 'patch')
+            total = merge_upload_stats(total, stats)
+    finally:
+        if index:
+            index.close()
+
+    if index or remote_index is not None:
+        total['skipped'] = skipped
+        logger.info(f"Sincronização incremental: {skipped} linhas sem alteração não foram enviadas.")
+
+    return total
+
+def resume_upload(client, checkpoint, config:JobConfig=None, report=None, bucket:TokenBucket=None):
+    """
+    Function to send again the batches of an upload that were not acknowledged by Airtable:
+    the ones interrupted by a restart or an outage and the ones in the retry queue.
+    The batches are sent as they were saved, so the file is not needed.
+    Args:
+        - client: AirtableClient of the base
+        - checkpoint: UploadCheckpoint of the upload
+        - config: JobConfig with the limits of the upload (default is built from the environment variables)
+        - report: RunReport where the metrics are saved (default is None)
+        - bucket: TokenBucket shared with other uploads to the same base (default is a new one)
+    Returns:
+        - dictionary with the upload statistics of the batches sent again
+    """
+    config = config or JobConfig.from_env()
+    report = report or RunReport()
+    bucket = bucket or TokenBucket(rate=config.requests_per_second)
+    total = empty_upload_stats()
+
+    batches = checkpoint.batches_left()
+    logger.info(f"Retomando o envio {checkpoint.id}: {len(batches)} lotes sem confirmação.")
+
+    # Consecutive batches of the same table and method are sent together, in the order they were saved.
+    for (table_name, method), group in itertools.groupby(batches, key=lambda batch: (batch[1], batch[2])):
+        group = [(number, 0, payload, batch_id) for number, (batch_id, _, _, payload) in enumerate(group, start=1)]
+        with report.stage('upload', rows_in=sum(len(payload['records']) for _, _, payload, _ in group)) as stage:
+            stats = send_batches_airtable(
+                client=client,
+                batches=group,
+                table_name=table_name,
+                max_workers=config.max_workers,
+                requests_per_second=config.requests_per_second,
+                bucket=bucket,
+                method=method,
+                checkpoint=checkpoint)
+            stage['rows_out'] = stats['records']
+        total = merge_upload_stats(total, stats)
+
+    return total
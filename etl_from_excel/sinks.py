@@ -0,0 +1,351 @@
+import os
+import csv
+import time
+import uuid
+import sqlite3
+import importlib.util
+from abc import ABC, abstractmethod
+from dataclasses import replace
+from loguru import logger
+from .airtable_client import AirtableClient
+from .job_config import JobConfig, InvalidConfigError
+from .run_report import RunReport
+from .send_to_airtable import send_to_airtable_pipeline, send_chunks_to_airtable_pipeline, empty_upload_stats, merge_upload_stats
+from .transform_plan import MissingColumnsError
+from .utils.rename_to_snake_case import rename_to_snake_case
+from .utils.serialize_records import serialize_column
+from .utils.token_bucket import TokenBucket
+
+DEFAULT_OUTPUT_DIR = '.output'
+SQLITE_FILE_NAME = 'etl.sqlite'
+PARQUET_ENGINES = ('pyarrow', 'fastparquet')
+
+def quote_identifier(name:str) -> str:
+    """
+    Function to quote the name of a table or column in a SQLite statement.
+
+    Args:
+        - name: name of the table or column
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+def get_sqlite_type(dtype) -> str:
+    """
+    Function to choose the SQLite type of a column from its pandas dtype.
+
+    Args:
+        - dtype: dtype of the column
+    """
+    if str(dtype) == 'bool' or str(dtype).startswith(('int', 'uint', 'Int', 'UInt')):
+        return 'INTEGER'
+    if str(dtype).startswith(('float', 'Float')):
+        return 'REAL'
+    return 'TEXT'
+
+def to_fixed_schema(dataframe):
+    """
+    Function to undo the compact dtypes of a chunk (see optimize_dtypes and parse_quantity), so every
+    chunk of a table is written with the same schema: categoricals and strings become object columns
+    and the integers are stored in 64 bits.
+
+    Args:
+        - dataframe: pandas DataFrame with the treated data
+    Returns:
+        - pandas DataFrame with the fixed dtypes, the same object when nothing had to change
+    """
+    dtypes = {}
+    for column, dtype in dataframe.dtypes.items():
+        if str(dtype) in ('category', 'string') or str(dtype).startswith('string['):
+            dtypes[column] = object
+        elif str(dtype).startswith(('int', 'uint')) and str(dtype) != 'int64':
+            dtypes[column] = 'int64'
+        elif str(dtype).startswith(('Int', 'UInt')) and str(dtype) != 'Int64':
+            dtypes[column] = 'Int64'
+    return dataframe.astype(dtypes) if dtypes else dataframe
+
+class Sink(ABC):
+    """
+    Base class of the outputs where the pipeline writes the treated data.
+    A sink receives the chunks of one table at a time and returns the statistics in the same format
+    as the upload to Airtable, so the report and the summary don't depend on the output.
+    The local sinks only need to implement write_chunk.
+    """
+    def __init__(self, config:JobConfig, report:RunReport=None):
+        """
+        Args:
+            - config: JobConfig of the job
+            - report: RunReport where the metrics of each write are saved (default is a new one)
+        """
+        self.config = config
+        self.report = report or RunReport()
+
+    def write(self, dataframe, table_name:str=None) -> dict:
+        """
+        Function to write a whole dataset.
+
+        Args:
+            - dataframe: pandas DataFrame with the treated data
+            - table_name: name of the output table (default is TABLE_NAME of the job)
+        Returns:
+            - dictionary with the write statistics
+        """
+        return self.write_chunks([dataframe], table_name)
+
+    def write_chunks(self, chunks, table_name:str=None) -> dict:
+        """
+        Function to write a dataset that arrives in chunks, each one as soon as it arrives.
+
+        Args:
+            - chunks: iterable of pandas DataFrames with the treated data
+            - table_name: name of the output table (default is TABLE_NAME of the job)
+        Returns:
+            - dictionary with the write statistics of all the chunks
+        """
+        table_name = table_name or self.config.table_name
+        total = empty_upload_stats()
+
+        for dataframe in chunks:
+            with self.report.stage('write', rows_in=len(dataframe)) as stage:
+                started_at = time.perf_counter()
+                self.write_chunk(dataframe, table_name)
+                stage['rows_out'] = len(dataframe)
+
+            stats = dict(
+                empty_upload_stats(),
+                requests=1,
+                success=1,
+                records=len(dataframe),
+                elapsed_seconds=time.perf_counter() - started_at,
+            )
+            total = merge_upload_stats(total, stats)
+
+        logger.info(f"{total['records']} linhas gravadas na tabela {table_name}.")
+        return total
+
+    @abstractmethod
+    def write_chunk(self, dataframe, table_name:str):
+        """
+        Function to write one chunk of a table.
+
+        Args:
+            - dataframe: pandas DataFrame with the treated data
+            - table_name: name of the output table
+        """
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class AirtableSink(Sink):
+    """
+    Class that sends the data to Airtable with the upload pipeline (upserts, incremental sync,
+    prefetch of the remote records and checkpoints). All the tables of the job share the same
+    client and the same rate limit.
+    """
+    def __init__(self, config:JobConfig, report:RunReport=None, checkpoint=None):
+        """
+        Args:
+            - config: JobConfig of the job
+            - report: RunReport where the metrics of each request are saved (default is a new one)
+            - checkpoint: UploadCheckpoint where the batches are saved, so the upload can be resumed (default is None)
+        """
+        super().__init__(config, report)
+        self.checkpoint = checkpoint
+        self.bucket = TokenBucket(rate=config.requests_per_second)
+        self.client = AirtableClient.from_config(config)
+        self.client.report = self.report
+
+    def _config_for(self, table_name:str) -> JobConfig:
+        return self.config if table_name is None else replace(self.config, table_name=table_name)
+
+    def write(self, dataframe, table_name:str=None) -> dict:
+        return send_to_airtable_pipeline(
+            self.client, dataframe, config=self._config_for(table_name), report=self.report, bucket=self.bucket,
+            checkpoint=self.checkpoint
+        )
+
+    def write_chunks(self, chunks, table_name:str=None) -> dict:
+        return send_chunks_to_airtable_pipeline(
+            self.client, chunks, config=self._config_for(table_name), report=self.report, bucket=self.bucket,
+            checkpoint=self.checkpoint
+        )
+
+    def write_chunk(self, dataframe, table_name:str):
+        self.write(dataframe, table_name)
+
+    def close(self):
+        self.client.close()
+
+class SqliteSink(Sink):
+    """
+    Class that writes the data to a local SQLite database, with one table for each output table.
+    The rows are upserted with executemany on the merge key (FIELDS_TO_MERGE_ON, or column_hash
+    when it is not set), so a file processed again updates its rows instead of duplicating them.
+    Columns that appear in a later run are added to the table.
+    """
+    def __init__(self, config:JobConfig, report:RunReport=None, path:str=None):
+        """
+        Args:
+            - config: JobConfig of the job
+            - report: RunReport where the metrics of each write are saved (default is a new one)
+            - path: path of the database (default is etl.sqlite in OUTPUT_DIR)
+        """
+        super().__init__(config, report)
+        directory = config.output_dir or DEFAULT_OUTPUT_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path or os.path.join(directory, SQLITE_FILE_NAME)
+        self.connection = sqlite3.connect(self.path)
+        self.merge_fields = [rename_to_snake_case(field) for field in config.fields_to_merge_on or ()]
+        self.tables = {}
+
+    def prepare_table(self, table:str, dataframe) -> list:
+        """
+        Function to create the table (and the unique index of the merge key) or add the new columns to it.
+
+        Args:
+            - table: name of the table in the database
+            - dataframe: pandas DataFrame with the data to write
+        Returns:
+            - list with the columns of the merge key, empty when the rows are only inserted
+        """
+        merge_fields = self.merge_fields or (['column_hash'] if 'column_hash' in dataframe.columns else [])
+        missing = [field for field in merge_fields if field not in dataframe.columns]
+        if missing:
+            raise MissingColumnsError(f"As colunas {', '.join(missing)} de FIELDS_TO_MERGE_ON não estão nos dados.")
+
+        existing = self.tables.get(table)
+        if existing is None:
+            existing = {row[1] for row in self.connection.execute(f'PRAGMA table_info({quote_identifier(table)})')}
+
+        with self.connection:
+            if not existing:
+                columns = ', '.join(
+                    f'{quote_identifier(column)} {get_sqlite_type(dtype)}' for column, dtype in dataframe.dtypes.items()
+                )
+                self.connection.execute(f'CREATE TABLE IF NOT EXISTS {quote_identifier(table)} ({columns})')
+            else:
+                for column, dtype in dataframe.dtypes.items():
+                    if column not in existing:
+                        self.connection.execute(
+                            f'ALTER TABLE {quote_identifier(table)} ADD COLUMN {quote_identifier(column)} {get_sqlite_type(dtype)}'
+                        )
+
+            if merge_fields:
+                self.connection.execute(
+                    f'CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(table + "_merge_key")} '
+                    f'ON {quote_identifier(table)} ({", ".join(map(quote_identifier, merge_fields))})'
+                )
+
+        self.tables[table] = existing | set(dataframe.columns)
+        return merge_fields
+
+    def write_chunk(self, dataframe, table_name:str):
+        table = rename_to_snake_case(table_name)
+        merge_fields = self.prepare_table(table, dataframe)
+
+        columns = list(dataframe.columns)
+        statement = (
+            f'INSERT INTO {quote_identifier(table)} ({", ".join(map(quote_identifier, columns))}) '
+            f'VALUES ({", ".join("?" for _ in columns)})'
+        )
+        if merge_fields:
+            updates = [column for column in columns if column not in merge_fields]
+            conflict = f' ON CONFLICT ({", ".join(map(quote_identifier, merge_fields))}) DO '
+            if updates:
+                statement += conflict + 'UPDATE SET ' + ', '.join(
+                    f'{quote_identifier(column)} = excluded.{quote_identifier(column)}' for column in updates
+                )
+            else:
+                statement += conflict + 'NOTHING'
+
+        values = [serialize_column(dataframe[column]) for column in columns]
+        with self.connection:
+            self.connection.executemany(statement, zip(*values))
+
+    def close(self):
+        self.connection.close()
+
+class ParquetSink(Sink):
+    """
+    Class that writes the data to Parquet files, in a folder for each output table inside OUTPUT_DIR.
+    Each chunk becomes one file of the folder, named by the run, so the folder can be read as a
+    single dataset (pd.read_parquet on the folder). The compact dtypes of each chunk are converted
+    first (see to_fixed_schema), so the files of a table share the same schema. Needs pyarrow or fastparquet.
+    """
+    def __init__(self, config:JobConfig, report:RunReport=None):
+        """
+        Args:
+            - config: JobConfig of the job
+            - report: RunReport where the metrics of each write are saved (default is a new one)
+        Raises:
+            - InvalidConfigError when no Parquet engine is installed
+        """
+        super().__init__(config, report)
+        if not any(importlib.util.find_spec(engine) for engine in PARQUET_ENGINES):
+            raise InvalidConfigError('OUTPUT_SINK=parquet precisa do pyarrow, instale com poetry install --extras parquet.')
+
+        self.directory = config.output_dir or DEFAULT_OUTPUT_DIR
+        self.run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.parts = {}
+
+    def write_chunk(self, dataframe, table_name:str):
+        folder = os.path.join(self.directory, rename_to_snake_case(table_name))
+        os.makedirs(folder, exist_ok=True)
+
+        part = self.parts[folder] = self.parts.get(folder, 0) + 1
+        to_fixed_schema(dataframe).to_parquet(os.path.join(folder, f'{self.run_id}-{part:05d}.parquet'), index=False)
+
+class CsvSink(Sink):
+    """
+    Class that writes the data to a CSV file for each output table inside OUTPUT_DIR.
+    The rows are appended to the end of the file, and the header is only written when the file is new.
+    A chunk whose columns are not the ones in the header of the file is refused, so the rows of the
+    file always line up with its header.
+    """
+    def __init__(self, config:JobConfig, report:RunReport=None):
+        """
+        Args:
+            - config: JobConfig of the job
+            - report: RunReport where the metrics of each write are saved (default is a new one)
+        """
+        super().__init__(config, report)
+        self.directory = config.output_dir or DEFAULT_OUTPUT_DIR
+        os.makedirs(self.directory, exist_ok=True)
+
+    def write_chunk(self, dataframe, table_name:str):
+        path = os.path.join(self.directory, f'{rename_to_snake_case(table_name)}.csv')
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            with open(path, newline='') as file:
+                header = next(csv.reader(file), [])
+            columns = [str(column) for column in dataframe.columns]
+            if header != columns:
+                raise ValueError(
+                    f"As colunas dos dados ({', '.join(columns)}) são diferentes das colunas de {path} ({', '.join(header)})."
+                )
+        dataframe.to_csv(path, mode='a', header=new_file, index=False)
+
+LOCAL_SINKS = {
+    'sqlite': SqliteSink,
+    'parquet': ParquetSink,
+    'csv': CsvSink,
+}
+
+def create_sink(config:JobConfig, report:RunReport=None, checkpoint=None) -> Sink:
+    """
+    Function to create the sink chosen in OUTPUT_SINK.
+
+    Args:
+        - config: JobConfig of the job
+        - report: RunReport where the metrics are saved (default is a new one)
+        - checkpoint: UploadCheckpoint of the upload, only used by Airtable (default is None)
+    """
+    if config.output_sink == 'airtable':
+        return AirtableSink(config, report, checkpoint=checkpoint)
+    return LOCAL_SINKS[config.output_sink](config, report)
@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import hashlib
+import sqlite3
+from .utils.rename_to_snake_case import rename_to_snake_case
+
+DEFAULT_SYNC_INDEX_DIR = '.sync_index'
+SQLITE_MAX_VARIABLES = 900
+AIRTABLE_DATETIME_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d+))?Z$')
+
+def normalize_field_value(value):
+    """
+    Function to convert a field value to the form Airtable returns it, so local and remote
+    values can be compared: empty values and false checkboxes become None, integral floats
+    become int and datetimes keep only milliseconds.
+
+    Args:
+        - value: value of the field
+    """
+    if value is None or value is False or value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        match = AIRTABLE_DATETIME_PATTERN.match(value)
+        if match:
+            return f"{match.group(1)}.{(match.group(2) or '').ljust(3, '0')[:3]}Z"
+    return value
+
+def normalize_fields(fields:dict) -> dict:
+    """
+    Function to normalize all the fields of a record with normalize_field_value,
+    dropping the empty ones, as Airtable does.
+
+    Args:
+        - fields: dictionary with the fields of the record
+    """
+    normalized = {}
+    for name, value in fields.items():
+        value = normalize_field_value(value)
+        if value is not None:
+            normalized[name] = value
+    return normalized
+
+def row_content_hash(fields:dict) -> str:
+    """
+    Function to generate a hash of all the fields of a serialized record.
+    The fields are normalized first, so a local record and the same record read back
+    from Airtable have the same hash.
+
+    Args:
+        - fields: dictionary with the fields of the record
+    """
+    content = json.dumps(normalize_fields(fields), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def row_merge_key(fields:dict, merge_fields:list) -> str:
+    """
+    Function to build the key that identifies a record in the table.
+    It uses the column_hash field when it exists, the fields to merge on otherwise,
+    and the content of the record when there is no key at all.
+
+    Args:
+        - fields: dictionary with the fields of the record
+        - merge_fields: list of snake_case names of the fields used to merge (can be None)
+    """
+    if fields.get('column_hash'):
+        return fields['column_hash']
+    if merge_fields:
+        values = [normalize_field_value(fields.get(field)) for field in merge_fields]
+        return json.dumps(values, ensure_ascii=False, default=str)
+    return row_content_hash(fields)
+
+class SyncIndex:
+    """
+    Class that keeps, for one Airtable table, the content hash of each row already sent.
+    It is stored in a SQLite file per table, so the next runs only send new or changed rows.
+    """
+    def __init__(self, table_name:str, directory:str=None):
+        """
+        Args:
+            - table_name: name of the table in Airtable
+            - directory: folder where the index files are kept (default is SYNC_INDEX_DIR or .sync_index)
+        """
+        directory = directory or os.getenv('SYNC_INDEX_DIR') or DEFAULT_SYNC_INDEX_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = os.path.join(directory, f'{rename_to_snake_case(table_name)}.sqlite')
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS rows (merge_key TEXT PRIMARY KEY, content_hash TEXT NOT NULL)'
+        )
+        self.connection.commit()
+
+    def get(self, merge_keys:list) -> dict:
+        """
+        Function to get the stored content hash of the given keys.
+
+        Args:
+            - merge_keys: list of keys to look up
+        Returns:
+            - dictionary {merge_key: content_hash} with the keys found
+        """
+        found = {}
+        for i in range(0, len(merge_keys), SQLITE_MAX_VARIABLES):
+            part = merge_keys[i:i + SQLITE_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(part))
+            found.update(self.connection.execute(
+                f'SELECT merge_key, content_hash FROM rows WHERE merge_key IN ({placeholders})', part
+            ))
+        return found
+
+    def changed(self, merge_keys:list, content_hashes:list) -> list:
+        """
+        Function to check which rows are new or changed since the last sync.
+
+        Args:
+            - merge_keys: list with the key of each row
+            - content_hashes: list with the content hash of each row
+        Returns:
+            - list of booleans, True for the rows that have to be sent
+        """
+        stored = self.get(list(set(merge_keys)))
+        return [stored.get(key) != content for key, content in zip(merge_keys, content_hashes)]
+
+    def update(self, merge_keys:list, content_hashes:list):
+        """
+        Function to save the content hash of the rows that were sent.
+
+        Args:
+            - merge_keys: list with the key of each row
+            - content_hashes: list with the content hash of each row
+        """
+        self.connection.executemany(
+            'INSERT INTO rows (merge_key, content_hash) VALUES (?, ?) '
+            'ON CONFLICT(merge_key) DO UPDATE SET content_hash = excluded.content_hash',
+            zip(merge_keys, content_hashes)
+        )
+        self.connection.commit()
+
+    def replace(self, merge_keys:list, content_hashes:list):
+        """
+        Function to replace everything in the index, e.g. with what was read from the remote table.
+
+        Args:
+            - merge_keys: list with the key of each row
+            - content_hashes: list with the content hash of each row
+        """
+        self.connection.execute('DELETE FROM rows')
+        self.update(merge_keys, content_hashes)
+
+    def clear(self):
+        """
+        Function to forget every row, e.g. when the table was created again.
+        """
+        self.connection.execute('DELETE FROM rows')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
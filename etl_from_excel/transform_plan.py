@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from .utils.rename_to_snake_case import rename_to_snake_case
+
+PLAN_CACHE_SIZE = 128
+
+class MissingColumnsError(ValueError):
+    """
+    Exception raised when columns used by the job are not in the sheet.
+    """
+
+@dataclass(frozen=True)
+class TransformPlan:
+    """
+    Class with the treatments of a job resolved to the snake_case names of the columns.
+    It is compiled once for each set of options (see compile_transform_plan) and reused by every
+    chunk and every job with the same options, so the names are not converted again for each one.
+    When the columns to select are known, the projection keeps only the selected and hashed columns,
+    and the quantity and date treatments only run on the columns that are kept.
+    """
+    quantity_columns: tuple = ()
+    date_columns: tuple = ()
+    hash_columns: tuple = ()
+    output_columns: tuple = None
+    projection: tuple = None
+    required_columns: tuple = ()
+
+    def usecols(self):
+        """
+        Function to build the filter of the columns that must be read from the file.
+        When the columns to select are known, only the required columns are read, so the other
+        columns are never turned into a DataFrame. The names are compared in snake_case.
+
+        Returns:
+            - function that receives a column name and says if it must be read, or None to read every column
+        """
+        if self.projection is None:
+            return None
+        needed = frozenset(self.required_columns)
+        return lambda name: rename_to_snake_case(str(name)) in needed
+
+    def validate(self, columns):
+        """
+        Function to check that the columns used by the job are in the dataset, before any treatment runs.
+
+        Args:
+            - columns: names of the columns of the dataset, already in snake_case
+        Raises:
+            - MissingColumnsError with the columns that are not in the dataset
+        """
+        available = set(columns)
+        missing = [column for column in self.required_columns if column not in available]
+        if missing:
+            raise MissingColumnsError(
+                f"As colunas {', '.join(missing)} não foram encontradas na planilha. "
+                f"Colunas disponíveis: {', '.join(map(str, columns))}."
+            )
+
+def unique(columns) -> tuple:
+    """
+    Function to remove the repeated names of a list, keeping the order.
+
+    Args:
+        - columns: list of names
+    """
+    return tuple(dict.fromkeys(columns))
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def build_transform_plan(
+        quantity_column:tuple,
+        date_column:tuple,
+        columns_to_select:tuple,
+        columns_to_hash:tuple
+        ) -> TransformPlan:
+    quantity_columns = unique(rename_to_snake_case(column) for column in quantity_column or ())
+    date_columns = unique(rename_to_snake_case(column) for column in date_column or ())
+    hash_columns = unique(rename_to_snake_case(column) for column in columns_to_hash or ())
+    required_columns = unique(quantity_columns + date_columns + hash_columns)
+
+    if not columns_to_select:
+        return TransformPlan(quantity_columns, date_columns, hash_columns, required_columns=required_columns)
+
+    selected = unique(rename_to_snake_case(column) for column in columns_to_select)
+    output_columns = selected + ('column_hash',) if hash_columns and 'column_hash' not in selected else selected
+    # column_hash is created by the hash stage, so it is not read from the sheet when there are columns to hash.
+    read_columns = tuple(column for column in selected if column != 'column_hash') if hash_columns else selected
+    projection = unique(read_columns + hash_columns)
+    kept = set(projection)
+
+    return TransformPlan(
+        quantity_columns=tuple(column for column in quantity_columns if column in kept),
+        date_columns=tuple(column for column in date_columns if column in kept),
+        hash_columns=hash_columns,
+        output_columns=output_columns,
+        projection=projection,
+        required_columns=unique(projection + required_columns),
+    )
+
+def compile_transform_plan(
+        quantity_column:list=None,
+        date_column:list=None,
+        columns_to_select:list=None,
+        columns_to_hash:list=None
+        ) -> TransformPlan:
+    """
+    Function to compile the options of a job into a TransformPlan.
+    The plans are memoized, so the chunks of a file and the jobs with the same options share the same plan.
+
+    Args:
+        - quantity_column: list of names of the columns to treat as quantity (default is None)
+        - date_column: list of names of the columns to treat as date (default is None)
+        - columns_to_select: list of names of the columns to select (default is None)
+        - columns_to_hash: list of names of the columns to use to generate the hash (default is None)
+    """
+    return build_transform_plan(
+        tuple(quantity_column or ()),
+        tuple(date_column or ()),
+        tuple(columns_to_select or ()),
+        tuple(columns_to_hash or ()),
+    )
@@ -1,64 +1,451 @@
+import os
+import re
+import importlib.util
+from datetime import datetime
 import pandas as pd
+import numpy as np
 import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from loguru import logger
 from .utils.rename_to_snake_case import rename_to_snake_case
+from .run_report import RunReport
+from .workbook_cache import WorkbookCache
+from .transform_plan import compile_transform_plan
+from .job_config import READER_ENGINES
 
-def read_data_from_excel(path:str, sheet_name:str=None, header:int=0) -> pd.DataFrame:
+HASH_PARALLEL_MIN_ROWS = 200000
+DEFAULT_QUANTITY_UNITS = ('un',)
+CATEGORY_MAX_RATIO = 0.5
+DEFAULT_TIMEZONE = 'America/Sao_Paulo'
+DEFAULT_DATE_FORMATS = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y')
+EXCEL_EPOCH = np.datetime64('1899-12-30', 'ns')
+EXCEL_MAX_SERIAL = 2958466
+# Text that pd.read_excel reads as missing (its default na_values) and the error cells of Excel,
+# which openpyxl returns as text when only the values are read.
+MISSING_CELL_VALUES = frozenset((
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+    'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+    '#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!',
+))
+
+def get_reader_engine(engine:str=None) -> str:
+    """
+    Function to choose the engine used by pandas to read the Excel files.
+    'auto' picks the fastest engine installed: calamine (written in Rust, it doesn't build a Python
+    object for each cell) when python-calamine is available, otherwise openpyxl.
+
+    Args:
+        - engine: 'auto', 'calamine' or 'openpyxl' (default is 'auto')
+    """
+    engine = (engine or 'auto').lower()
+    calamine_installed = importlib.util.find_spec('python_calamine') is not None
+
+    if engine == 'auto':
+        return 'calamine' if calamine_installed else 'openpyxl'
+    if engine not in READER_ENGINES:
+        raise ValueError(f"Engine de leitura desconhecida: {engine}. Use auto, {', '.join(READER_ENGINES)}.")
+    if engine == 'calamine' and not calamine_installed:
+        logger.warning('python-calamine não está instalado, lendo o arquivo com openpyxl.')
+        return 'openpyxl'
+    return engine
+
+def read_data_from_excel(path:str, sheet_name:str=None, header:int=0, engine:str=None, usecols=None) -> pd.DataFrame:
     """
     Function to read data from an Excel file.
     
     Args:
-        - path: path to the file
+        - path: path to the file or file-like object (e.g. a buffer with the attachment)
         - sheet_name: name of the sheet to read
         - header: row number to use as the header (0-indexed)
+        - engine: reader engine, see get_reader_engine (default is 'auto')
+        - usecols: function that says which columns must be read, see TransformPlan.usecols (default is every column)
     """
     try:
-        return pd.read_excel(path, sheet_name=sheet_name, header=header)
+        return pd.read_excel(path, sheet_name=sheet_name, header=header, engine=get_reader_engine(engine), usecols=usecols)
     except Exception as e:
         logger.error(f"Erro ao ler arquivo: {e}")
         return 0
 
+def read_data_with_cache(
+        path,
+        sheet_name,
+        header:int,
+        cache:WorkbookCache,
+        engine:str=None,
+        usecols=None
+        ) -> tuple:
+    """
+    Function to read a sheet from the WorkbookCache, or from the Excel file when it isn't there yet.
+    On a miss the whole sheet is read and saved, so the next jobs with other columns also find it,
+    and only then the columns are filtered.
+
+    Args:
+        - path: path to the file or file-like object
+        - sheet_name: name of the sheet to read
+        - header: row number to use as the header (0-indexed)
+        - cache: WorkbookCache where the sheets are kept
+        - engine: reader engine, see get_reader_engine (default is 'auto')
+        - usecols: function that says which columns must be read, see TransformPlan.usecols (default is every column)
+    Returns:
+        - tuple with the pandas DataFrame (0 when the file can't be read) and True when it came from the cache
+    """
+    key = cache.build_key(path, sheet_name, header, get_reader_engine(engine))
+    df = cache.get(key, usecols=usecols)
+    if df is not None:
+        logger.info('Planilha encontrada no cache, a leitura do Excel foi pulada.')
+        return df, True
+
+    df = read_data_from_excel(path=path, sheet_name=sheet_name, header=header, engine=engine)
+    if isinstance(df, pd.DataFrame):
+        cache.put(key, df)
+        if usecols is not None:
+            df = df[[column for column in df.columns if usecols(column)]]
+    return df, False
+
+def get_unique_column_names(header_row:tuple) -> list:
+    """
+    Function to name the columns of a header row the same way pandas does.
+    Empty names become "Unnamed: <position>" and repeated names get a ".<n>" suffix.
+
+    Args:
+        - header_row: tuple with the values of the header row
+    """
+    names = []
+    seen = {}
+    for position, value in enumerate(header_row):
+        name = f"Unnamed: {position}" if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            new_name = f"{name}.{seen[name]}"
+            while new_name in seen:
+                seen[name] += 1
+                new_name = f"{name}.{seen[name]}"
+            seen[new_name] = 0
+            name = new_name
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def build_chunk(rows:list, columns:list) -> pd.DataFrame:
+    """
+    Function to build a DataFrame from the rows read by openpyxl.
+    The cells are normalized the way pd.read_excel does with openpyxl: empty cells, error cells and
+    the text of its default na_values become NaN, and integral floats in text columns become integers.
+    Unlike pd.read_excel, a column where all the text looks like numbers is kept as text, because
+    the other chunks of the column may not.
+
+    Args:
+        - rows: list of tuples with the values of each row
+        - columns: list of names of the columns
+    """
+    chunk = pd.DataFrame(rows, columns=columns)
+    for column in chunk.select_dtypes(include='object').columns:
+        values = chunk[column]
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        missing = values.isna()
+        if kind not in ('empty', 'floating', 'integer', 'boolean'):
+            missing |= values.isin(MISSING_CELL_VALUES)
+        values = values.where(~missing, np.nan)
+        if kind in ('floating', 'mixed-integer-float', 'mixed'):
+            values = values.map(lambda value: int(value) if isinstance(value, float) and value.is_integer() else value)
+        chunk[column] = values.infer_objects()
+    return chunk
+
+def build_sheet_chunk(rows:list, header_row:list, width:int, usecols=None) -> pd.DataFrame:
+    """
+    Function to build a chunk of the chunked reader with the columns of the header row.
+    The header is padded to the width of the data and the empty names become "Unnamed: <position>",
+    as in pd.read_excel, before the columns that must be read are chosen.
+
+    Args:
+        - rows: list of tuples with the values of each row, without the trailing empty cells
+        - header_row: list with the values of the header row, without the trailing empty cells
+        - width: number of columns of the chunk
+        - usecols: function that says which columns must be read (default is every column)
+    """
+    columns = get_unique_column_names(header_row + [None] * (width - len(header_row)))
+    rows = [row + (None,) * (width - len(row)) for row in rows]
+
+    positions = [i for i, column in enumerate(columns) if usecols is None or usecols(column)]
+    if len(positions) < width:
+        columns = [columns[i] for i in positions]
+        rows = [tuple(row[i] for i in positions) for row in rows]
+    return build_chunk(rows, columns)
+
+def get_sheet_names(path) -> list:
+    """
+    Function to list the names of the sheets of an Excel file, without reading the cells.
+
+    Args:
+        - path: path to the file or file-like object
+    """
+    # openpyxl is only loaded when a workbook is opened here, pd.read_excel loads its engine by itself.
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+        if hasattr(path, 'seek'):
+            path.seek(0)
+
+def read_data_from_excel_in_chunks(path, sheet_name=None, header:int=0, chunk_size:int=10000, usecols=None):
+    """
+    Function to read data from an Excel file in fixed-size chunks.
+    It uses the read-only mode of openpyxl, so only one chunk of rows is kept in memory at a time.
+    The rows are read the same way as read_data_from_excel: blank rows inside the data are kept,
+    trailing blank rows are dropped and the data to the right of the header is kept in columns named
+    "Unnamed: <position>". The width of a chunk is the widest row read so far, so when a row after
+    the first chunk is wider than the previous ones, the next chunks get the new columns at the end.
+    The cells are normalized like pd.read_excel (see build_chunk), but the dtypes are inferred for
+    each chunk, so a column can be int in one chunk and float in another; the row hash gives the
+    same result for both.
+
+    Args:
+        - path: path to the file or file-like object
+        - sheet_name: name or index of the sheet to read (default is the first sheet)
+        - header: row number to use as the header (0-indexed)
+        - chunk_size: number of rows in each chunk (default is 10000)
+        - usecols: function that says which columns must be read, see TransformPlan.usecols (default is every column)
+    Yields:
+        - pandas DataFrame with up to chunk_size rows
+    """
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        if isinstance(sheet_name, str):
+            sheet = workbook[sheet_name]
+        else:
+            sheet = workbook.worksheets[sheet_name or 0]
+
+        rows = sheet.iter_rows(min_row=header + 1, values_only=True)
+        header_row = next(rows, None)
+        if header_row is None:
+            return
+
+        header_row = list(header_row)
+        while header_row and header_row[-1] is None:
+            header_row.pop()
+        width = len(header_row)
+
+        chunk = []
+        blank_rows = 0
+        for row in rows:
+            # The trailing empty cells are dropped, like pandas does, so the width only counts the data.
+            length = len(row)
+            while length and row[length - 1] is None:
+                length -= 1
+            if not length:
+                blank_rows += 1
+                continue
+
+            chunk.extend([()] * blank_rows)
+            blank_rows = 0
+            chunk.append(row[:length])
+            width = max(width, length)
+
+            while len(chunk) >= chunk_size:
+                yield build_sheet_chunk(chunk[:chunk_size], header_row, width, usecols)
+                chunk = chunk[chunk_size:]
+
+        if chunk:
+            yield build_sheet_chunk(chunk, header_row, width, usecols)
+    finally:
+        workbook.close()
+
 def rename_columns_to_snake_case(dataset:pd.DataFrame) -> pd.DataFrame:
     """
-    Function to rename the columns of a dataset to snake_case.
+    Function to rename the columns of a dataset to snake_case, with a single rename of the whole index.
 
     Args:
         - dataset: pandas DataFrame with the data to rename the columns
     """
-    for column in dataset.columns:
-        dataset.rename(columns={column: rename_to_snake_case(column)}, inplace=True)
+    dataset.rename(columns=rename_to_snake_case, inplace=True)
     return dataset
 
-def treat_quantity_column(dataset:pd.DataFrame, column:str) -> pd.DataFrame:
+def downcast_integers(values:pd.Series) -> pd.Series:
+    """
+    Function to store an integer column in the smallest integer dtype.
+    Float columns are kept as float64, also when all their values are integral, so '10.0 un' stays 10.0.
+
+    Args:
+        - values: numeric pandas Series
+    """
+    if pd.api.types.is_integer_dtype(values.dtype) and isinstance(values.dtype, np.dtype):
+        return pd.to_numeric(values, downcast='integer')
+    return values
+
+def parse_quantity(values:pd.Series, units:list=None, decimal:str=',') -> tuple:
+    """
+    Function to convert a column of quantities like "1.234,5 un" to numbers, for the whole column at once.
+    The unit suffixes and the spaces are removed, the thousands separators (only when followed by
+    groups of 3 digits) are dropped and the decimal separator becomes a dot. Cells that are already
+    numbers are kept as they are.
+
+    Args:
+        - values: pandas Series with the quantities
+        - units: list of unit suffixes to remove, case insensitive (default is DEFAULT_QUANTITY_UNITS)
+        - decimal: decimal separator of the text cells, ',' or '.' (default is ',')
+    Returns:
+        - tuple with the numeric pandas Series, with integers downcast to the smallest dtype (floats stay float64),
+          and the number of cells that couldn't be converted and became NaN
+    """
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return downcast_integers(values), 0
+
+    units = units or DEFAULT_QUANTITY_UNITS
+    thousands = '.' if decimal == ',' else ','
+    unit_pattern = r'\s*(?:' + '|'.join(re.escape(unit) for unit in units) + r')\.?$'
+
+    # Only the text cells go through the str accessor, the other ones (numbers, booleans, None) are
+    # converted directly, so a column without any text cell doesn't break the accessor.
+    is_text = values.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+    text = values[is_text].astype(str).str.strip().str.lower()
+    cleaned = (
+        text.str.replace(unit_pattern, '', regex=True)
+        .str.replace(r'\s+', '', regex=True)
+        .str.replace(re.escape(thousands) + r'(?=\d{3}(?:\D|$))', '', regex=True)
+        .str.replace(decimal, '.', regex=False)
+    )
+    numbers = values[~is_text]
+    numbers = numbers.astype('int64') if pd.api.types.is_bool_dtype(numbers) else pd.to_numeric(numbers, errors='coerce')
+
+    parts = [part for part in (pd.to_numeric(cleaned, errors='coerce'), numbers) if len(part)]
+    positions = np.concatenate([np.flatnonzero(is_text), np.flatnonzero(~is_text)])
+    result = pd.concat(parts).iloc[np.argsort(positions, kind='stable')] if parts else pd.Series(dtype=float)
+    result.index = values.index
+
+    empty = np.zeros(len(values), dtype=bool)
+    empty[is_text] = (text == '').to_numpy()
+    invalid = int((result.isna().to_numpy() & values.notna().to_numpy() & ~empty).sum())
+    return downcast_integers(result), invalid
+
+def treat_quantity_column(dataset:pd.DataFrame, column:str, units:list=None, decimal:str=',', report:RunReport=None) -> pd.DataFrame:
     """
     Function to treat a quantity column in a dataset.
+    The cells that can't be converted become NaN and are counted in the report.
 
     Args:
         - dataset: pandas DataFrame with the data to treat
         - column: name of the column to treat
+        - units: list of unit suffixes to remove (default is DEFAULT_QUANTITY_UNITS)
+        - decimal: decimal separator of the text cells (default is ',')
+        - report: RunReport where the number of invalid cells is saved (default is None)
     """
-    dataset[column] = dataset[column].apply(lambda x: x.replace('un', '').replace(' ', '') if 'un' in x else x)
-    dataset[column] = dataset[column].apply(pd.to_numeric)
+    dataset[column], invalid = parse_quantity(dataset[column], units=units, decimal=decimal)
+
+    if invalid:
+        logger.warning(f"{invalid} células da coluna {column} não são quantidades válidas e ficaram vazias.")
+    if report is not None:
+        report.add_count('invalid_quantities', column, invalid)
     return dataset
 
-def treat_date_column(dataset: pd.DataFrame, column: str, timezone: str = 'America/Sao_Paulo') -> pd.DataFrame:
+def parse_dates(values:pd.Series, formats:list=None, timezone:str=DEFAULT_TIMEZONE) -> tuple:
+    """
+    Function to convert a column of dates to UTC datetimes.
+    The distinct values are parsed only once and mapped back to the rows, since the same timestamps
+    repeat a lot in the exports. Text is tried against each format in order, always only on the text
+    that no previous format could parse. Numbers are read as Excel serial dates and cells that are
+    already datetimes are kept, converted to the timezone first when they have one. The local dates are localized and converted to UTC once, also on the
+    distinct values.
+
+    Args:
+        - values: pandas Series with the dates
+        - formats: list of strptime formats tried in order (default is DEFAULT_DATE_FORMATS)
+        - timezone: timezone of the dates without one (default is 'America/Sao_Paulo')
+    Returns:
+        - tuple with the pandas Series of UTC datetimes and a dictionary with the number of cells matched
+          by each format (plus 'excel_serial' and 'datetime') and of cells that couldn't be parsed ('invalid')
+    """
+    formats = formats or DEFAULT_DATE_FORMATS
+
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        return values.dt.tz_convert('UTC'), {'datetime': int(values.notna().sum())}
+
+    codes, uniques = pd.factorize(values)
+    # How many rows have each distinct value, so the counts are in cells and not in distinct values.
+    occurrences = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    parsed = np.full(len(uniques), np.datetime64('NaT'), dtype='datetime64[ns]')
+    counts = {}
+
+    if pd.api.types.is_datetime64_dtype(uniques):
+        parsed[:] = uniques.to_numpy(dtype='datetime64[ns]')
+        counts['datetime'] = int(occurrences.sum())
+    else:
+        uniques = pd.Series(uniques, dtype=object)
+        is_text = uniques.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+        is_number = uniques.map(
+            lambda value: isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_))
+        ).to_numpy(dtype=bool)
+        is_datetime = ~is_text & ~is_number
+
+        if is_datetime.any():
+            # Datetimes with a timezone are converted to the local time, like the text, so the column
+            # can be localized as a whole below.
+            local = uniques[is_datetime].map(
+                lambda value: pd.Timestamp(value).tz_convert(timezone).tz_localize(None)
+                if isinstance(value, datetime) and value.tzinfo is not None else value
+            )
+            dates = pd.to_datetime(local, errors='coerce')
+            parsed[is_datetime] = dates.to_numpy(dtype='datetime64[ns]')
+            counts['datetime'] = int(occurrences[is_datetime][dates.notna().to_numpy()].sum())
+            counts['invalid'] = int(occurrences[is_datetime][dates.isna().to_numpy()].sum())
+
+        if is_number.any():
+            serials = uniques[is_number].astype(float).to_numpy()
+            valid = (serials >= 1) & (serials < EXCEL_MAX_SERIAL)
+            milliseconds = np.round(np.where(valid, serials, 0) * 86400000).astype('int64')
+            dates = EXCEL_EPOCH + milliseconds.astype('timedelta64[ms]')
+            parsed[np.flatnonzero(is_number)[valid]] = dates[valid]
+            counts['excel_serial'] = int(occurrences[is_number][valid].sum())
+
+        text = uniques[is_text].str.strip()
+        positions = np.flatnonzero(is_text)
+        # Blank cells become NaT without being counted as invalid.
+        remaining = (text != '').to_numpy()
+        for date_format in formats:
+            if not remaining.any():
+                break
+            dates = pd.to_datetime(text[remaining], format=date_format, errors='coerce')
+            matched = dates.notna().to_numpy()
+            parsed[positions[remaining][matched]] = dates[matched].to_numpy(dtype='datetime64[ns]')
+            counts[date_format] = int(occurrences[positions[remaining][matched]].sum())
+            remaining[np.flatnonzero(remaining)[matched]] = False
+
+        counts['invalid'] = counts.get('invalid', 0) + int(occurrences[positions[remaining]].sum())
+
+    utc = pd.DatetimeIndex(parsed).tz_localize(timezone).tz_convert('UTC')
+    result = utc.take(codes, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(result, index=values.index, name=values.name), counts
+
+def treat_date_column(
+        dataset:pd.DataFrame,
+        column:str,
+        timezone:str=DEFAULT_TIMEZONE,
+        formats:list=None,
+        report:RunReport=None
+        ) -> pd.DataFrame:
     """
-    Function to treat a date column in a dataset and localize it to a specific timezone.
+    Function to treat a date column in a dataset and convert it from a specific timezone to UTC.
+    The cells that can't be parsed become NaT and are counted in the report, with the cells matched by each format.
 
     Args:
         - dataset: pandas DataFrame with the data to treat
         - column: name of the column to treat
         - timezone: string representing the timezone to localize the dates (default is 'America/Sao_Paulo')
+        - formats: list of formats tried in order, see parse_dates (default is DEFAULT_DATE_FORMATS)
+        - report: RunReport where the number of cells of each format is saved (default is None)
     """
-    dataset[column] = pd.to_datetime(
-        dataset[column],
-        errors='coerce',
-        format='%d/%m/%Y %H:%M:%S'
-    )
-
-    dataset[column] = dataset[column].dt.tz_localize(timezone)
-    dataset[column] = dataset[column].dt.tz_convert('UTC')
+    dataset[column], counts = parse_dates(dataset[column], formats=formats, timezone=timezone)
 
+    invalid = counts.pop('invalid', 0)
+    if invalid:
+        logger.warning(f"{invalid} células da coluna {column} não são datas válidas e ficaram vazias.")
+    if report is not None:
+        report.add_count('invalid_dates', column, invalid)
+        for name, count in counts.items():
+            report.add_count('date_formats', name, count)
     return dataset
 
 def select_columns(dataset:pd.DataFrame, columns:list) -> pd.DataFrame:
@@ -79,22 +466,243 @@ def generate_row_hash(row: pd.Series) -> str:
     Args:
         - row: pandas Series with the values of the row
     """
-    row_str = ''.join(row.astype(str).values)
+    values = row.astype(str).to_numpy(dtype=object)
+    if row.dtype.kind in 'fO':
+        # Integral floats are written as integers, see format_hash_values.
+        for i, value in enumerate(row.to_numpy()):
+            if isinstance(value, float) and value.is_integer():
+                values[i] = str(int(value))
+    row_str = ''.join(values)
 
     return hashlib.sha256(row_str.encode()).hexdigest()
 
-def add_hash_column(dataset: pd.DataFrame, columns: list) -> pd.DataFrame:
+def format_hash_values(values:np.ndarray) -> np.ndarray:
+    """
+    Function to convert the values of one column to the text used in the row hash.
+    Integral floats are written as integers ('10' and not '10.0'), so a number gets the same text
+    whether its column is int or float, e.g. when a missing cell made the column float in one chunk
+    and not in the others.
+
+    Args:
+        - values: numpy array with the values of the column
+    Returns:
+        - numpy array with the text of each value
+    """
+    if values.dtype.kind == 'f':
+        integral = np.isfinite(values) & (np.mod(values, 1) == 0)
+        if not integral.any():
+            return values.astype(object).astype(str)
+        strings = np.empty(len(values), dtype=object)
+        small = integral & (np.abs(values) < 2 ** 63)
+        strings[small] = values[small].astype(np.int64).astype(str)
+        strings[~small] = [str(int(value)) if is_integral else str(value) for value, is_integral in zip(values[~small], integral[~small])]
+        return strings
+
+    strings = values.astype(object).astype(str)
+    if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) in ('floating', 'mixed-integer-float', 'mixed'):
+        integral = np.fromiter(
+            (isinstance(value, float) and value.is_integer() for value in values), dtype=bool, count=len(values)
+        )
+        if integral.any():
+            strings = strings.astype(object)
+            strings[integral] = [str(int(value)) for value in values[integral]]
+    return strings
+
+def build_hash_keys(dataset: pd.DataFrame, columns: list):
+    """
+    Function to build, column by column, the strings that generate_row_hash would hash for each row.
+    The values are converted the same way a row of dataset[columns] is: numeric columns are
+    upcast to their common type and mixed columns are converted with str() as objects, with the
+    integral floats written as integers (see format_hash_values).
+
+    Args:
+        - dataset: pandas DataFrame with the data
+        - columns: list of columns to use to generate the hash
+    Returns:
+        - numpy array with one key per row, or None when the columns need the row-wise path
+    """
+    frame = dataset[columns]
+    dtypes = list(frame.dtypes)
+
+    if all(isinstance(dtype, np.dtype) and dtype.kind in 'iuf' for dtype in dtypes):
+        common = np.result_type(*dtypes)
+        parts = [format_hash_values(frame[column].to_numpy(dtype=common)) for column in columns]
+    elif all(isinstance(dtype, np.dtype) and dtype.kind in 'mM' for dtype in dtypes):
+        # Rows with only naive datetimes/timedeltas are formatted row by row by pandas.
+        return None
+    else:
+        parts = []
+        for column in columns:
+            values = frame[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Each category is converted once, missing values (code -1) take the last item: 'nan'.
+                categories = format_hash_values(values.cat.categories.to_numpy())
+                parts.append(np.append(categories, 'nan')[values.cat.codes.to_numpy()])
+                continue
+            if isinstance(values.dtype, pd.StringDtype):
+                # Missing values of string columns are pd.NA, they are hashed as 'nan' like the object column they came from.
+                values = values.astype(object).where(values.notna(), np.nan)
+            parts.append(format_hash_values(values.to_numpy() if values.dtype.kind == 'f' else values.astype(object).to_numpy()))
+
+    keys = parts[0].astype(str)
+    for part in parts[1:]:
+        keys = np.char.add(keys, part.astype(str))
+    return keys
+
+def hash_keys(keys: list) -> list:
+    """
+    Function to generate the sha256 hash of each key.
+
+    Args:
+        - keys: list of strings
+    """
+    sha256 = hashlib.sha256
+    return [sha256(key.encode()).hexdigest() for key in keys]
+
+def add_hash_column(dataset: pd.DataFrame, columns: list, processes: int = None) -> pd.DataFrame:
     """
     Function to add a hash column to the dataset.
     It uses the selected columns to generate the hash.
+    The keys are built for all the rows at once and hashed in bulk, generating the same hashes as generate_row_hash.
+    Large datasets can be hashed in a process pool.
 
     Args:
         - dataset: pandas DataFrame with the data
         - columns: list of columns to use to generate the hash
+        - processes: number of processes used to hash datasets larger than HASH_PARALLEL_MIN_ROWS
+          (default is the HASH_PROCESSES environment variable, or no process pool)
     """
-    dataset['column_hash'] = dataset[columns].apply(generate_row_hash, axis=1)
+    keys = build_hash_keys(dataset, columns)
+
+    if keys is None:
+        dataset['column_hash'] = dataset[columns].apply(generate_row_hash, axis=1)
+        return dataset
+
+    keys = keys.tolist()
+
+    if processes is None:
+        processes = int(os.getenv('HASH_PROCESSES')) if os.getenv('HASH_PROCESSES') else 0
+
+    if processes > 1 and len(keys) >= HASH_PARALLEL_MIN_ROWS:
+        size = -(-len(keys) // processes)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            hashes = [
+                value
+                for part in executor.map(hash_keys, [keys[i:i + size] for i in range(0, len(keys), size)])
+                for value in part
+            ]
+    else:
+        hashes = hash_keys(keys)
+
+    dataset['column_hash'] = hashes
+    return dataset
+
+def optimize_dtypes(dataset:pd.DataFrame, category_max_ratio:float=CATEGORY_MAX_RATIO) -> pd.DataFrame:
+    """
+    Function to store the columns of a dataset in more compact dtypes.
+    Text columns with few distinct values become categoricals, the other text columns become
+    Arrow-backed strings (when pyarrow is installed) and integer columns are downcast.
+    Float columns are kept as they are, because float32 would change the values sent to Airtable.
+    The hashes and the serialization give the same results with the new dtypes.
+
+    Args:
+        - dataset: pandas DataFrame with the data
+        - category_max_ratio: maximum ratio of distinct values to rows for a column to become a categorical (default is 0.5)
+    """
+    arrow_strings = importlib.util.find_spec('pyarrow') is not None
+
+    for column in dataset.columns:
+        values = dataset[column]
+        if pd.api.types.is_integer_dtype(values.dtype) and isinstance(values.dtype, np.dtype):
+            dataset[column] = pd.to_numeric(values, downcast='integer')
+        elif values.dtype == object and len(values):
+            if values.nunique(dropna=True) <= len(values) * category_max_ratio:
+                dataset[column] = values.astype('category')
+            elif arrow_strings and pd.api.types.infer_dtype(values, skipna=True) == 'string':
+                dataset[column] = values.astype('string[pyarrow]')
+
     return dataset
 
+def treat_dataset(
+        df:pd.DataFrame,
+        quantity_column:list=None,
+        date_column:list=None,
+        columns_to_select:list=None,
+        columns_to_hash:list=None,
+        hash_processes:int=None,
+        quantity_units:list=None,
+        quantity_decimal:str=',',
+        date_formats:list=None,
+        optimize:bool=True,
+        report:RunReport=None
+        ) -> pd.DataFrame:
+    """
+    Function to apply the treatments to a dataset that was already read.
+    It renames the columns to snake_case, treats the quantity and date columns,
+    adds the hash column and selects the columns.
+    The options are compiled into a TransformPlan, so the columns used by the job are checked before
+    any treatment runs and the columns that are not selected are dropped before the treatments.
+
+    Args:
+        - df: pandas DataFrame with the data read from the file
+        - quantity_column: list of names of the columns to treat as quantity (default is None)
+        - date_column: list of names of the columns to treat as date (default is None)
+        - columns_to_select: list of names of the columns to select (default is None)
+        - columns_to_hash: list of names of the columns to use to generate the hash (default is None)
+        - hash_processes: number of processes used to hash large datasets (default is HASH_PROCESSES)
+        - quantity_units: list of unit suffixes removed from the quantities (default is DEFAULT_QUANTITY_UNITS)
+        - quantity_decimal: decimal separator of the quantities (default is ',')
+        - date_formats: list of formats tried in order on the date columns (default is DEFAULT_DATE_FORMATS)
+        - optimize: store the columns in compact dtypes before the hash, see optimize_dtypes (default is True)
+        - report: RunReport where the metrics of each stage are saved (default is None)
+    Raises:
+        - MissingColumnsError when a column used by the job is not in the dataset
+    """
+    report = report or RunReport()
+    plan = compile_transform_plan(quantity_column, date_column, columns_to_select, columns_to_hash)
+
+    with report.stage('rename', rows_in=len(df)) as stage:
+        df = rename_columns_to_snake_case(df)
+        plan.validate(df.columns)
+        unneeded = [column for column in df.columns if column not in plan.projection] if plan.projection else []
+        if unneeded:
+            # drop returns a new frame instead of a slice, so the treatments can assign to it.
+            df = df.drop(columns=unneeded)
+        stage['rows_out'] = len(df)
+
+    if plan.quantity_columns:
+        with report.stage('quantity', rows_in=len(df)) as stage:
+            for column in plan.quantity_columns:
+                df = treat_quantity_column(df, column, units=quantity_units, decimal=quantity_decimal, report=report)
+            stage['rows_out'] = len(df)
+
+    if plan.date_columns:
+        with report.stage('date', rows_in=len(df)) as stage:
+            for column in plan.date_columns:
+                df = treat_date_column(df, column, formats=date_formats, report=report)
+            stage['rows_out'] = len(df)
+
+    if optimize:
+        with report.stage('optimize', rows_in=len(df)) as stage:
+            memory_before = df.memory_usage(deep=True).sum()
+            df = optimize_dtypes(df)
+            memory_after = df.memory_usage(deep=True).sum()
+            report.add_count('memory_mb', 'before', float(memory_before) / 1024 ** 2)
+            report.add_count('memory_mb', 'after', float(memory_after) / 1024 ** 2)
+            stage['rows_out'] = len(df)
+
+    if plan.hash_columns:
+        with report.stage('hash', rows_in=len(df)) as stage:
+            df = add_hash_column(df, list(plan.hash_columns), processes=hash_processes)
+            stage['rows_out'] = len(df)
+    
+    if plan.output_columns is not None:
+        with report.stage('select', rows_in=len(df)) as stage:
+            df = select_columns(df, list(plan.output_columns))
+            stage['rows_out'] = len(df)
+
+    return df
+
 def treat_data_pipeline(
         path, 
         sheet_name, 
@@ -102,45 +710,137 @@ def treat_data_pipeline(
         quantity_column:list=None,
         date_column:list=None,
         columns_to_select:list=None,
-        columns_to_hash:list=None
+        columns_to_hash:list=None,
+        hash_processes:int=None,
+        engine:str=None,
+        cache:WorkbookCache=None,
+        quantity_units:list=None,
+        quantity_decimal:str=',',
+        date_formats:list=None,
+        optimize:bool=True,
+        report:RunReport=None
         ):
     """
     Function to treat the data from an Excel file.
     It reads the data, renames the columns to snake_case, treats the quantity column and the date column.
+    When columns_to_select is given, only the columns used by the job are read from the file.
 
     Args:
-        - path: path to the file
+        - path: path to the file or file-like object
         - sheet_name: name of the sheet to read
         - header: row number to use as the header (0-indexed)
         - quantity_column: list of names of the columns to treat as quantity (default is None)
         - date_column: list of names of the columns to treat as date (default is None)
         - columns_to_select: list of names of the columns to select (default is None)
         - columns_to_hash: list of names of the columns to use to generate the hash (default is None)
+        - hash_processes: number of processes used to hash large datasets (default is HASH_PROCESSES)
+        - engine: reader engine, see get_reader_engine (default is 'auto')
+        - cache: WorkbookCache used to skip the parsing of a workbook already read (default is None)
+        - quantity_units: list of unit suffixes removed from the quantities (default is DEFAULT_QUANTITY_UNITS)
+        - quantity_decimal: decimal separator of the quantities (default is ',')
+        - date_formats: list of formats tried in order on the date columns (default is DEFAULT_DATE_FORMATS)
+        - optimize: store the columns in compact dtypes before the hash, see optimize_dtypes (default is True)
+        - report: RunReport where the metrics of each stage are saved (default is None)
     """
-    df = read_data_from_excel(
-        path=path, 
-        sheet_name=sheet_name, 
-        header=header
+    report = report or RunReport()
+    usecols = compile_transform_plan(quantity_column, date_column, columns_to_select, columns_to_hash).usecols()
+
+    with report.stage('read') as stage:
+        if cache is not None:
+            df, hit = read_data_with_cache(path, sheet_name, header, cache, engine=engine, usecols=usecols)
+            report.add_details('workbook_cache', 'hit' if hit else 'miss')
+        else:
+            df = read_data_from_excel(
+                path=path, 
+                sheet_name=sheet_name, 
+                header=header,
+                engine=engine,
+                usecols=usecols
+            )
+        stage['rows_out'] = len(df) if isinstance(df, pd.DataFrame) else None
+
+    return treat_dataset(
+        df,
+        quantity_column=quantity_column,
+        date_column=date_column,
+        columns_to_select=columns_to_select,
+        columns_to_hash=columns_to_hash,
+        hash_processes=hash_processes,
+        quantity_units=quantity_units,
+        quantity_decimal=quantity_decimal,
+        date_formats=date_formats,
+        optimize=optimize,
+        report=report
     )
 
-    df = rename_columns_to_snake_case(df)
+def treat_data_pipeline_in_chunks(
+        path,
+        sheet_name,
+        header,
+        quantity_column:list=None,
+        date_column:list=None,
+        columns_to_select:list=None,
+        columns_to_hash:list=None,
+        chunk_size:int=10000,
+        hash_processes:int=None,
+        quantity_units:list=None,
+        quantity_decimal:str=',',
+        date_formats:list=None,
+        optimize:bool=True,
+        report:RunReport=None
+        ):
+    """
+    Function to treat the data from an Excel file chunk by chunk.
+    It applies the same treatments as treat_data_pipeline, but reads the file in streaming mode
+    and yields each treated chunk as soon as it is ready, so the memory used depends on the
+    chunk size and not on the file size.
+    When columns_to_select is given, only the columns used by the job are kept from each row.
 
-    if quantity_column:
-        for column in quantity_column:
-            df = treat_quantity_column(df, rename_to_snake_case(column))
+    Args:
+        - path: path to the file or file-like object
+        - sheet_name: name of the sheet to read
+        - header: row number to use as the header (0-indexed)
+        - quantity_column: list of names of the columns to treat as quantity (default is None)
+        - date_column: list of names of the columns to treat as date (default is None)
+        - columns_to_select: list of names of the columns to select (default is None)
+        - columns_to_hash: list of names of the columns to use to generate the hash (default is None)
+        - chunk_size: number of rows in each chunk (default is 10000)
+        - hash_processes: number of processes used to hash large datasets (default is HASH_PROCESSES)
+        - quantity_units: list of unit suffixes removed from the quantities (default is DEFAULT_QUANTITY_UNITS)
+        - quantity_decimal: decimal separator of the quantities (default is ',')
+        - date_formats: list of formats tried in order on the date columns (default is DEFAULT_DATE_FORMATS)
+        - optimize: store the columns in compact dtypes before the hash, see optimize_dtypes (default is True)
+        - report: RunReport where the metrics of each stage are saved, added up over the chunks (default is None)
+    Yields:
+        - pandas DataFrame with the treated chunk
+    """
+    report = report or RunReport()
+    chunks = read_data_from_excel_in_chunks(
+        path,
+        sheet_name=sheet_name,
+        header=header,
+        chunk_size=chunk_size,
+        usecols=compile_transform_plan(quantity_column, date_column, columns_to_select, columns_to_hash).usecols()
+    )
 
-    if date_column:
-        for column in date_column:
-            df = treat_date_column(df, rename_to_snake_case(column))
+    while True:
+        with report.stage('read') as stage:
+            chunk = next(chunks, None)
+            stage['rows_out'] = len(chunk) if chunk is not None else 0
 
-    if columns_to_hash:
-        columns_to_hash = [rename_to_snake_case(column) for column in columns_to_hash]
-        df = add_hash_column(df, columns_to_hash)
-    
-    if columns_to_select:
-        columns_to_select = [rename_to_snake_case(column) for column in columns_to_select]
-        if columns_to_hash and 'column_hash' not in columns_to_select:
-            columns_to_select.append('column_hash')
-        df = select_columns(df, columns_to_select)
+        if chunk is None:
+            return
 
-    return df
+        yield treat_dataset(
+            chunk,
+            quantity_column=quantity_column,
+            date_column=date_column,
+            columns_to_select=columns_to_select,
+            columns_to_hash=columns_to_hash,
+            hash_processes=hash_processes,
+            quantity_units=quantity_units,
+            quantity_decimal=quantity_decimal,
+            date_formats=date_formats,
+            optimize=optimize,
+            report=report
+        )
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+DEFAULT_CHECKPOINT_DIR = '.checkpoints'
+
+def list_checkpoints(directory:str=None) -> list:
+    """
+    Function to list the uploads that still have batches to send.
+
+    Args:
+        - directory: folder where the checkpoints are kept (default is CHECKPOINT_DIR or .checkpoints)
+    Returns:
+        - list of dictionaries with the id, the metadata and the number of batches left of each upload,
+          the oldest first
+    """
+    directory = directory or os.getenv('CHECKPOINT_DIR') or DEFAULT_CHECKPOINT_DIR
+    if not os.path.isdir(directory):
+        return []
+
+    checkpoints = []
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith('.sqlite'):
+            continue
+        with UploadCheckpoint(file[:-len('.sqlite')], directory, create=False) as checkpoint:
+            left = checkpoint.count_left()
+            if left:
+                checkpoints.append({'id': checkpoint.id, 'metadata': checkpoint.metadata(), 'left': left})
+    return sorted(checkpoints, key=lambda checkpoint: checkpoint['metadata'].get('created_at', 0))
+
+class UploadCheckpoint:
+    """
+    Class that keeps, for one upload, every batch sent to Airtable and whether Airtable acknowledged it.
+    It is stored in a SQLite file per upload, so an upload interrupted by a restart of the bot or by an
+    outage of Airtable can be resumed from the batches that were not acknowledged, without the file.
+    The batches that failed after all the retries stay in the file as a retry queue.
+    """
+    def __init__(self, checkpoint_id:str=None, directory:str=None, create:bool=True):
+        """
+        Args:
+            - checkpoint_id: ID of the upload (default is a new ID)
+            - directory: folder where the checkpoints are kept (default is CHECKPOINT_DIR or .checkpoints)
+            - create: create the checkpoint if it doesn't exist (default is True)
+        Raises:
+            - ValueError when the ID is not valid
+            - FileNotFoundError when create is False and the checkpoint doesn't exist
+        """
+        directory = directory or os.getenv('CHECKPOINT_DIR') or DEFAULT_CHECKPOINT_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        # The ID comes from a Discord message when an upload is resumed, so it can't point outside the folder.
+        if checkpoint_id is not None and not checkpoint_id.isalnum():
+            raise ValueError(f"ID de envio inválido: '{checkpoint_id}'.")
+
+        self.id = checkpoint_id or uuid.uuid4().hex[:8]
+        self.path = os.path.join(directory, f'{self.id}.sqlite')
+        if not create and not os.path.exists(self.path):
+            raise FileNotFoundError(f"Envio {self.id} não encontrado.")
+        # The batches are acknowledged by the threads of the upload.
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS batches ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, method TEXT NOT NULL, '
+            "payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+            'error TEXT)'
+        )
+        self.connection.execute(
+            "INSERT OR IGNORE INTO metadata (key, value) VALUES ('created_at', ?)", (json.dumps(time.time()),)
+        )
+        self.connection.commit()
+
+    def set_metadata(self, **values):
+        """
+        Function to save information about the upload, e.g. the file name and the base.
+        """
+        with self._lock:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value)) for key, value in values.items()]
+            )
+            self.connection.commit()
+
+    def metadata(self) -> dict:
+        """
+        Function to get the information saved with set_metadata.
+        """
+        with self._lock:
+            return {key: json.loads(value) for key, value in self.connection.execute('SELECT key, value FROM metadata')}
+
+    def add_batches(self, table_name:str, method:str, payloads:list) -> list:
+        """
+        Function to save the batches of an upload before they are sent.
+
+        Args:
+            - table_name: name of the table in Airtable
+            - method: 'patch' or 'post', the method used to send the batches
+            - payloads: list of dictionaries sent to Airtable
+        Returns:
+            - list with the ID of each batch
+        """
+        with self._lock:
+            ids = []
+            for payload in payloads:
+                cursor = self.connection.execute(
+                    'INSERT INTO batches (table_name, method, payload) VALUES (?, ?, ?)',
+                    (table_name, method, json.dumps(payload, ensure_ascii=False))
+                )
+                ids.append(cursor.lastrowid)
+            self.connection.commit()
+            return ids
+
+    def mark(self, batch_id:int, success:bool, error:str=None):
+        """
+        Function to save the result of a batch. A failed batch stays in the retry queue.
+
+        Args:
+            - batch_id: ID returned by add_batches
+            - success: whether Airtable acknowledged the batch
+            - error: content of the error response (default is None)
+        """
+        with self._lock:
+            self.connection.execute(
+                'UPDATE batches SET status = ?, attempts = attempts + 1, error = ? WHERE id = ?',
+                ('done' if success else 'failed', None if success else error, batch_id)
+            )
+            self.connection.commit()
+
+    def batches_left(self) -> list:
+        """
+        Function to get the batches that were not acknowledged: the ones never sent (or interrupted)
+        and the ones in the retry queue, in the order they were added.
+
+        Returns:
+            - list of tuples (batch_id, table_name, method, payload)
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT id, table_name, method, payload FROM batches WHERE status != 'done' ORDER BY id"
+            ).fetchall()
+        return [(batch_id, table_name, method, json.loads(payload)) for batch_id, table_name, method, payload in rows]
+
+    def count_left(self) -> int:
+        """
+        Function to count the batches that were not acknowledged.
+        """
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM batches WHERE status != 'done'").fetchone()[0]
+
+    def count_failed(self) -> int:
+        """
+        Function to count the batches in the retry queue.
+        """
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM batches WHERE status = 'failed'").fetchone()[0]
+
+    def close(self, remove_if_done:bool=False):
+        """
+        Function to close the checkpoint.
+
+        Args:
+            - remove_if_done: delete the file when every batch was acknowledged (default is False)
+        """
+        done = remove_if_done and self.metadata().get('complete') and not self.count_left()
+        self.connection.close()
+        if done:
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,3 +1,4 @@
+from pandas.api.types import is_integer_dtype, is_float_dtype
 from .rename_to_snake_case import rename_to_snake_case
 
 def get_dataset_columns_with_types(dataset, primary_field=None):
@@ -18,7 +19,7 @@ def get_dataset_columns_with_types(dataset, primary_field=None):
         dataset = dataset[[primary_field] + [col for col in dataset.columns if col != primary_field]]
 
     for column in dataset.columns:
-        if dataset[column].dtype == 'int64':
+        if is_integer_dtype(dataset[column].dtype):
             columns.append(
                 {
                     'name': rename_to_snake_case(column),
@@ -28,7 +29,7 @@ def get_dataset_columns_with_types(dataset, primary_field=None):
                     }
                 }
             )
-        elif dataset[column].dtype == 'float64':
+        elif is_float_dtype(dataset[column].dtype):
             columns.append(
                 {
                     'name': rename_to_snake_case(column),
@@ -0,0 +1,61 @@
+import queue
+import threading
+
+_DONE = object()
+
+def prefetch(iterable, depth:int=1):
+    """
+    Function to consume an iterable in a background thread.
+    Up to depth items are produced ahead of the consumer, so the next chunk is read and
+    treated while the current one is being uploaded, without loading the whole file.
+    Exceptions raised by the producer are raised again in the consumer. When the consumer stops early
+    (an exception or close), the source is closed in the producer thread before the consumer returns,
+    so a generator that holds a file runs its finally block.
+
+    Args:
+        - iterable: iterable to consume
+        - depth: maximum number of items produced ahead of the consumer (default is 1)
+    Yields:
+        - the items of the iterable, in order
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                buffer.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_DONE, e))
+        finally:
+            # The generator is closed in the thread that runs it, closing it from the consumer would fail
+            # while it is producing the next item.
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
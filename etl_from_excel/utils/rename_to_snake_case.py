@@ -1,9 +1,12 @@
 import unicodedata
 import re
+from functools import lru_cache
 
+@lru_cache(maxsize=4096)
 def rename_to_snake_case(text):
     """
     Function to convert a text to snake_case
+    The results are cached, since the same column names are converted by every chunk and every job.
     """
     text = unicodedata.normalize('NFKD', text.lower()).encode('ASCII', 'ignore').decode('ASCII')
     
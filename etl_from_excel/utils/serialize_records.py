@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+def serialize_column(column:pd.Series) -> np.ndarray:
+    """
+    Function to convert a column to JSON-ready values in one vectorized pass.
+    Missing values (NaN, NaT, NA) become None, datetimes become ISO strings in UTC
+    and numpy scalars become native Python types.
+
+    Args:
+        - column: pandas Series to convert
+    Returns:
+        - numpy object array with the converted values
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = serialize_column(pd.Series(column.cat.categories))
+        codes = column.cat.codes.to_numpy()
+        values = np.append(categories, None)[codes]
+        return values
+
+    missing = column.isna().to_numpy()
+
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        if column.dt.tz is not None:
+            column = column.dt.tz_convert('UTC')
+        values = column.dt.strftime(DATETIME_FORMAT).to_numpy(dtype=object)
+    elif pd.api.types.is_timedelta64_dtype(column.dtype):
+        values = column.astype(str).to_numpy(dtype=object)
+    else:
+        values = column.to_numpy(dtype=object)
+
+    if missing.any():
+        values[missing] = None
+
+    return values
+
+def serialize_records(dataset:pd.DataFrame) -> list:
+    """
+    Function to convert a dataset to the list of records expected by the Airtable API.
+    Each column is converted once with serialize_column, so there is no per-row pandas work.
+
+    Args:
+        - dataset: pandas DataFrame with the data
+    Returns:
+        - list of dictionaries in the format {"fields": {column: value}}
+    """
+    columns = list(dataset.columns)
+    values = [serialize_column(dataset[column]) for column in columns]
+
+    return [
+        {"fields": dict(zip(columns, row))}
+        for row in zip(*values)
+    ]
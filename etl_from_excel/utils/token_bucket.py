@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+class TokenBucket:
+    """
+    Thread-safe token bucket used to respect the requests-per-second limit of an API.
+    Each call to acquire() consumes one token, blocking until one is available.
+    """
+    def __init__(self, rate:float, capacity:int=None):
+        """
+        Args:
+            - rate: number of tokens added to the bucket per second
+            - capacity: maximum number of tokens stored (default is the rate, rounded up)
+        """
+        if rate <= 0:
+            raise ValueError("rate must be greater than zero")
+
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1, int(rate + 0.999))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now:float):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def acquire(self):
+        """
+        Function to take one token from the bucket, waiting until it is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds:float):
+        """
+        Function to stop handing out tokens for some time, e.g. after a 429 response.
+        All the threads sharing the bucket will wait, not only the one that was throttled.
+
+        Args:
+            - seconds: how long the bucket should stay closed
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated_at = self._paused_until
+
+class AsyncTokenBucket(TokenBucket):
+    """
+    Token bucket for coroutines running on one event loop, used by the async pipeline.
+    It waits with asyncio.sleep instead of blocking the thread, so the other requests keep going.
+    """
+    async def acquire(self):
+        """
+        Function to take one token from the bucket, waiting until it is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
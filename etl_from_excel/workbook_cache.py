@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import importlib.util
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+DEFAULT_WORKBOOK_CACHE_DIR = '.workbook_cache'
+DEFAULT_WORKBOOK_CACHE_MAX_MB = 500
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_content_hash(source) -> str:
+    """
+    Function to get the sha256 of the content of a file, reading it in blocks.
+    A file-like object is read from the start and put back at the start.
+
+    Args:
+        - source: path to the file or file-like object
+    """
+    digest = hashlib.sha256()
+
+    if hasattr(source, 'read'):
+        source.seek(0)
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+        source.seek(0)
+    else:
+        with open(source, 'rb') as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+def restore_missing_values(dataset:pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to turn the None values of the text columns back into NaN after a Feather round trip,
+    so the row hashes are the same as the ones of the DataFrame read from the Excel file.
+
+    Args:
+        - dataset: pandas DataFrame loaded from the cache
+    """
+    for column in dataset.select_dtypes(include='object').columns:
+        dataset[column] = dataset[column].where(dataset[column].notna(), np.nan)
+    return dataset
+
+class WorkbookCache:
+    """
+    Class that keeps the sheets already read, so a workbook uploaded again skips the Excel parsing.
+    Each entry is keyed by the content hash of the file, the sheet, the header row and the engine,
+    and keeps the whole sheet, so a job with other COLUMNS_TO_SELECT still finds it.
+    The entries are stored as Feather files (memory-mapped on load) when pyarrow is installed, or as pickle
+    files otherwise, and the least recently used ones are removed when the cache grows past its size cap.
+    """
+    def __init__(self, directory:str=None, max_mb:float=None):
+        """
+        Args:
+            - directory: folder where the cache is kept (default is .workbook_cache)
+            - max_mb: maximum size of the cache in MB (default is 500)
+        """
+        self.directory = directory or DEFAULT_WORKBOOK_CACHE_DIR
+        self.max_bytes = int((max_mb or DEFAULT_WORKBOOK_CACHE_MAX_MB) * 1024 ** 2)
+        self.use_feather = importlib.util.find_spec('pyarrow') is not None
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=30)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, file TEXT NOT NULL, format TEXT NOT NULL, '
+            'columns TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)'
+        )
+        self.connection.commit()
+
+    def build_key(self, source, sheet_name, header:int, engine:str) -> str:
+        """
+        Function to build the key of a sheet.
+
+        Args:
+            - source: path to the file or file-like object
+            - sheet_name: name or index of the sheet
+            - header: row number used as the header
+            - engine: reader engine used to parse the file
+        """
+        return json.dumps([file_content_hash(source), sheet_name, header, engine])
+
+    def get(self, key:str, usecols=None):
+        """
+        Function to load a sheet from the cache.
+
+        Args:
+            - key: key returned by build_key
+            - usecols: function that says which columns must be loaded, see TransformPlan.usecols (default is every column)
+        Returns:
+            - pandas DataFrame, or None when the sheet is not in the cache
+        """
+        entry = self.connection.execute('SELECT file, format, columns FROM entries WHERE key = ?', (key,)).fetchone()
+        if entry is None:
+            return None
+
+        file, file_format, columns = entry
+        path = os.path.join(self.directory, file)
+        columns = json.loads(columns)
+        selected = [column for column in columns if usecols is None or usecols(column)]
+
+        try:
+            if file_format == 'feather':
+                from pyarrow import feather
+                dataset = feather.read_table(path, columns=selected, memory_map=True).to_pandas()
+                dataset = restore_missing_values(dataset)
+            else:
+                dataset = pd.read_pickle(path)[selected]
+        except Exception as e:
+            logger.warning(f'Não foi possível ler a planilha do cache, ela será lida de novo: {e}')
+            self._delete(key, file)
+            return None
+
+        self.connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.connection.commit()
+        return dataset
+
+    def put(self, key:str, dataset:pd.DataFrame):
+        """
+        Function to save a sheet in the cache and remove the least recently used sheets past the size cap.
+
+        Args:
+            - key: key returned by build_key
+            - dataset: pandas DataFrame with the whole sheet
+        """
+        name = uuid.uuid4().hex
+        file, file_format = self._write(dataset, name)
+        size = os.path.getsize(os.path.join(self.directory, file))
+
+        if size > self.max_bytes:
+            os.remove(os.path.join(self.directory, file))
+            return
+
+        old = self.connection.execute('SELECT file FROM entries WHERE key = ?', (key,)).fetchone()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO entries (key, file, format, columns, size, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+            (key, file, file_format, json.dumps(list(dataset.columns)), size, time.time())
+        )
+        self.connection.commit()
+        if old:
+            self._remove_file(old[0])
+
+        self.evict()
+
+    def evict(self):
+        """
+        Function to remove the least recently used sheets until the cache fits in its size cap.
+        """
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, file, size in self.connection.execute(
+                'SELECT key, file, size FROM entries ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._delete(key, file)
+            total -= size
+            logger.info(f'Planilha removida do cache para liberar {size / 1024 ** 2:.1f} MB.')
+
+    def _can_use_feather(self, dataset:pd.DataFrame) -> bool:
+        # Only text is kept in object columns, other objects (e.g. numbers and text in the same column,
+        # or dates mixed with NaN) would come back with another dtype and change the row hashes.
+        if not self.use_feather or not all(isinstance(column, str) for column in dataset.columns):
+            return False
+        return all(
+            pd.api.types.infer_dtype(dataset[column], skipna=True) in ('string', 'empty')
+            for column in dataset.select_dtypes(include='object').columns
+        )
+
+    def _write(self, dataset:pd.DataFrame, name:str) -> tuple:
+        if self._can_use_feather(dataset):
+            try:
+                dataset.reset_index(drop=True).to_feather(os.path.join(self.directory, f'{name}.feather'))
+                return f'{name}.feather', 'feather'
+            except Exception:
+                self._remove_file(f'{name}.feather')
+
+        dataset.to_pickle(os.path.join(self.directory, f'{name}.pkl'))
+        return f'{name}.pkl', 'pickle'
+
+    def _delete(self, key:str, file:str):
+        self.connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self.connection.commit()
+        self._remove_file(file)
+
+    def _remove_file(self, file:str):
+        try:
+            os.remove(os.path.join(self.directory, file))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,26 @@
+from benchmarks.run_benchmarks import run_benchmarks
+from benchmarks.import_time import run_import_benchmark
+
+def test_run_benchmarks_smoke():
+    """
+    Test the run_benchmarks function with a tiny workbook.
+    It should time every stage and upload all the rows to the fake server, retrying the 429 responses.
+    """
+    results = run_benchmarks(rows=50, upload_rows=30, latency=0, rate_429=0.2, requests_per_second=1000)
+
+    assert set(results['treat_data']) == {'read', 'rename', 'quantity', 'date', 'hash', 'select', 'total'}
+    upload = results['send_to_airtable']
+    assert upload['upload_stats']['records'] == 30
+    assert upload['upload_stats']['error'] == 0
+    assert upload['upload_stats']['throttled'] == upload['server_requests']['429']
+
+def test_import_time_keeps_heavy_packages_lazy():
+    """
+    Test the run_import_benchmark function.
+    It should measure the cold import of each entry point, without loading the packages that are only needed on first use.
+    """
+    results = run_import_benchmark(runs=1)
+
+    for module, result in results.items():
+        assert result['total_ms'] > 0
+        assert result['eager_imports'] == [], module
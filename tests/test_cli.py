@@ -0,0 +1,74 @@
+import json
+import sqlite3
+import openpyxl
+from etl_from_excel.cli import main, collect_files
+
+def write_workbook(path, rows):
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['Produto', 'Quantidade'])
+    for i in range(rows):
+        workbook.active.append([f'{path.stem} {i}', f'{i} un'])
+    workbook.save(path)
+
+def test_collect_files(tmp_path):
+    """
+    Test the collect_files function.
+    It should expand the directories and the globs, skip the Excel lock files and remove the repeated paths.
+    """
+    for name in ('a.xlsx', 'b.xlsx', '~$a.xlsx', 'notas.txt'):
+        (tmp_path / name).write_bytes(b'')
+
+    files = collect_files([str(tmp_path), str(tmp_path / 'b*'), str(tmp_path / 'c.xlsx')])
+
+    assert files == [str(tmp_path / name) for name in ('a.xlsx', 'b.xlsx', 'c.xlsx')]
+
+def test_cli_processes_a_directory(tmp_path, capsys, monkeypatch):
+    """
+    Test the main function of the command line.
+    It should treat every workbook of the directory on the process pool, write them to the sink of the
+    config file and print the status of each file, returning 1 when some file failed.
+    """
+    for key in ('SHEET_NAME', 'HEADER_ROW', 'DATE_COLUMNS', 'COLUMNS_TO_SELECT'):
+        monkeypatch.delenv(key, raising=False)
+
+    folder = tmp_path / 'planilhas'
+    folder.mkdir()
+    for name, rows in (('janeiro', 3), ('fevereiro', 4)):
+        write_workbook(folder / f'{name}.xlsx', rows)
+    (folder / 'quebrado.xlsx').write_bytes(b'isto nao e uma planilha')
+
+    config = tmp_path / 'job.env'
+    config.write_text(
+        '# backfill\n'
+        'TABLE_NAME=vendas\n'
+        'QUANTITY_COLUMNS=Quantidade\n'
+        'COLUMNS_TO_HASH=Produto\n'
+        'OUTPUT_SINK=sqlite\n'
+        f'OUTPUT_DIR={tmp_path / "saida"}\n'
+    )
+
+    code = main([str(folder), '--config', str(config), '--workers', '2', '--report', str(tmp_path / 'report.json')])
+
+    assert code == 1
+    connection = sqlite3.connect(tmp_path / 'saida' / 'etl.sqlite')
+    assert connection.execute('SELECT COUNT(*) FROM vendas').fetchone() == (7,)
+    connection.close()
+
+    output = capsys.readouterr().out
+    assert 'Arquivos: 2 ok, 1 com erro' in output
+    assert f"- {folder / 'janeiro.xlsx'}: ok, 3 linhas para vendas" in output
+    assert f"- {folder / 'quebrado.xlsx'}: erro:" in output
+
+    with open(tmp_path / 'report.json') as file:
+        assert json.load(file)['details']['upload']['records'] == 7
+
+def test_cli_refuses_invalid_config(tmp_path, capsys):
+    """
+    Test the main function of the command line with an invalid config file.
+    It should return 2 before reading any file.
+    """
+    config = tmp_path / 'job.env'
+    config.write_text('OUTPUT_SINK=sqlite\n')
+
+    assert main([str(tmp_path), '--config', str(config)]) == 2
+    assert 'TABLE_NAME' in capsys.readouterr().err
@@ -22,22 +22,62 @@ async def test_on_message_with_template():
         await client.on_message(mock_message)
 
 @pytest.mark.asyncio
-async def test_on_message_with_file():
+async def test_on_message_with_file(monkeypatch):
     """
     Test the on_message method of the MyClient class.
-    It should save the file.
+    It should read the file into a buffer and process it with the variables of the message.
     """
+    monkeypatch.setenv('AIRTABLE_ACCESS_TOKEN', 'token')
+    monkeypatch.setenv('BASE_ID', 'base')
+    monkeypatch.delenv('TABLE_NAME', raising=False)
     client = MyClient()
+    await client.job_queue.start()
 
-    with patch.object(MyClient, 'user', new=MagicMock()), patch("os.remove") as mock_remove:
+    with patch.object(MyClient, 'user', new=MagicMock()), \
+            patch("etl_from_excel.etl.main") as mock_etl_main:
         mock_message = MagicMock()
         mock_message.author = MagicMock()
+        mock_message.content = "TABLE_NAME=Vendas\nHEADER_ROW=13"
         mock_message.attachments = [MagicMock(filename="test_file.xlsx")]
         mock_message.attachments[0].save = AsyncMock()
 
         mock_message.channel.send = AsyncMock()
 
         await client.on_message(mock_message)
+        await client.job_queue.join()
+        await client.job_queue.stop()
 
-        mock_message.attachments[0].save.assert_called_once_with("./temp_test_file.xlsx")
-        mock_remove.assert_called_once_with("./temp_test_file.xlsx")
\ No newline at end of file
+        buffer = mock_message.attachments[0].save.call_args[0][0]
+        mock_message.attachments[0].save.assert_called_once_with(buffer, seek_begin=True)
+        config = mock_etl_main.call_args[0][1]
+        mock_etl_main.assert_called_once_with(buffer, config, "test_file.xlsx")
+        assert buffer.closed
+        assert not os.path.exists("./temp_test_file.xlsx")
+        assert config.table_name == 'Vendas'
+        assert config.header_row == 13
+        assert 'TABLE_NAME' not in os.environ
+
+@pytest.mark.asyncio
+async def test_on_message_with_full_queue(monkeypatch):
+    """
+    Test the on_message method of the MyClient class when the job queue is full.
+    It should tell the channel without downloading the attachment.
+    """
+    monkeypatch.setenv('AIRTABLE_ACCESS_TOKEN', 'token')
+    monkeypatch.setenv('BASE_ID', 'base')
+    monkeypatch.setenv('BOT_QUEUE_SIZE', '0')
+    client = MyClient()
+
+    with patch.object(MyClient, 'user', new=MagicMock()):
+        mock_message = MagicMock()
+        mock_message.author = MagicMock()
+        mock_message.content = "TABLE_NAME=Vendas"
+        mock_message.attachments = [MagicMock(filename="test_file.xlsx")]
+        mock_message.attachments[0].save = AsyncMock()
+        mock_message.channel.send = AsyncMock()
+
+        await client.on_message(mock_message)
+
+    mock_message.attachments[0].save.assert_not_called()
+    assert 'fila está cheia' in mock_message.channel.send.call_args[0][0]
+    assert client.job_queue.pending == 0
@@ -1,11 +1,22 @@
 import os
+import asyncio
+import sqlite3
+import openpyxl
+import pandas as pd
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 from etl_from_excel.etl import main
+from etl_from_excel.job_config import JobConfig
+from etl_from_excel.airtable_client import AirtableClient
+from etl_from_excel import async_pipeline
+from etl_from_excel.async_pipeline import AsyncAirtableClient
+from etl_from_excel.run_report import RunReport
+from benchmarks.fake_airtable_server import FakeAirtableServer
 
+@patch('etl_from_excel.sinks.AirtableClient')
 @patch('etl_from_excel.etl.treat_data_pipeline')
-@patch('etl_from_excel.etl.send_to_airtable_pipeline')
-def test_etl_pipeline(mock_send_to_airtable, mock_treat_data_pipeline):
+@patch('etl_from_excel.sinks.send_to_airtable_pipeline')
+def test_etl_pipeline(mock_send_to_airtable, mock_treat_data_pipeline, mock_client_class):
     """
     Test the main function of the ETL pipeline.
     It should call the treat_data_pipeline and send_to_airtable_pipeline functions with the correct parameters.
@@ -21,16 +32,224 @@ def test_etl_pipeline(mock_send_to_airtable, mock_treat_data_pipeline):
     os.environ['COLUMNS_TO_HASH'] = 'Data,Produto'
 
     file_path = 'fake_path.xlsx'
-    main(file_path)
+    report = main(file_path)
 
     mock_treat_data_pipeline.assert_called_once_with(
         path=file_path,
         sheet_name='Sheet1',
         header=1,
-        quantity_column=['Quantidade'],
-        date_column=['Data'],
-        columns_to_select=['Data', 'Quantidade', 'Produto'],
-        columns_to_hash=['Data', 'Produto']
+        quantity_column=('Quantidade',),
+        date_column=('Data',),
+        columns_to_select=('Data', 'Quantidade', 'Produto'),
+        columns_to_hash=('Data', 'Produto'),
+        hash_processes=0,
+        quantity_units=None,
+        quantity_decimal=',',
+        date_formats=None,
+        optimize=True,
+        engine='auto',
+        cache=None,
+        report=report
     )
 
-    mock_send_to_airtable.assert_called_once_with(mock_df)
+    config = mock_send_to_airtable.call_args[1]['config']
+    mock_client = mock_client_class.from_config.return_value
+    mock_client_class.from_config.assert_called_once_with(config)
+    mock_send_to_airtable.assert_called_once_with(mock_client, mock_df, config=config, report=report, bucket=ANY, checkpoint=None)
+    mock_client.close.assert_called_once()
+    assert report.details['upload'] is mock_send_to_airtable.return_value
+
+def test_job_config_from_env():
+    """
+    Test the from_env method of the JobConfig class.
+    It should give precedence to the variables of the job, parse them and refuse invalid values.
+    """
+    environ = {'TABLE_NAME': 'padrao', 'HEADER_ROW': '1', 'INCREMENTAL_SYNC': 'false'}
+    config = JobConfig.from_env({'TABLE_NAME': 'vendas', 'FIELDS_TO_MERGE_ON': 'Data,Produto', 'INCREMENTAL_SYNC': 'sim'}, environ=environ)
+
+    assert config.table_name == 'vendas'
+    assert config.header_row == 1
+    assert config.fields_to_merge_on == ('Data', 'Produto')
+    assert config.incremental_sync is True
+    assert environ['TABLE_NAME'] == 'padrao'
+
+    with pytest.raises(AttributeError):
+        config.table_name = 'outra'
+
+    with pytest.raises(ValueError):
+        JobConfig.from_env({'HEADER_ROW': 'treze'}, environ={})
+
+    with pytest.raises(ValueError):
+        JobConfig.from_env({'TABLE_NAME': 'vendas'}, environ={}).validate()
+
+def test_etl_with_several_sheets(tmp_path, monkeypatch):
+    """
+    Test the main function of the ETL pipeline with several sheets.
+    It should treat every sheet in the process pool and send each one to its own table.
+    """
+    path = tmp_path / 'lojas.xlsx'
+    workbook = openpyxl.Workbook()
+    for index, store in enumerate(['Centro', 'Norte']):
+        sheet = workbook.active if index == 0 else workbook.create_sheet()
+        sheet.title = store
+        sheet.append(['Produto', 'Quantidade'])
+        for i in range(3 + index):
+            sheet.append([f'produto {i}', f'{i} un'])
+    workbook.save(path)
+
+    config = JobConfig.from_env({
+        'SHEET_NAME': '*',
+        'TABLE_NAME': 'vendas_{sheet}',
+        'QUANTITY_COLUMNS': 'Quantidade',
+        'COLUMNS_TO_HASH': 'Produto',
+        'AIRTABLE_REQUESTS_PER_SECOND': '1000',
+        'SHEET_PROCESSES': '2',
+    }, environ={})
+
+    with FakeAirtableServer() as server:
+        monkeypatch.setattr(
+            AirtableClient, 'from_config', classmethod(lambda cls, config: cls('token', 'base', api_url=server.api_url))
+        )
+        report = main(str(path), config)
+
+        sent = {name: len(records) for name, records in server.records.items() if records}
+        assert sent == {'vendas_Centro': 3, 'vendas_Norte': 4}
+
+    assert report.details['upload']['records'] == 7
+    assert set(report.details['tables']) == {'vendas_Centro', 'vendas_Norte'}
+    assert report.stages['read']['calls'] == 2
+
+def test_etl_with_async_pipeline(tmp_path, monkeypatch):
+    """
+    Test the main function of the ETL pipeline with ASYNC_PIPELINE.
+    It should read, treat and send every chunk through the async stages.
+    """
+    path = tmp_path / 'vendas.xlsx'
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['Produto', 'Quantidade'])
+    for i in range(45):
+        workbook.active.append([f'produto {i}', f'{i} un'])
+    workbook.save(path)
+
+    config = JobConfig.from_env({
+        'TABLE_NAME': 'vendas',
+        'QUANTITY_COLUMNS': 'Quantidade',
+        'COLUMNS_TO_HASH': 'Produto',
+        'FIELDS_TO_MERGE_ON': 'column_hash',
+        'AIRTABLE_REQUESTS_PER_SECOND': '1000',
+        'CHUNK_SIZE': '20',
+        'ASYNC_PIPELINE': 'true',
+    }, environ={})
+
+    with FakeAirtableServer() as server:
+        monkeypatch.setattr(
+            AirtableClient, 'from_config', classmethod(lambda cls, config: cls('token', 'base', api_url=server.api_url))
+        )
+        monkeypatch.setattr(
+            AsyncAirtableClient, 'from_config', classmethod(lambda cls, config: cls('token', 'base', api_url=server.api_url))
+        )
+        report = main(str(path), config)
+
+        assert len(server.records['vendas']) == 45
+        assert sorted(record['quantidade'] for record in server.records['vendas'].values()) == list(range(45))
+
+    assert report.details['upload']['records'] == 45
+    assert report.details['upload']['first_record_seconds'] is not None
+    assert report.stages['read']['calls'] == 4
+    assert report.stages['hash']['rows_out'] == 45
+
+def test_async_client_retries_timeouts(monkeypatch):
+    """
+    Test the patch method of the AsyncAirtableClient class when a request times out.
+    It should retry the request like a connection error instead of failing the upload.
+    """
+    class Response:
+        status = 200
+        headers = {}
+
+        async def read(self):
+            return b'{"records": []}'
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            pass
+
+    class Session:
+        calls = 0
+
+        def request(self, method, url, data):
+            self.calls += 1
+            if self.calls == 1:
+                raise asyncio.TimeoutError()
+            return Response()
+
+    async def sleep(seconds):
+        pass
+
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    client = AsyncAirtableClient('token', 'base')
+    client.session = Session()
+
+    response = asyncio.run(client.patch(client.table_url('vendas'), {'records': []}))
+
+    assert response.status_code == 200
+    assert client.session.calls == 2
+
+def test_async_pipeline_closes_reader_on_error(monkeypatch):
+    """
+    Test the run_async_pipeline function when a stage fails.
+    It should close the generator of the reader, so the workbook isn't left open.
+    """
+    closed = []
+
+    def read_chunks(*args, **kwargs):
+        try:
+            while True:
+                yield pd.DataFrame({'produto': ['a']})
+        finally:
+            closed.append(True)
+
+    def transform_chunk(chunk, config):
+        raise ValueError('erro no tratamento')
+
+    monkeypatch.setattr(async_pipeline, 'read_data_from_excel_in_chunks', read_chunks)
+    monkeypatch.setattr(async_pipeline, 'transform_chunk', transform_chunk)
+    config = JobConfig.from_env({'TABLE_NAME': 'vendas', 'ASYNC_PIPELINE': 'true'}, environ={})
+
+    with pytest.raises(ValueError):
+        asyncio.run(async_pipeline.run_async_pipeline('vendas.xlsx', config, RunReport(trace_memory=False)))
+
+    assert closed == [True]
+
+def test_etl_with_sqlite_sink(tmp_path):
+    """
+    Test the main function of the ETL pipeline with OUTPUT_SINK=sqlite.
+    It should write every chunk to the local database without Airtable, and update the rows when the file is sent again.
+    """
+    path = tmp_path / 'vendas.xlsx'
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['Produto', 'Quantidade'])
+    for i in range(25):
+        workbook.active.append([f'produto {i}', f'{i} un'])
+    workbook.save(path)
+
+    config = JobConfig.from_env({
+        'TABLE_NAME': 'vendas',
+        'QUANTITY_COLUMNS': 'Quantidade',
+        'COLUMNS_TO_HASH': 'Produto',
+        'CHUNK_SIZE': '10',
+        'OUTPUT_SINK': 'sqlite',
+        'OUTPUT_DIR': str(tmp_path / 'saida'),
+    }, environ={}).validate()
+
+    main(str(path), config)
+    report = main(str(path), config)
+
+    connection = sqlite3.connect(tmp_path / 'saida' / 'etl.sqlite')
+    rows = connection.execute('SELECT produto, quantidade FROM vendas ORDER BY quantidade').fetchall()
+    connection.close()
+    assert rows == [(f'produto {i}', i) for i in range(25)]
+    assert report.details['upload']['records'] == 25
+    assert report.stages['write']['calls'] == 3
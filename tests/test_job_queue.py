@@ -0,0 +1,71 @@
+import asyncio
+import tempfile
+import pytest
+from etl_from_excel.job_queue import Job, JobQueue, QueueFullError
+
+@pytest.mark.asyncio
+async def test_job_queue_round_robin_between_channels():
+    """
+    Test the JobQueue class.
+    It should alternate between the channels, so a burst in one channel doesn't block the others.
+    """
+    processed = []
+
+    async def handler(job):
+        processed.append(job.name)
+
+    queue = JobQueue(handler, workers=1)
+
+    # The jobs are queued before the workers start, so the order only depends on the fairness.
+    for name in ['a1', 'a2', 'a3']:
+        await queue.submit(Job(channel_id='a', name=name))
+    position = await queue.submit(Job(channel_id='b', name='b1'))
+
+    assert position == 2
+    assert [job.name for job in queue.order()] == ['a1', 'b1', 'a2', 'a3']
+
+    await queue.start()
+    await queue.join()
+    await queue.stop()
+
+    assert processed == ['a1', 'b1', 'a2', 'a3']
+
+@pytest.mark.asyncio
+async def test_job_queue_cancel_and_limit():
+    """
+    Test the JobQueue class.
+    It should cancel only pending jobs of the same channel and refuse jobs when the queue is full.
+    """
+    queue = JobQueue(lambda job: None, workers=1, max_pending=2)
+
+    first = Job(channel_id='a', name='first')
+    second = Job(channel_id='a', name='second')
+    await queue.submit(first)
+    await queue.submit(second)
+
+    with pytest.raises(QueueFullError):
+        await queue.submit(Job(channel_id='b', name='third'))
+
+    assert not queue.cancel(first.id, channel_id='b')
+    assert queue.cancel(first.id, channel_id='a')
+    assert first.status == 'cancelled'
+    assert queue.position(second.id) == 1
+    assert queue.pending == 1
+
+@pytest.mark.asyncio
+async def test_job_queue_stop_closes_pending_buffers():
+    """
+    Test the stop method of the JobQueue class.
+    It should drop the jobs still waiting and close the buffers with their files.
+    """
+    queue = JobQueue(lambda job: None, workers=1)
+    buffer = tempfile.SpooledTemporaryFile()
+    job = Job(channel_id='a', name='arquivo.xlsx', data={'buffer': buffer, 'name': 'arquivo.xlsx'})
+    await queue.submit(job)
+
+    await queue.stop()
+
+    assert buffer.closed
+    assert job.status == 'cancelled'
+    assert queue.pending == 0
+    await asyncio.wait_for(queue.join(), timeout=1)
@@ -0,0 +1,55 @@
+import json
+import tracemalloc
+from etl_from_excel.run_report import RunReport
+
+def test_run_report_accumulates_stages_and_http_latencies():
+    """
+    Test the RunReport class.
+    It should add up a stage that runs several times and compute the latency percentiles per endpoint.
+    """
+    report = RunReport(name='vendas.xlsx', trace_memory=True)
+
+    with report:
+        for rows in (10, 5):
+            with report.stage('hash', rows_in=rows) as stage:
+                stage['rows_out'] = rows
+    assert not tracemalloc.is_tracing()
+
+    for milliseconds in range(1, 101):
+        report.record_http('PATCH records', milliseconds / 1000, 200)
+
+    result = report.to_dict()
+
+    assert result['stages']['hash']['calls'] == 2
+    assert result['stages']['hash']['rows_in'] == 15
+    assert result['stages']['hash']['rows_out'] == 15
+    assert 'alloc_peak_mb' in result['stages']['hash']
+    assert result['http']['PATCH records']['count'] == 100
+    assert round(result['http']['PATCH records']['p50_ms']) == 50
+    assert result['http']['PATCH records']['status_codes'] == {200: 100}
+    assert 'PATCH records' in report.summary()
+    json.dumps(result, default=str)
+
+def test_run_report_shares_tracing_between_reports():
+    """
+    Test the finish method and the memory of the stages of the RunReport class with two reports at the same time.
+    It should keep tracing until the last report finishes and not report the peak of stages that overlapped.
+    """
+    first = RunReport(name='a.xlsx', trace_memory=True)
+    second = RunReport(name='b.xlsx', trace_memory=True)
+
+    with first.stage('read'):
+        with second.stage('read'):
+            pass
+    with first.stage('hash'):
+        data = list(range(1000))
+
+    first.finish()
+    assert tracemalloc.is_tracing()
+    second.finish()
+    assert not tracemalloc.is_tracing()
+
+    assert first.stages['read']['alloc_peak_mb'] is None
+    assert second.stages['read']['alloc_peak_mb'] is None
+    assert first.stages['hash']['alloc_peak_mb'] > 0
+    assert len(data) == 1000
@@ -0,0 +1,217 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+from unittest.mock import patch, MagicMock
+from etl_from_excel.airtable_client import AirtableClient
+from etl_from_excel.send_to_airtable import (
+    upsert_data_airtable, upsert_records_airtable, table_exists, send_to_airtable_pipeline,
+    create_table, verify_column_exists, resume_upload
+)
+from etl_from_excel.job_config import JobConfig
+from etl_from_excel.schema_cache import SCHEMA_CACHE
+from etl_from_excel.upload_checkpoint import UploadCheckpoint, list_checkpoints
+
+def make_response(status_code, headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.content = b''
+    return response
+
+@patch('etl_from_excel.send_to_airtable.send_upsert_request_to_airtable')
+def test_upsert_data_airtable_sends_all_batches(mock_send):
+    """
+    Test the upsert_data_airtable function.
+    It should send every batch and report the records sent.
+    """
+    mock_send.return_value = make_response(200)
+    dataset = pd.DataFrame({'produto': [f'p{i}' for i in range(25)], 'quantidade': range(25)})
+
+    stats = upsert_data_airtable(MagicMock(), dataset, 'tabela', ['Produto'], max_workers=3, requests_per_second=1000)
+
+    assert mock_send.call_count == 3
+    assert stats['success'] == 3
+    assert stats['error'] == 0
+    assert stats['records'] == 25
+    assert 1 <= stats['max_in_flight'] <= 3
+
+@patch('etl_from_excel.send_to_airtable.send_upsert_request_to_airtable')
+def test_upsert_data_airtable_retries_throttled_batches(mock_send):
+    """
+    Test the upsert_data_airtable function.
+    It should wait and retry a batch throttled with 429 instead of counting it as an error.
+    """
+    mock_send.side_effect = [make_response(429, {'Retry-After': '0'}), make_response(200)]
+    dataset = pd.DataFrame({'produto': ['a', 'b']})
+
+    stats = upsert_data_airtable(MagicMock(), dataset, 'tabela', None, max_workers=1, requests_per_second=1000)
+
+    assert mock_send.call_count == 2
+    assert stats['throttled'] == 1
+    assert stats['success'] == 1
+    assert stats['error'] == 0
+
+class FakeMetaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({'tables': [{'name': 'vendas', 'fields': []}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def test_table_exists_with_local_server():
+    """
+    Test the table_exists function against a local stand-in for the Airtable API.
+    It should find the table through the client session.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeMetaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        api_url = f'http://127.0.0.1:{server.server_address[1]}/v0'
+        with AirtableClient('token', 'base', api_url=api_url) as client:
+            assert table_exists(client, 'vendas') == {'name': 'vendas', 'fields': []}
+            assert table_exists(client, 'outra') is None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_table_exists_uses_schema_cache():
+    """
+    Test the table_exists function with the shared schema cache.
+    It should download the tables once, download them again after a table is created
+    and download them again when the cached schema is too old.
+    """
+    client = MagicMock()
+    client.api_url = 'http://schema-cache-test/v0'
+    client.base_id = 'base'
+    tables = make_response(200)
+    tables.json.return_value = {'tables': [{'name': 'vendas', 'fields': [{'name': 'produto'}, {'name': 'column_hash'}]}]}
+    created = make_response(200)
+    created.json.return_value = {'name': 'estoque', 'fields': [{'name': 'produto'}]}
+    client.get.return_value = tables
+    client.post.return_value = created
+
+    try:
+        table = table_exists(client, 'vendas')
+        assert table == {'name': 'vendas', 'fields': [{'name': 'produto'}, {'name': 'column_hash'}]}
+        assert verify_column_exists(table, 'column_hash')
+        assert not verify_column_exists(table, 'quantidade')
+        assert table_exists(client, 'estoque') is None
+
+        assert client.get.call_count == 1
+
+        create_table(client, [{'name': 'produto', 'type': 'singleLineText'}], 'Estoque')
+        tables.json.return_value['tables'].append(created.json.return_value)
+        assert table_exists(client, 'estoque') == {'name': 'estoque', 'fields': [{'name': 'produto'}]}
+        assert client.get.call_count == 2
+        assert table_exists(client, 'vendas') is not None
+        assert client.get.call_count == 2
+
+        table_exists(client, 'vendas', max_age=0)
+        assert client.get.call_count == 3
+    finally:
+        SCHEMA_CACHE.invalidate(client)
+
+@patch('etl_from_excel.send_to_airtable.send_upsert_request_to_airtable')
+def test_resume_upload_sends_batches_left(mock_send, tmp_path):
+    """
+    Test the resume_upload function with an upload that had a failed batch and was interrupted.
+    It should send only the batches that were not acknowledged and empty the retry queue.
+    """
+    mock_send.side_effect = [make_response(200), make_response(422), make_response(200)]
+    records = [{'fields': {'produto': f'p{i}', 'quantidade': i}} for i in range(25)]
+
+    checkpoint = UploadCheckpoint(directory=str(tmp_path))
+    checkpoint.set_metadata(name='vendas.xlsx', complete=True)
+    stats = upsert_records_airtable(
+        MagicMock(), records, 'vendas', ['Produto'], max_workers=1, requests_per_second=1000, checkpoint=checkpoint
+    )
+    assert stats['error'] == 1
+    assert checkpoint.count_failed() == 1
+    # A batch saved but never sent, as if the bot had stopped.
+    checkpoint.add_batches('vendas', 'patch', [{'records': [{'fields': {'produto': 'p99', 'quantidade': 99}}]}])
+    assert [entry['left'] for entry in list_checkpoints(str(tmp_path))] == [2]
+
+    mock_send.reset_mock()
+    mock_send.side_effect = None
+    mock_send.return_value = make_response(200)
+    stats = resume_upload(MagicMock(), checkpoint, config=JobConfig(requests_per_second=1000))
+
+    assert stats['records'] == 11
+    assert [call[0][1]['records'][0]['fields']['produto'] for call in mock_send.call_args_list] == ['p10', 'p99']
+    assert checkpoint.count_left() == 0
+    checkpoint.close(remove_if_done=True)
+    assert list_checkpoints(str(tmp_path)) == []
+
+@patch('etl_from_excel.send_to_airtable.table_exists')
+@patch('etl_from_excel.send_to_airtable.send_upsert_request_to_airtable')
+def test_incremental_sync_skips_unchanged_rows(mock_send, mock_table_exists, monkeypatch, tmp_path):
+    """
+    Test the send_to_airtable_pipeline function with INCREMENTAL_SYNC.
+    It should only send the rows that are new or changed since the last sync.
+    """
+    monkeypatch.setenv('INCREMENTAL_SYNC', 'true')
+    monkeypatch.setenv('SYNC_INDEX_DIR', str(tmp_path))
+    monkeypatch.setenv('TABLE_NAME', 'vendas')
+    monkeypatch.setenv('FIELDS_TO_MERGE_ON', 'Produto')
+    monkeypatch.setenv('AIRTABLE_REQUESTS_PER_SECOND', '1000')
+    mock_table_exists.return_value = {'name': 'vendas', 'fields': [{'name': 'produto'}]}
+    mock_send.return_value = make_response(200)
+
+    first = pd.DataFrame({'produto': [f'p{i}' for i in range(15)], 'quantidade': range(15)})
+    stats = send_to_airtable_pipeline(MagicMock(), first)
+    assert stats['records'] == 15
+    assert stats['skipped'] == 0
+
+    second = first.copy()
+    second.loc[3, 'quantidade'] = 100
+    stats = send_to_airtable_pipeline(MagicMock(), second)
+    assert stats['records'] == 1
+    assert stats['skipped'] == 14
+    assert mock_send.call_args[0][1]['records'] == [{'fields': {'produto': 'p3', 'quantidade': 100}}]
+
+@patch('etl_from_excel.send_to_airtable.table_exists')
+@patch('etl_from_excel.send_to_airtable.send_create_request_to_airtable')
+@patch('etl_from_excel.send_to_airtable.send_upsert_request_to_airtable')
+def test_prefetch_remote_splits_creates_and_updates(mock_upsert, mock_create, mock_table_exists, monkeypatch):
+    """
+    Test the send_to_airtable_pipeline function with PREFETCH_REMOTE.
+    It should update changed records by id, create the new ones and skip the unchanged ones.
+    """
+    monkeypatch.setenv('PREFETCH_REMOTE', 'true')
+    monkeypatch.delenv('INCREMENTAL_SYNC', raising=False)
+    monkeypatch.delenv('FIELDS_TO_MERGE_ON', raising=False)
+    monkeypatch.setenv('TABLE_NAME', 'vendas')
+    monkeypatch.setenv('AIRTABLE_REQUESTS_PER_SECOND', '1000')
+    mock_table_exists.return_value = {'name': 'vendas', 'fields': [{'name': 'column_hash'}]}
+    mock_upsert.return_value = make_response(200)
+    mock_create.return_value = make_response(200)
+
+    client = MagicMock()
+    first_page = make_response(200)
+    first_page.json.return_value = {
+        'records': [{'id': 'rec1', 'fields': {'column_hash': 'h1', 'quantidade': 1}}],
+        'offset': 'page2'
+    }
+    second_page = make_response(200)
+    second_page.json.return_value = {
+        'records': [{'id': 'rec2', 'fields': {'column_hash': 'h2', 'quantidade': 2}}]
+    }
+    client.get.side_effect = [first_page, second_page]
+
+    dataset = pd.DataFrame({'column_hash': ['h1', 'h2', 'h3'], 'quantidade': [1.0, 5.0, 3.0]})
+    stats = send_to_airtable_pipeline(client, dataset)
+
+    assert client.get.call_count == 2
+    assert client.get.call_args[1]['params']['fields[]'] == ['column_hash', 'quantidade']
+    assert mock_create.call_args[0][1]['records'] == [{'fields': {'column_hash': 'h3', 'quantidade': 3.0}}]
+    assert mock_upsert.call_args[0][1] == {'records': [{'id': 'rec2', 'fields': {'column_hash': 'h2', 'quantidade': 5.0}}]}
+    assert stats['records'] == 2
+    assert stats['skipped'] == 1
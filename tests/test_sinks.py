@@ -0,0 +1,97 @@
+import sqlite3
+import importlib.util
+import pandas as pd
+import pytest
+from etl_from_excel.job_config import JobConfig, InvalidConfigError
+from etl_from_excel.run_report import RunReport
+from etl_from_excel.sinks import create_sink, to_fixed_schema, Sink, SqliteSink, CsvSink, ParquetSink, PARQUET_ENGINES
+from etl_from_excel.treat_data import optimize_dtypes
+
+def build_config(tmp_path, **variables):
+    return JobConfig.from_env(dict({'TABLE_NAME': 'Vendas', 'OUTPUT_DIR': str(tmp_path)}, **variables), environ={})
+
+def test_sqlite_sink_upserts_on_merge_key(tmp_path):
+    """
+    Test the SqliteSink class.
+    It should create the table, update the rows with the same merge key, insert the new ones
+    and add the columns that appear in a later chunk.
+    """
+    config = build_config(tmp_path, OUTPUT_SINK='sqlite', FIELDS_TO_MERGE_ON='Produto')
+    first = pd.DataFrame({'produto': ['a', 'b'], 'quantidade': [1, 2], 'data': pd.to_datetime(['2024-01-01', None]).tz_localize('UTC')})
+    second = pd.DataFrame({'produto': ['b', 'c'], 'quantidade': [20, 3], 'valor': [1.5, 2.5]})
+
+    report = RunReport(trace_memory=False)
+    with create_sink(config, report) as sink:
+        assert isinstance(sink, SqliteSink)
+        stats = sink.write_chunks([first, second])
+
+    assert stats['records'] == 4
+    assert report.stages['write']['calls'] == 2
+
+    connection = sqlite3.connect(tmp_path / 'etl.sqlite')
+    rows = connection.execute('SELECT produto, quantidade, data, valor FROM vendas ORDER BY produto').fetchall()
+    connection.close()
+    assert rows == [('a', 1, '2024-01-01T00:00:00.000000Z', None), ('b', 20, None, 1.5), ('c', 3, None, 2.5)]
+
+def test_csv_sink_appends_rows(tmp_path):
+    """
+    Test the CsvSink class.
+    It should append every chunk to the file of the table, writing the header only once.
+    """
+    config = build_config(tmp_path, OUTPUT_SINK='csv')
+    with create_sink(config) as sink:
+        assert isinstance(sink, CsvSink)
+        sink.write(pd.DataFrame({'produto': ['a'], 'quantidade': [1]}))
+        sink.write(pd.DataFrame({'produto': ['b'], 'quantidade': [2]}), 'Outra Tabela')
+        sink.write(pd.DataFrame({'produto': ['c'], 'quantidade': [3]}))
+
+    assert pd.read_csv(tmp_path / 'vendas.csv').to_dict('list') == {'produto': ['a', 'c'], 'quantidade': [1, 3]}
+    assert pd.read_csv(tmp_path / 'outra_tabela.csv').to_dict('list') == {'produto': ['b'], 'quantidade': [2]}
+
+    with create_sink(config) as sink:
+        with pytest.raises(ValueError):
+            sink.write(pd.DataFrame({'quantidade': [4], 'produto': ['d']}))
+    assert len(pd.read_csv(tmp_path / 'vendas.csv')) == 2
+
+    with pytest.raises(TypeError):
+        Sink(config)
+
+def test_parquet_sink(tmp_path):
+    """
+    Test the ParquetSink class.
+    It should write one file for each chunk in the folder of the table, or refuse to start without a Parquet engine.
+    """
+    config = build_config(tmp_path, OUTPUT_SINK='parquet')
+    if not any(importlib.util.find_spec(engine) for engine in PARQUET_ENGINES):
+        with pytest.raises(InvalidConfigError):
+            create_sink(config)
+        return
+
+    with create_sink(config) as sink:
+        assert isinstance(sink, ParquetSink)
+        sink.write_chunks([pd.DataFrame({'produto': ['a']}), pd.DataFrame({'produto': ['b']})])
+
+    assert sorted(pd.read_parquet(tmp_path / 'vendas')['produto']) == ['a', 'b']
+
+def test_to_fixed_schema_undoes_compact_dtypes():
+    """
+    Test the to_fixed_schema function.
+    It should give the same dtypes for chunks that optimize_dtypes stored in different compact dtypes.
+    """
+    first = optimize_dtypes(pd.DataFrame({'produto': ['a', 'a', 'a'], 'quantidade': [1, 2, 3], 'valor': [1.5, 2.5, 3.5]}))
+    second = optimize_dtypes(pd.DataFrame({'produto': ['a', 'b', 'c'], 'quantidade': [1000, 2, 3], 'valor': [1.5, 2.5, 3.5]}))
+    assert first.dtypes.to_dict() != second.dtypes.to_dict()
+
+    fixed = [to_fixed_schema(chunk) for chunk in (first, second)]
+    assert fixed[0].dtypes.to_dict() == fixed[1].dtypes.to_dict() == {'produto': object, 'quantidade': 'int64', 'valor': 'float64'}
+    assert fixed[1]['produto'].tolist() == ['a', 'b', 'c']
+
+def test_local_sink_does_not_need_airtable_credentials(tmp_path):
+    """
+    Test the validate method of the JobConfig class with a local sink.
+    It should only require the credentials of Airtable when the data is sent there.
+    """
+    assert build_config(tmp_path, OUTPUT_SINK='sqlite').validate().output_sink == 'sqlite'
+
+    with pytest.raises(InvalidConfigError):
+        build_config(tmp_path).validate()
@@ -0,0 +1,386 @@
+import io
+import os
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+from etl_from_excel.run_report import RunReport
+from etl_from_excel.utils.serialize_records import serialize_records
+from etl_from_excel.workbook_cache import WorkbookCache
+from etl_from_excel.transform_plan import compile_transform_plan, MissingColumnsError
+from etl_from_excel.treat_data import (
+    read_data_from_excel,
+    read_data_from_excel_in_chunks,
+    get_reader_engine,
+    treat_dataset,
+    treat_data_pipeline,
+    treat_data_pipeline_in_chunks,
+    treat_quantity_column,
+    parse_quantity,
+    treat_date_column,
+    optimize_dtypes,
+    generate_row_hash,
+    add_hash_column
+)
+
+def write_workbook(path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = 'Vendas'
+    sheet['A1'] = 'Relatório de vendas'
+    sheet.append([])
+    sheet.append(['Data/hora', 'Produto', 'Quantidade', 'Quantidade'])
+    for i in range(7):
+        sheet.append([f'0{i + 1}/01/2024 10:00:00', f'produto {i}', f'{i} un', i])
+    sheet.append([])
+    sheet.append(['09/01/2024 10:00:00', None, '9 un', 9])
+    sheet.append([])
+    workbook.save(path)
+
+def test_read_data_from_excel_in_chunks_matches_read_excel(tmp_path):
+    """
+    Test the read_data_from_excel_in_chunks function.
+    It should yield chunks of the requested size that together match read_data_from_excel.
+    """
+    path = tmp_path / 'vendas.xlsx'
+    write_workbook(path)
+
+    chunks = list(read_data_from_excel_in_chunks(path, sheet_name='Vendas', header=2, chunk_size=3))
+    expected = read_data_from_excel(path, sheet_name='Vendas', header=2)
+
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3]
+    result = pd.concat(chunks, ignore_index=True)
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(result.astype(str), expected.astype(str))
+
+def test_read_data_from_excel_in_chunks_with_blank_header_cells(tmp_path):
+    """
+    Test the read_data_from_excel_in_chunks function with data to the right of blank header cells.
+    It should keep those columns as "Unnamed: <position>", like read_data_from_excel, also when the whole header is blank.
+    """
+    path = tmp_path / 'vendas.xlsx'
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['produto', None, 'quantidade'])
+    sheet.append(['a', 'x', 1, 10])
+    sheet.append([])
+    sheet.append(['b', None, 2])
+    sheet.append(['c', 'y', 3, 30, 'z'])
+    blank = workbook.create_sheet('Sem cabeçalho')
+    blank.append([None, None])
+    blank.append([1, 2])
+    blank.append([3])
+    workbook.save(path)
+
+    for sheet_name in ('Sheet', 'Sem cabeçalho'):
+        expected = read_data_from_excel(path, sheet_name=sheet_name)
+        chunks = list(read_data_from_excel_in_chunks(path, sheet_name=sheet_name, chunk_size=3))
+        result = pd.concat(chunks, ignore_index=True)
+        assert list(result.columns) == list(expected.columns)
+        pd.testing.assert_frame_equal(result.astype(str), expected.astype(str))
+
+    assert list(read_data_from_excel(path, sheet_name='Sheet')) == ['produto', 'Unnamed: 1', 'quantidade', 'Unnamed: 3', 'Unnamed: 4']
+
+def test_treat_data_pipeline_in_chunks_keeps_hashes(tmp_path):
+    """
+    Test the treat_data_pipeline_in_chunks function against treat_data_pipeline.
+    It should read the missing text and error cells as NaN and generate the same hashes, even when
+    a missing cell makes a number column float in only one of the chunks.
+    """
+    path = tmp_path / 'vendas.xlsx'
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['Codigo', 'Local', 'Valor'])
+    sheet.append([1, 'Loja A', 1.5])
+    sheet.append([2, 'N/A', 2])
+    sheet.append([None, 'Loja B', 3.0])
+    sheet.append([4, 'null', 4.25])
+    sheet['B6'] = '#DIV/0!'
+    sheet['B6'].data_type = 'e'
+    sheet['A6'] = 5
+    workbook.save(path)
+
+    options = {'columns_to_hash': ['Codigo', 'Local', 'Valor'], 'optimize': False}
+    expected = treat_data_pipeline(path, 'Sheet', 0, **options)
+    chunks = list(treat_data_pipeline_in_chunks(path, 'Sheet', 0, chunk_size=2, **options))
+    result = pd.concat(chunks, ignore_index=True)
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert result['local'].isna().tolist() == expected['local'].isna().tolist() == [False, True, False, True, True]
+    assert result['column_hash'].tolist() == expected['column_hash'].tolist()
+
+def test_read_data_from_excel_from_buffer(tmp_path):
+    """
+    Test the read_data_from_excel and read_data_from_excel_in_chunks functions with an in-memory buffer.
+    It should read the same data as from the file on disk.
+    """
+    path = tmp_path / 'vendas.xlsx'
+    write_workbook(path)
+    buffer = io.BytesIO(path.read_bytes())
+
+    expected = read_data_from_excel(path, sheet_name='Vendas', header=2)
+    pd.testing.assert_frame_equal(read_data_from_excel(buffer, sheet_name='Vendas', header=2), expected)
+
+    buffer.seek(0)
+    chunks = list(read_data_from_excel_in_chunks(buffer, sheet_name='Vendas', header=2, chunk_size=5))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True).astype(str), expected.astype(str))
+
+def test_read_data_from_excel_only_needed_columns(tmp_path):
+    """
+    Test the usecols method of the TransformPlan class with read_data_from_excel and read_data_from_excel_in_chunks.
+    It should read only the columns used by the job, with the same values as the full read.
+    """
+    path = tmp_path / 'vendas.xlsx'
+    write_workbook(path)
+    usecols = compile_transform_plan(columns_to_select=['Produto'], columns_to_hash=['Data/hora']).usecols()
+
+    full = read_data_from_excel(path, sheet_name='Vendas', header=2)
+    expected = full[['Data/hora', 'Produto']]
+    result = read_data_from_excel(path, sheet_name='Vendas', header=2, engine='openpyxl', usecols=usecols)
+    pd.testing.assert_frame_equal(result, expected)
+
+    chunks = list(read_data_from_excel_in_chunks(path, sheet_name='Vendas', header=2, chunk_size=4, usecols=usecols))
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True).astype(str), expected.astype(str))
+
+    assert compile_transform_plan(columns_to_hash=['Data/hora']).usecols() is None
+    assert get_reader_engine('openpyxl') == 'openpyxl'
+    with pytest.raises(ValueError):
+        get_reader_engine('xlrd')
+
+def test_treat_data_pipeline_with_workbook_cache(tmp_path):
+    """
+    Test the treat_data_pipeline function with a WorkbookCache.
+    It should read the workbook once, find it again with other columns and give the same result as without the cache.
+    """
+    path = tmp_path / 'vendas.xlsx'
+    write_workbook(path)
+    options = {'sheet_name': 'Vendas', 'header': 2, 'columns_to_hash': ['Data/hora', 'Produto']}
+
+    with WorkbookCache(str(tmp_path / 'cache')) as cache:
+        first = RunReport(trace_memory=False)
+        treat_data_pipeline(path, columns_to_select=['Produto'], cache=cache, report=first, **options)
+        second = RunReport(trace_memory=False)
+        result = treat_data_pipeline(path, columns_to_select=['Data/hora', 'Quantidade'], cache=cache, report=second, **options)
+
+    expected = treat_data_pipeline(path, columns_to_select=['Data/hora', 'Quantidade'], **options)
+    assert first.details['workbook_cache'] == 'miss'
+    assert second.details['workbook_cache'] == 'hit'
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_treat_dataset_with_transform_plan():
+    """
+    Test the treat_dataset function with the compiled TransformPlan.
+    It should reuse the plan of the same options, drop the unneeded columns before the treatments
+    and refuse a dataset without the columns used by the job before treating it.
+    """
+    plan = compile_transform_plan(['Quantidade', 'Extra'], None, ['Produto', 'Quantidade'], ['Produto'])
+    assert compile_transform_plan(('Quantidade', 'Extra'), (), ('Produto', 'Quantidade'), ('Produto',)) is plan
+    assert plan.quantity_columns == ('quantidade',)
+    assert plan.output_columns == ('produto', 'quantidade', 'column_hash')
+
+    report = RunReport(trace_memory=False)
+    dataset = pd.DataFrame({'Produto': ['a', 'b'], 'Quantidade': ['1 un', '2 un'], 'Extra': ['x', '3 un'], 'Outra': [1, 2]})
+    result = treat_dataset(
+        dataset, quantity_column=['Quantidade', 'Extra'], columns_to_select=['Produto', 'Quantidade'],
+        columns_to_hash=['Produto'], report=report
+    )
+
+    assert list(result.columns) == ['produto', 'quantidade', 'column_hash']
+    assert report.details['invalid_quantities'] == {'quantidade': 0}
+
+    report = RunReport(trace_memory=False)
+    with pytest.raises(MissingColumnsError, match='valor'):
+        treat_dataset(pd.DataFrame({'Produto': ['a']}), quantity_column=['Valor'], columns_to_hash=['Produto'], report=report)
+    assert 'quantity' not in report.stages
+
+def test_treat_dataset_with_column_hash_selected():
+    """
+    Test the treat_dataset function with column_hash in the columns to select.
+    It should create the hash column instead of looking for it in the sheet, keeping the selected order.
+    """
+    plan = compile_transform_plan(None, None, ['column_hash', 'Produto'], ['Produto'])
+    assert 'column_hash' not in plan.required_columns
+    assert plan.output_columns == ('column_hash', 'produto')
+
+    dataset = pd.DataFrame({'Produto': ['a', 'b'], 'Outra': [1, 2]})
+    result = treat_dataset(dataset, columns_to_select=['column_hash', 'Produto'], columns_to_hash=['Produto'])
+
+    assert list(result.columns) == ['column_hash', 'produto']
+    assert result['column_hash'].tolist() == add_hash_column(pd.DataFrame({'produto': ['a', 'b']}), ['produto'])['column_hash'].tolist()
+
+def test_workbook_cache_evicts_least_recently_used(tmp_path):
+    """
+    Test the WorkbookCache class.
+    It should remove the least recently used sheets when the cache grows past its size cap.
+    """
+    dataset = pd.DataFrame({'produto': [f'produto {i}' for i in range(1000)], 'quantidade': range(1000)})
+
+    with WorkbookCache(str(tmp_path), max_mb=1) as cache:
+        cache.put('a', dataset)
+        size = cache.connection.execute('SELECT size FROM entries').fetchone()[0]
+        cache.max_bytes = int(size * 2.5)
+        cache.put('b', dataset)
+        assert cache.get('a') is not None
+        cache.put('c', dataset)
+
+        assert cache.get('b') is None
+        pd.testing.assert_frame_equal(cache.get('a'), dataset)
+        assert cache.get('c') is not None
+        assert len(os.listdir(tmp_path)) == 3
+
+def test_treat_quantity_column():
+    """
+    Test the treat_quantity_column function.
+    It should convert units and Brazilian separators, keep numeric cells, and count the invalid cells as NaN.
+    """
+    report = RunReport(trace_memory=False)
+    dataset = pd.DataFrame({'quantidade': ['3 un', '1.234,5 UN', '2,5', '1.5', 7, np.nan, 'abc', '  ', '10 kg']})
+
+    result = treat_quantity_column(dataset, 'quantidade', units=['un', 'kg'], report=report)
+
+    expected = [3, 1234.5, 2.5, 1.5, 7, np.nan, np.nan, np.nan, 10]
+    np.testing.assert_array_equal(result['quantidade'].to_numpy(), np.array(expected))
+    assert report.details['invalid_quantities'] == {'quantidade': 1}
+
+    integers = treat_quantity_column(pd.DataFrame({'quantidade': ['1 un', '20 un', '300 un']}), 'quantidade')
+    assert integers['quantidade'].dtype == 'int16'
+    assert integers['quantidade'].tolist() == [1, 20, 300]
+
+def test_parse_quantity_without_text_cells():
+    """
+    Test the parse_quantity function with columns that have no text cell.
+    It should convert an object column with only numbers and a bool column without using the str accessor.
+    """
+    numbers, invalid = parse_quantity(pd.Series([1, 2, None], dtype=object))
+    np.testing.assert_array_equal(numbers.to_numpy(), np.array([1, 2, np.nan]))
+    assert invalid == 0
+
+    integers, invalid = parse_quantity(pd.Series([1, 2], dtype=object))
+    assert integers.dtype == 'int8'
+    assert integers.tolist() == [1, 2]
+
+    decimals, invalid = parse_quantity(pd.Series(['10.0 un', '2,0', 3.0], dtype=object), decimal=',')
+    assert decimals.dtype == 'float64'
+    assert decimals.tolist() == [10.0, 2.0, 3.0]
+    assert parse_quantity(pd.Series([1.0, 2.0]))[0].dtype == 'float64'
+
+    booleans, invalid = parse_quantity(pd.Series([True, False, True]))
+    assert booleans.tolist() == [1, 0, 1]
+    assert invalid == 0
+
+def test_treat_date_column():
+    """
+    Test the treat_date_column function.
+    It should parse each format, Excel serials and datetimes to UTC, and count the cells of each format and the invalid ones.
+    """
+    report = RunReport(trace_memory=False)
+    values = [
+        '01/01/2024 10:00:00', '01/01/2024 10:00:00', '02/01/2024 10:30', '03/01/2024',
+        45293.5, pd.Timestamp('2024-01-05 08:00:00'), 'abc', np.nan, ' ',
+    ]
+
+    result = treat_date_column(pd.DataFrame({'data': values}), 'data', report=report)
+
+    expected = pd.to_datetime([
+        '2024-01-01 13:00:00', '2024-01-01 13:00:00', '2024-01-02 13:30:00', '2024-01-03 03:00:00',
+        '2024-01-02 15:00:00', '2024-01-05 11:00:00', None, None, None,
+    ]).tz_localize('UTC')
+    pd.testing.assert_series_equal(result['data'], pd.Series(expected, name='data'))
+    assert report.details['invalid_dates'] == {'data': 1}
+    assert report.details['date_formats'] == {
+        '%d/%m/%Y %H:%M:%S': 2, '%d/%m/%Y %H:%M': 1, '%d/%m/%Y': 1, 'excel_serial': 1, 'datetime': 1,
+    }
+
+    dates = pd.Series(['01/01/2024 10:00:00', '31/12/2023 23:59:59', 'abc', None] * 3)
+    old = pd.to_datetime(dates, errors='coerce', format='%d/%m/%Y %H:%M:%S').dt.tz_localize('America/Sao_Paulo').dt.tz_convert('UTC')
+    result = treat_date_column(pd.DataFrame({'data': dates}), 'data', formats=['%d/%m/%Y %H:%M:%S'])
+    pd.testing.assert_series_equal(result['data'], old, check_names=False)
+
+def test_treat_date_column_with_timezone_aware_datetimes():
+    """
+    Test the treat_date_column function with datetimes that have a timezone, mixed with local ones.
+    It should keep the instant of the datetimes with a timezone instead of counting them as invalid.
+    """
+    report = RunReport(trace_memory=False)
+    values = [
+        pd.Timestamp('2024-01-01 12:00:00', tz='UTC'),
+        pd.Timestamp('2024-01-01 12:00:00', tz='Europe/Lisbon').to_pydatetime(),
+        pd.Timestamp('2024-01-01 09:00:00'),
+        '01/01/2024 09:30:00',
+    ]
+
+    result = treat_date_column(pd.DataFrame({'data': pd.Series(values, dtype=object)}), 'data', report=report)
+
+    expected = pd.to_datetime(['2024-01-01 12:00:00', '2024-01-01 12:00:00', '2024-01-01 12:00:00', '2024-01-01 12:30:00']).tz_localize('UTC')
+    pd.testing.assert_series_equal(result['data'], pd.Series(expected, name='data'))
+    assert report.details['invalid_dates'] == {'data': 0}
+    assert report.details['date_formats']['datetime'] == 3
+
+@pytest.mark.parametrize('columns', [
+    ['data', 'produto'],
+    ['quantidade', 'valor'],
+    ['quantidade'],
+    ['produto', 'quantidade', 'ativo'],
+    ['data'],
+    ['data_local'],
+])
+def test_add_hash_column_matches_generate_row_hash(columns):
+    """
+    Test the add_hash_column function.
+    It should generate the same hashes as applying generate_row_hash to each row.
+    """
+    dataset = pd.DataFrame({
+        'data': pd.to_datetime(['01/01/2024 10:00:00', None, '02/01/2024 00:00:00'], format='%d/%m/%Y %H:%M:%S')
+            .tz_localize('America/Sao_Paulo').tz_convert('UTC'),
+        'data_local': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03']),
+        'produto': ['Café', np.nan, 'chá'],
+        'quantidade': [1, 2, 3],
+        'valor': [1.5, np.nan, 1e16],
+        'ativo': [True, False, True],
+    })
+    expected = dataset[columns].apply(generate_row_hash, axis=1).tolist()
+
+    result = add_hash_column(dataset, columns, processes=0)
+
+    assert result['column_hash'].tolist() == expected
+
+def test_optimize_dtypes_keeps_hashes_and_records():
+    """
+    Test the optimize_dtypes function.
+    It should shrink the dataset and keep the same hashes and serialized records.
+    """
+    rows = 1000
+    dataset = pd.DataFrame({
+        'local': (['Loja A', 'Loja B', np.nan, 'Loja C'] * rows)[:rows],
+        'descricao': [f'item {i}' if i % 7 else np.nan for i in range(rows)],
+        'quantidade': np.arange(rows, dtype='int64'),
+        'valor': np.linspace(0, 1, rows),
+    })
+    columns = ['local', 'descricao', 'quantidade', 'valor']
+    expected = add_hash_column(dataset.copy(), columns, processes=0)
+
+    optimized = optimize_dtypes(dataset.copy())
+    assert isinstance(optimized['local'].dtype, pd.CategoricalDtype)
+    assert optimized['quantidade'].dtype == 'int16'
+    assert optimized['valor'].dtype == 'float64'
+    assert optimized.memory_usage(deep=True).sum() < dataset.memory_usage(deep=True).sum()
+
+    # Arrow strings need pyarrow, the missing values behave the same way with the python storage.
+    optimized['descricao'] = optimized['descricao'].astype('string')
+    result = add_hash_column(optimized, columns, processes=0)
+
+    assert result['column_hash'].tolist() == expected['column_hash'].tolist()
+    assert serialize_records(result) == serialize_records(expected)
+
+def test_add_hash_column_with_process_pool(monkeypatch):
+    """
+    Test the add_hash_column function with the process pool.
+    It should keep the order of the rows.
+    """
+    monkeypatch.setattr('etl_from_excel.treat_data.HASH_PARALLEL_MIN_ROWS', 1)
+    dataset = pd.DataFrame({'produto': [f'produto {i}' for i in range(50)], 'local': ['loja'] * 50})
+    expected = dataset[['produto', 'local']].apply(generate_row_hash, axis=1).tolist()
+
+    result = add_hash_column(dataset, ['produto', 'local'], processes=2)
+
+    assert result['column_hash'].tolist() == expected
@@ -0,0 +1,64 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from etl_from_excel.utils.serialize_records import serialize_records
+from etl_from_excel.utils.get_dataset_columns import get_dataset_columns_with_types
+from etl_from_excel.utils.prefetch import prefetch
+
+def test_serialize_records_returns_json_ready_values():
+    """
+    Test the serialize_records function.
+    It should convert missing values to None, datetimes to ISO strings in UTC and numpy scalars to native types.
+    """
+    dataset = pd.DataFrame({
+        'data': pd.to_datetime(['01/02/2024 10:00:00', None], format='%d/%m/%Y %H:%M:%S').tz_localize('America/Sao_Paulo'),
+        'quantidade': np.array([1, 2], dtype='int64'),
+        'valor': [1.5, np.nan],
+        'produto': pd.Categorical(['a', None]),
+    })
+
+    records = serialize_records(dataset)
+
+    assert records == [
+        {'fields': {'data': '2024-02-01T13:00:00.000000Z', 'quantidade': 1, 'valor': 1.5, 'produto': 'a'}},
+        {'fields': {'data': None, 'quantidade': 2, 'valor': None, 'produto': None}},
+    ]
+    assert type(records[0]['fields']['quantidade']) is int
+    json.dumps(records)
+
+def test_get_dataset_columns_with_types_downcast_numbers():
+    """
+    Test the get_dataset_columns_with_types function.
+    It should create number fields for downcast integer and float columns.
+    """
+    dataset = pd.DataFrame({
+        'quantidade': np.array([1, 2], dtype='int8'),
+        'valor': np.array([1.5, 2.5], dtype='float32'),
+    })
+
+    columns = get_dataset_columns_with_types(dataset)
+
+    assert columns == [
+        {'name': 'quantidade', 'type': 'number', 'options': {'precision': 0}},
+        {'name': 'valor', 'type': 'number', 'options': {'precision': 2}},
+    ]
+
+def test_prefetch_closes_source_when_consumer_raises():
+    """
+    Test the prefetch function when the consumer stops with an exception.
+    It should close the source generator before the exception reaches the caller.
+    """
+    closed = []
+
+    def produce():
+        try:
+            yield from range(10)
+        finally:
+            closed.append(True)
+
+    with pytest.raises(RuntimeError):
+        for item in prefetch(produce()):
+            if item == 2:
+                raise RuntimeError('erro no consumidor')
+    assert closed == [True]